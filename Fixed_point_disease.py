@@ -2,27 +2,95 @@
 定点把握疾患の定点あたりの報告数の階級区分図作成
 """
 
-import folium
-import csv, urllib.request
-import requests
-import webbrowser
+import numpy as np
+import argparse, logging, os, queue, threading, time, webbrowser
 from datetime import datetime, date, timedelta
 import tkinter as tk
 from tkcalendar import DateEntry
-from typing import Tuple       # 関数アノテーション用
+from typing import Callable, Optional, Tuple       # 関数アノテーション用
+from geo_cache import PREF_TOPO_URL, GeometryCache, default_cache
+import classify, geo_store, regions, teiten
+from classify import Scale
+from geo_store import GeometryStore
+from instrument import BROWSER, BUILD, GEOMETRY, SAVE, Instrument
+from renderers import FoliumRenderer
+from teiten_store import TeitenStore
+# folium(branca, jinja2)とrequestsは読み込みに時間がかかるので、使う時に読み込む(画面を早く表示するため)
+# 画面の表示後にwarm_up()でバックグラウンドで読み込んでおく
+
+logger = logging.getLogger(__name__)
+
+WARM_UP_DELAY = 300     # 画面の表示からモジュールの読み込みを始めるまでの時間(ミリ秒)
+
+TABLE_TTL = 600    # 直前に取得した週報データを再検証せずに使う時間(秒)
+
+def map_stem(names:list) -> str:
+    """
+    地図のファイル名(拡張子なし)
+    新型コロナとインフルエンザを並べたものは従来どおりCOV_flu_map、それ以外は感染症名をつなげたもの
+    Args:
+        list:   地図に並べる感染症名のリスト
+    Returns:
+        str:    ファイル名
+    """
+    if len(names) == 1: return f"{names[0]}map"
+    if len(names) == 2 and any(teiten.NAME_COVID in n for n in names) and any(teiten.NAME_FLU in n for n in names):
+        return "COV_flu_map"
+    return "_".join(names) + "_map"
+
+class Cancelled(Exception):
+    """
+    地図作成の中止(Mapping.check_cancelで発生させる)
+    """
 
 class Mapping():
     """
     地図作成
     """
-    def __init__(self, view:tk.Frame) -> None:
+    def __init__(self, view:tk.Frame, geo_cache:GeometryCache=default_cache, store:TeitenStore=None) -> None:
         """
         コンストラクタ：制御画面クラスを関連付ける
         Args:
-            Frame:  画面クラス(ビュー)
+            Frame:          画面クラス(ビュー)
+            GeometryCache:  地図データのキャッシュ
+            TeitenStore:    週報データの保存先(省略時はcacheフォルダ)
         """
         self.view = view    # 制御画面クラスのオブジェクト
+        self.geo_cache = geo_cache  # 地図データのキャッシュ(地図ごとにダウンロードしない)
+        self.store = store or TeitenStore()     # 週報データの保存先(確定した週は再取得しない)
+        self.lod_zoom = 8   # 地図データの詳細度(このズームレベルまで粗さが目立たないよう単純化したものを使う)
+        self.out_dir = "."          # HTMLファイルの出力先
+        self._tables = {}           # 直前に取得した週報データ((年, 週)をキーにした(取得時刻, データ))
+        self.renderer = FoliumRenderer()    # 地図の出力方法(一括作成ではfoliumを使わない方法に替える)
+        self._template = None       # 地図の雛形(地図データ, MapTemplate)
+        self.open_browser = True    # 作成したHTMLファイルをブラウザで表示するか
+        self.instrument = Instrument()  # 段階ごとの処理時間の記録(make_mapごとに集計をログに出力)
+        self.regions = False        # 都道府県ではなく地方(8地方区分)ごとの地図を作成するか
+        self.scheme = classify.EQUAL    # 階級区分の方法
+        self.classes = classify.MAX_CLASSES     # 階級区分の数の上限
+        self.thresholds = None      # 階級区分の境界(FIXEDの時)
+        self.scales = {}            # 感染症名をキーにした階級区分(一括作成で全ての週の区分を揃える時に設定)
+        self.cancel = None          # 中止の指示(make_mapの実行中だけ設定)
 
+    def get_table(self, today:date) -> teiten.TeitenTable:
+        """
+        定点把握疾患の週報データ(全感染症)を取得
+        Args:
+            date:   報告者数報告日
+        Returns:
+            TeitenTable:    週報データ(データがない週はNone)
+        """
+        year, week = teiten.year_week(today)
+        # 直前に取得した週(先読みしたものを含む)はそのまま使う
+        key = (year, week)
+        if key in self._tables and time.time() - self._tables[key][0] < TABLE_TTL:
+            self.instrument.count("table_hits")
+            return self._tables[key][1]
+        # 確定した週は保存したデータを使い、Webから取得しない
+        table = self.store.load(year, week, self.instrument)
+        if table is not None:
+            self._tables = {key: (time.time(), table)}
+        return table
 
     def get_csv_from_web(self, today:date) -> Tuple[list, list, str, str, str, str]:
         """
@@ -39,41 +107,61 @@ class Mapping():
         """
         msg =""
         # today = datetime(2023, 10, 16)
-        year = today.strftime('%Y')
-        week = today.strftime('%V')
-        # csvファイルのurl
-        _url = f'https://www.niid.go.jp/niid/images/idwr/sokuho/idwr-{year}/{year}{week}/{year}-{week}-teiten.csv'
-        # csvファイルの取得
-        with urllib.request.urlopen(_url) as res:
-            print(f'request url:{_url}')
-            print(f'return  url:{res.url}')
-            if res.url != _url:
-                msg = "指定した日付の週にデータがありません"
-                return None, None, None, None, None, msg
-            # ヘッダに対する処理
-            next(res)   # 1行目
-            title = next(res).decode('cp932').split(',')[0].replace('"', '')   # 2行目 報告期間
-            shippei = next(res).decode('cp932').split(',')  # 3行目 疾病
-            if len(shippei) > 37:   # 2023/5/8以前のデータはない
-                name_c = shippei[37].replace('"', '')            # 新型コロナ
-            else:
-                name_c = ""
-            name_i = shippei[1].replace('"', '')             # インフルエンザ
-            next(res)   # 4行目
-            next(res)   # 5行目
-            data = res.read()                       # 残りをすべて読む
-            data = data.decode('cp932')             # urlopenで読んだ場合はデコードが必要
-            data = data.splitlines()                # 行ごとに分ける
-        # 新型コロナのデータ作成(データがあるものだけ、報告がないと「-」が設定されるので弾く)
-        if len(shippei) > 37:   # 2023/5/8以前のデータはない
-            rows_c = [(row[0], float(row[38])) for row in csv.reader(data) if row[38] and row[38] != "-"]   # 都道府県とCOVID-19定当を取得
-        else:
-            rows_c = []
-        # インフルエンザのデータ作成(データがあるものだけ、報告がないと「-」が設定されるので弾く)
-        rows_i = [(row[0], float(row[2])) for row in csv.reader(data) if row[2] and row[2] != "-"]   # 都道府県とインフルエンザ定当を取得
-        return rows_c, rows_i, name_c, name_i, title, msg
+        table = self.get_table(today)
+        if table is None:
+            msg = "指定した日付の週にデータがありません"
+            return None, None, None, None, None, msg
+        # 2023/5/8以前は新型コロナのデータはない
+        name_c = table.find(teiten.NAME_COVID) or ""
+        name_i = table.find(teiten.NAME_FLU)
+        # 都道府県と定当を取得(報告がないと「-」が設定されるので弾く)
+        rows_c = table.rows(name_c or None)     # 新型コロナ
+        rows_i = table.rows(name_i)             # インフルエンザ
+        return rows_c, rows_i, name_c, name_i, table.title, msg
+
+    def get_geometry(self, zoom:Optional[int]=None) -> dict:
+        """
+        地図データ(詳細度を合わせたTopoJSON)をキャッシュから取得し、読み込み時間とキャッシュの利用回数を記録
+        regionsがTrueの時は都道府県をまとめた地方の形(都道府県と同じオブジェクト名とプロパティ)
+        Args:
+            int:    地図データの詳細度(Noneの時はlod_zoom)
+        Returns:
+            dict:   TopoJSONデータ(共有しているので変更しないこと)
+        """
+        cache = self.geo_cache
+        hits, misses, size = cache.hits, cache.misses, cache.bytes_downloaded
+        with self.instrument.stage(GEOMETRY):
+            topo_json_data = cache.get_lod(PREF_TOPO_URL, self.lod_zoom if zoom is None else zoom)
+            if self.regions:
+                topo_json_data = regions.region_topology(topo_json_data)
+        self.instrument.count("geometry_hits", cache.hits - hits)
+        self.instrument.count("geometry_misses", cache.misses - misses)
+        self.instrument.count("bytes_downloaded", cache.bytes_downloaded - size)
+        return topo_json_data
 
-    def Choropleth_map_topo(self, rows, s_name, title, max_value, out2html:bool=False) -> folium.Map:
+    def get_store(self, zoom:Optional[int]=None) -> GeometryStore:
+        """
+        get_geometryと同じ地図データの地域の形と地域名の索引(地方の形はファイルに保存せずメモリだけ)
+        Args:
+            int:    地図データの詳細度(Noneの時はlod_zoom)
+        Returns:
+            GeometryStore:  地域の形(読み取り専用)
+        """
+        if self.regions:
+            return geo_store.for_topology(self.get_geometry(zoom))
+        with self.instrument.stage(GEOMETRY):
+            return self.geo_cache.get_store(PREF_TOPO_URL, self.lod_zoom if zoom is None else zoom)
+
+    def warm_up(self) -> None:
+        """
+        地図作成で使うモジュールの読み込みと地図データの準備(最初の地図作成を速くするためバックグラウンドで実行)
+        """
+        import folium, folium.plugins, map_template    # 読み込むだけ
+        self.get_geometry()
+        self.get_store()
+
+    def Choropleth_map_topo(self, rows, s_name, title, max_value, out2html:bool=False
+                            , scale:Optional[Scale]=None) -> "folium.Map":
         """
         階級区分図の作成(TopoJSONを使用)
         Args:
@@ -82,40 +170,55 @@ class Mapping():
             str:    期間
             int:    報告数の最大値
             bool:   HTMLファイルへ出力するか
+            Scale:  階級区分(Noneの時は報告数の最大値から作成)
         Returns:
             Map:    作成した地図のMapオブジェクト
         """
+        # TopoJSON の利用(キャッシュから取得、共有しているので変更しないこと)
+        topo_json_data = self.get_geometry()  # 全国都道府県
+        store = self.get_store()
+        with self.instrument.stage(BUILD):
+            scale = scale or self.scale_for(s_name, [v for _, v in rows], max_value)
+            map = self._build_topo(topo_json_data, store, rows, s_name, title, scale)
+
+        # ブログ埋め込み用iframeの作成 作成したテキストを埋め込めば地図が表示される(色分けされなかった)
+        # iframe = map._repr_html_()
+        # with open("ifram.txt", "w", encoding='utf-8') as f:
+        #     f.write(iframe)
+
+        # map.show_in_browser()               # こちらなら表示できるけど添付ファイルが残る
+
+        if out2html:
+            self.save_html(map, f"{s_name}map.html")
+        return map
+
+    def _build_topo(self, topo_json_data:dict, store:GeometryStore, rows:list, s_name:str, title:str
+                    , scale:Scale) -> "folium.Map":
+        """
+        階級区分図のMapオブジェクトの作成(Choropleth_map_topoの地図作成部分)
+        foliumのTopoJsonは描画時にpropertiesを書き換えるので、どちらのレイヤーにも新しいpropertiesを重ねたものを渡す
+        """
+        import folium
+
         # Mapオブジェクトの作成(日本地図全体が表示されるような位置と倍率を指定)
         map = folium.Map(location=[39.00, 137.00], tiles='Cartodb Positron', zoom_start=6)
 
-        # TopoJSON の利用
-        _url = "https://raw.githubusercontent.com/smartnews-smri/japan-topography/main/data/municipality/topojson/s0010/prefectures.json"  # 全国都道府県 
-        topo_json_data = requests.get(_url).json()
-
         # MapオブジェクトにTopoJSONデータを追加
-        folium.TopoJson(topo_json_data, "objects.prefectures").add_to(map)
+        folium.TopoJson(store.join(topo_json_data, {}), "objects.prefectures").add_to(map)
 
         # Choroplethの作成
-        cp = folium.Choropleth(geo_data=topo_json_data
+        # TopoJSONの地域データに定当データを追加(ツールチップに表示するため)
+        cp = folium.Choropleth(geo_data=store.join(topo_json_data, dict(rows), "teito")
                                 , topojson='objects.prefectures'  # GeoJSONへ変換するデータの位置
                                 , data=rows                            # 地域区分するデータ
                                 , key_on='properties.N03_001'           # 地域を特定するキー
-                                , bins=range(0, int(max_value + 2), 1)  # カラーマップ
-                                , fill_color='PuRd'                     # カラーマップの色
+                                , bins=scale.bins                       # 階級区分の境界
+                                , fill_color='PuRd'                     # カラーマップの色(Scaleと同じ色)
                                 , fill_opacity=0.3                      # 透明度
                                 , line_weight=2,                        # 境界線の幅
                                 )
         cp.add_to(map)          # Mapオブジェクトに追加
 
-        # TopoJSONの地域データに定当データを追加(ツールチップに表示するため)
-        # TopoJSONのgeometriesに都道府県のデータがあるのでそこのpropertisに要素追加
-        teito = dict(rows)  # リストを辞書化
-        for d in topo_json_data["objects"]["prefectures"]["geometries"]:
-            # "properties"の辞書に定当のキーと値を追加(都道府県名をキーにして定当を取得)
-            try:    # 都道府県で回しているのでデータがないことがある
-                d["properties"]["teito"] = teito[d["properties"]["N03_001"]]
-            except KeyError:
-                pass    # 定当のデータがない場合追加しない
         # ツールチップの追加
         folium.GeoJsonTooltip(['N03_001', 'teito'], ['地域', '人数']).add_to(cp.geojson)
         # カラーマップの幅を指定(地図を並べて表示した時に長くなるため)
@@ -127,18 +230,95 @@ class Mapping():
                 <h6 align="right";">{title}</h6>
                 '''
         map.get_root().html.add_child(folium.Element(title_html))
+        return map
 
-        # ブログ埋め込み用iframeの作成 作成したテキストを埋め込めば地図が表示される(色分けされなかった)
-        # iframe = map._repr_html_()
-        # with open("ifram.txt", "w", encoding='utf-8') as f:
-        #     f.write(iframe)
+    def Choropleth_map_template(self, rows:list, s_name:str, title:str, max_value:float, fname:str
+                                , scale:Optional[Scale]=None) -> str:
+        """
+        階級区分図の作成(雛形に値と色を差し込んでHTMLファイルに保存、foliumの要素は作らない)
+        Args:
+            list:   報告数データ(都道府県と報告数のタプルのリスト)
+            str:    感染症名
+            str:    期間
+            float:  報告数の最大値
+            str:    ファイル名(out_dirに作成)
+            Scale:  階級区分(Noneの時は報告数の最大値から作成)
+        Returns:
+            str:    保存したファイルのパス
+        """
+        from map_template import MapTemplate
 
-        # map.show_in_browser()               # こちらなら表示できるけど添付ファイルが残る
+        topo_json_data = self.get_geometry()
+        with self.instrument.stage(BUILD):
+            # 雛形は地図データが変わった時だけ作り直す
+            if self._template is None or self._template[0] is not topo_json_data:
+                self._template = (topo_json_data, MapTemplate(topo_json_data))
+            scale = scale or self.scale_for(s_name, [v for _, v in rows], max_value)
+            colors, legend = scale.table(rows), scale.legend()
+            # タイトル
+            title_html = f'''
+                    <h3 align="center" style="font-size:20px"><b>{s_name}定点当たり報告数</b></h3>
+                    <h6 align="right";">{title}</h6>
+                    '''
+        with self.instrument.stage(SAVE):
+            path = self._template[1].save(os.path.join(self.out_dir, fname), colors, legend, s_name, title_html)
+        self.show(path)
+        return path
 
+    def Choropleth_time_slider(self, tables:list, s_name:str, max_value:Optional[float], out2html:bool=False) -> "folium.Map":
+        """
+        週ごとの階級区分図をスライダーで切り替える地図の作成
+        地図データ(単純化・量子化したTopoJSON)は1つだけ埋め込み、週ごとには地域の値と区分の番号だけを持たせる
+        Args:
+            list:   週報データ(TeitenTable)のリスト(週の順)
+            str:    感染症名(含まれる文字列)
+            float:  報告数の最大値(Noneの時は全ての週の最大値)
+            bool:   HTMLファイルへ出力するか
+        Returns:
+            Map:    作成した地図のMapオブジェクト
+        """
+        topo_json_data = self.get_geometry()
+        store = self.get_store()
+        with self.instrument.stage(BUILD):
+            map = self._build_time_slider(topo_json_data, store, tables, s_name, max_value)
         if out2html:
-            fname = f"{s_name}map.html"
-            map.save(fname)
-            webbrowser.open(fname)   # 開くのが早すぎで出てこない
+            name = tables[-1].find(s_name) or s_name
+            self.save_html(map, f"{name}_weekly_map{'_region' if self.regions else ''}.html")
+        return map
+
+    def _build_time_slider(self, topo_json_data:dict, store:GeometryStore, tables:list, s_name:str
+                            , max_value:Optional[float]) -> "folium.Map":
+        """
+        スライダーで切り替える地図のMapオブジェクトの作成(Choropleth_time_sliderの地図作成部分)
+        """
+        import folium
+        from map_elements import SharedTopoJson, SharedTimeSlider
+
+        map = folium.Map(location=[39.00, 137.00], tiles='Cartodb Positron', zoom_start=6)
+        # 週×地域の値(地方の時は地方ごとに集計)
+        if self.regions:
+            names, values = regions.REGION_NAMES, regions.RegionSeries(tables, s_name).region_teito()
+        else:
+            names = [n for n in store.names if n]
+            values = teiten.week_matrix(tables, s_name, names)
+        # 全ての週で同じ階級区分を使い、週×地域の配列をまとめて区分の番号にする
+        name = next((t.find(s_name) for t in reversed(tables) if t.find(s_name)), s_name)
+        scale = self.scale_for(name, values, max_value)
+        index = scale.classify(values)
+        rounded = np.round(values, 2)
+        values = [[None if np.isnan(v) else float(v) for v in row] for row in rounded]
+        shared = SharedTopoJson(topo_json_data)
+        map.get_root().add_child(shared)
+        SharedTimeSlider(shared, store.object_name, names, [t.title for t in tables], values
+                        , index.tolist(), scale.colors, store.key).add_to(map)
+        scale.colormap(f"{name}定点当たり報告数").add_to(map)
+
+        # タイトルを追加
+        title_html = f'''
+                <h3 align="center" style="font-size:20px"><b>{name}定点当たり報告数</b></h3>
+                <h6 align="right";">{tables[0].title} ～ {tables[-1].title}</h6>
+                '''
+        map.get_root().html.add_child(folium.Element(title_html))
         return map
 
     def tow_choropleth(self, rows_c, rows_i, name_c, name_i, title, max_c, max_i):
@@ -153,37 +333,140 @@ class Mapping():
             int:    新型コロナ報告数の最大値
             int:    インフルエンザ報告数の最大値
         """
-        # Figureオブジェクトの作成(ここに2つの地図を追加する)
-        f = folium.Figure()
+        panels = []
         if rows_c:  # コロナのデータがある時だけ作成
-            # コロナ用階級区分図の作成
-            sb1 = f.add_subplot(1, 2, 1)    # 1行2列の1番目のdivチャイルドをFigureオブジェクトに追加
-            m1 = self.Choropleth_map_topo(rows_c, name_c, title, max_c)    # 地図作成
-            # m1.save("COVID-19_map.html")
-            sb1.add_child(m1)   # divチャイルドに地図を追加(add_child タイトルより先じゃないとタイトルが出ない)
+            panels.append((rows_c, name_c, self.scale_for(name_c, [v for _, v in rows_c], max_c)))
+        panels.append((rows_i, name_i, self.scale_for(name_i, [v for _, v in rows_i], max_i)))
+        self.multi_choropleth(panels, title, f"{map_stem([p[1] for p in panels])}.html")
+
+    def multi_choropleth(self, panels:list, title:str, fname:str, out2html:bool=True) -> "folium.Figure":
+        """
+        地図を複数並べて表示(地図データはページに1つだけ埋め込み、地図ごとには値と色だけを持たせる)
+        Args:
+            list:   地図ごとの(報告数データ, 感染症名, 階級区分)のリスト
+            str:    期間
+            str:    出力するHTMLファイル名
+            bool:   HTMLファイルへ出力するか
+        Returns:
+            Figure: 作成したFigureオブジェクト
+        """
+        topo_json_data = self.get_geometry()
+        with self.instrument.stage(BUILD):
+            f = self._build_multi(topo_json_data, panels, title)
+        if out2html:
+            self.save_html(f, fname)
+        return f
+
+    def _build_multi(self, topo_json_data:dict, panels:list, title:str) -> "folium.Figure":
+        """
+        地図を並べたFigureオブジェクトの作成(multi_choroplethの地図作成部分)
+        """
+        import folium
+        from map_elements import SharedTopoJson, SharedChoropleth
+
+        # Figureオブジェクトの作成(ここに地図を追加する)
+        f = folium.Figure()
+        # 地図データはFigureに1つだけ追加
+        shared = SharedTopoJson(topo_json_data)
+        f.add_child(shared)
+        for i, (rows, s_name, scale) in enumerate(panels):
+            self.check_cancel()
+            sb = f.add_subplot(1, len(panels), i + 1)   # 1行n列のi番目のdivチャイルドをFigureオブジェクトに追加
+            map = folium.Map(location=[39.00, 137.00], tiles='Cartodb Positron', zoom_start=6)
+            sb.add_child(map)   # divチャイルドに地図を追加(add_child タイトルより先じゃないとタイトルが出ない)
+            # 階級区分図(値と色だけ)の作成
+            SharedChoropleth(shared, "prefectures", scale.table(rows)).add_to(map)
+            # 凡例
+            legend = scale.colormap(s_name)
+            legend.width = 200      # カラーマップの幅を指定(地図を並べて表示した時に長くなるため)
+            map.add_child(legend)
             # タイトルを追加
             title_html = f'''
-                    <h3 align="center" style="font-size:20px"><b>{name_c}定点当たり報告数</b></h3>
+                    <h3 align="center" style="font-size:20px"><b>{s_name}定点当たり報告数</b></h3>
                     <h6 align="right";">{title}</h6>
                     '''
-            m1.get_root().html.add_child(folium.Element(title_html))
-        # インフルエンザ用階級区分図の作成
-        sb2 = f.add_subplot(1, 2, 2)    # 1行2列の2番目のdivチャイルドをFigureオブジェクトに追加
-        m2 = self.Choropleth_map_topo(rows_i, name_i, title, max_i)    # 地図作成
-        # m2.save("flu_map.html")
-        sb2.add_child(m2)   # divチャイルドに地図を追加(add_child タイトルより先じゃないとタイトルが出ない)
-        # タイトルを追加
-        title_html = f'''
-                <h3 align="center" style="font-size:20px"><b>{name_i}定点当たり報告数</b></h3>
-                <h6 align="right";">{title}</h6>
-                '''
-        m2.get_root().html.add_child(folium.Element(title_html))
+            map.get_root().html.add_child(folium.Element(title_html))
+        return f
 
-        # 地図htmlをファイルに保存
-        fname = "COV_flu_map.html"
-        f.save(fname)
+    def save_html(self, map, fname:str) -> str:
+        """
+        地図htmlをファイルに保存してブラウザで表示
+        Args:
+            Map:    MapかFigureオブジェクト
+            str:    ファイル名(out_dirに作成)
+        Returns:
+            str:    保存したファイルのパス
+        """
+        path = os.path.join(self.out_dir, fname)
+        tmp = f"{path}.{os.getpid()}.tmp"  # 一時ファイルに書いてから置き換える(作成途中のファイルを残さない)
+        with self.instrument.stage(SAVE):
+            map.save(tmp)
+            os.replace(tmp, path)
         # HTMLファイルをブラウザで表示
-        webbrowser.open(fname)   # 開くのが早すぎで出てこないことがある
+        self.show(path)
+        return path
+
+    def check_cancel(self) -> None:
+        """
+        中止の指示があればCancelledを発生させる(地図ごとと保存の後に確認する)
+        """
+        if self.cancel is not None and self.cancel.is_set():
+            raise Cancelled()
+
+    def show(self, path:str) -> None:
+        """
+        HTMLファイルをブラウザで表示(open_browserがFalseの時は何もしない)
+        どの出力方法も保存した後に呼ぶので、ここで中止を確認する(中止した地図は表示しない)
+        Args:
+            str:    ファイルのパス
+        """
+        self.check_cancel()
+        if self.open_browser:
+            with self.instrument.stage(BROWSER):
+                webbrowser.open(path)   # 開くのが早すぎで出てこないことがある
+
+    def scale_for(self, name:str, values, max_value:Optional[float]=None) -> Scale:
+        """
+        感染症の階級区分(scalesにあればそれを使い、なければ値から作成)
+        Args:
+            str:        感染症名
+            ndarray:    報告数(週×都道府県などの配列)
+            float:      最後の区分に入れる最小の最大値(Noneの時はデータの最大値)
+        Returns:
+            Scale:  区分と色の表
+        """
+        scale = self.scales.get(name)
+        if scale is None:
+            scale = classify.fit(values, self.scheme, self.classes, max_value, self.thresholds, name)
+        return scale
+
+    def create_maps(self, table:teiten.TeitenTable, keywords:list, fix_max:Optional[float]=None) -> list:
+        """
+        感染症ごとの地図作成(画面を使わない)
+        感染症が複数の時は地図を並べたHTMLファイル、1つの時はその感染症の地図のHTMLファイルを作成
+        Args:
+            TeitenTable:    週報データ
+            list:           感染症名(含まれる文字列)のリスト
+            float:          最大値を固定にする場合の最小の最大値(Noneの時はデータ依存)
+        Returns:
+            list:           作成したファイルのパスのリスト
+        """
+        found = []
+        for keyword in keywords:
+            self.check_cancel()
+            name = table.find(keyword)
+            rows = regions.region_rows(table, name) if self.regions else table.rows(name)
+            if not rows: continue   # 2023/5/8以前は新型コロナのデータはない
+            found.append((rows, name, np.array([x[1] for x in rows])))
+        if not found: return []
+        # 最大値を固定にする場合は全ての地図で同じ最大値
+        max_value = max([fix_max] + [v.max() for _, _, v in found]) if fix_max is not None else None
+        panels = [(rows, name, self.scale_for(name, values, max_value)) for rows, name, values in found]
+        # 地図に並べた感染症でファイルを分ける(選んだ感染症が違う地図は上書きしない)
+        stem = map_stem([name for _, name, _ in panels])
+        if self.regions: stem += "_region"
+        self.check_cancel()
+        return [self.renderer.render(self, panels, table.title, stem)]
 
     def create_map(self, today:date) -> str:
         """
@@ -193,27 +476,131 @@ class Mapping():
         Returns:
             str:    実行結果のメッセージ
         """
-        rows_c, rows_i, name_c, name_i, title, msg = self.get_csv_from_web(today)
-        # エラーがあったら戻る
-        if msg: return msg
+        return self.make_map(today, *self.view.get_options())
+
+    def make_map(self, today:date, keywords:list, fix_max:Optional[float]
+                , progress:Optional[Callable[[str], None]]=None
+                , cancel:Optional[threading.Event]=None) -> str:
+        """
+        地図作成(画面の値を使わないのでバックグラウンドで実行できる)
+        Args:
+            date:       報告者数報告日
+            list:       感染症名(含まれる文字列)のリスト
+            float:      最大値を固定にする場合の最小の最大値(Noneの時はデータ依存)
+            Callable:   進捗メッセージを受け取る関数
+            Event:      中止の指示(地図ごとと保存の後に確認する)
+        Returns:
+            str:        実行結果のメッセージ
+        """
         # 感染症にチェックが無かったら戻る
-        if self.view.var_col.get() == False and self.view.var_flu.get() == False:
+        if not keywords:
             return "感染症の両方か、どちらかにチェックを付けてください"
-        # 定当の最大値
-        max_c = max([x[1] for x in rows_c], default=0)
-        max_i = max([x[1] for x in rows_i])
-        # 最大値を固定にする場合
-        if self.view.var_fix_max.get(): max_c = max_i = max(40, max_c, max_i)
-        # どの感染症を対象にするかで出す地図を分ける
-        if self.view.var_col.get() and self.view.var_flu.get(): # 新型コロナとインフルエンザ
-            self.tow_choropleth(rows_c, rows_i, name_c, name_i, title, max_c, max_i)
-        elif self.view.var_col.get():                           # 新型コロナ
-            self.Choropleth_map_topo(rows_c, name_c, title, max_c, True)
-        elif self.view.var_flu.get():                           # インフルエンザ
-            self.Choropleth_map_topo(rows_i, name_i, title, max_i, True)
-        print('finished')
+        self.cancel = cancel
+        try:
+            # 段階ごとの処理時間を記録し、終わったらログに出力
+            with self.instrument.run(f"make_map {today}"):
+                if progress: progress("週報データを取得しています")
+                table = self.get_table(today)
+                # エラーがあったら戻る
+                if table is None: return "指定した日付の週にデータがありません"
+                self.check_cancel()
+                if progress: progress("地図を作成しています")
+                files = self.create_maps(table, keywords, fix_max)
+        except Cancelled:
+            return "中止しました"
+        finally:
+            self.cancel = None
+        # 選んだ感染症のデータがない(2023/5/8以前の新型コロナだけなど)
+        if not files: return "選んだ感染症のデータがないので地図を作成できませんでした"
+        logger.info('finished')
         return "地図をブラウザに表示しました"
 
+class MapWorker():
+    """
+    地図作成をバックグラウンドのスレッドで実行
+    画面へのメッセージはキューで渡す(画面側でafter()を使って取り出す)
+    """
+    def __init__(self, ctrl:Mapping) -> None:
+        """
+        コンストラクタ：スレッドを開始
+        Args:
+            Mapping:    コントロールオブジェクト(地図作成オブジェクト)
+        """
+        self.ctrl = ctrl
+        self.messages = queue.Queue()   # 画面へのメッセージ
+        self._cond = threading.Condition()
+        self._request = None            # 次に実行する地図作成の依頼(最新の1件だけ残す)
+        self._running = None            # 実行中の地図作成の依頼
+        self._prefetch = None           # 先読みする日付
+        self._cancel = threading.Event()
+        self._warm = False              # モジュールの読み込みと地図データの準備が済んだか
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, request:tuple) -> bool:
+        """
+        地図作成の依頼(実行中と同じ依頼は無視し、未実行の依頼は新しいものに置き換える)
+        中止した依頼は終わるまで実行中のままなので、同じ依頼でも受け付ける
+        Args:
+            tuple:  (日付, 感染症名のリスト, 最大値)
+        Returns:
+            bool:   受け付けた時はTrue
+        """
+        with self._cond:
+            if request == self._running and not self._cancel.is_set(): return False
+            self._request = request
+            self._cond.notify()
+        return True
+
+    def prefetch(self, today:date) -> None:
+        """
+        週報データの先読みの依頼(地図作成の依頼がない時に実行)
+        Args:
+            date:   日付
+        """
+        with self._cond:
+            self._prefetch = today
+            self._cond.notify()
+
+    def cancel(self) -> None:
+        """
+        実行中と未実行の地図作成を中止
+        """
+        with self._cond:
+            self._request = None
+            if self._running: self._cancel.set()
+
+    def _run(self) -> None:
+        """
+        スレッドの処理：依頼を待って実行
+        """
+        while True:
+            with self._cond:
+                while self._request is None and self._prefetch is None:
+                    self._cond.wait()
+                if self._request is not None:
+                    request, self._request = self._request, None
+                    self._running = request
+                    self._cancel.clear()
+                else:
+                    request, today, self._prefetch = None, self._prefetch, None
+            if request is None:     # 先読み(エラーは地図作成の時に表示する)
+                try:
+                    with self.ctrl.instrument.run(f"prefetch {today}", profile=False):
+                        if not self._warm:
+                            self._warm = True
+                            self.ctrl.warm_up()
+                        self.ctrl.get_table(today)
+                except Exception:
+                    pass
+                continue
+            try:
+                msg = self.ctrl.make_map(*request, progress=self.messages.put, cancel=self._cancel)
+            except Exception as e:
+                msg = f"エラーが発生しました:{e}"
+            with self._cond:
+                self._running = None
+            self.messages.put(msg)
+
 class MyFrame(tk.Frame):
     """
     操作画面クラス
@@ -229,10 +616,14 @@ class MyFrame(tk.Frame):
         # カレンダー    最新データは今日の16に前の週からなのでカレンダーの初期値とする
         latest_date = date.today() - timedelta(days=16)
         self.tkcal = DateEntry(self, year=latest_date.year, month=latest_date.month, day=latest_date.day, date_pattern='y/m/d', locale='ja_JP')
+        self.tkcal.bind("<<DateEntrySelected>>", self.date_selected)   # 日付を選んだら週報データを先読み
         self.tkcal.pack()
         # 作成ボタン
         btn_exe = tk.Button(self, text='地図作成', command=self.map_btn_clicked)
         btn_exe.pack()
+        # 中止ボタン
+        btn_cancel = tk.Button(self, text='中止', command=self.cancel_btn_clicked)
+        btn_cancel.pack()
         # チェックボックス(最大値)
         self.var_fix_max = tk.BooleanVar(self, True)
         chb_fix_max = tk.Checkbutton(self, variable=self.var_fix_max, text="最大値を40に固定(オフはデータ依存)")
@@ -257,16 +648,57 @@ class MyFrame(tk.Frame):
             Mapping:    コントロールオブジェクト(地図作成オブジェクト)
         """
         self.ctrl = ctrl
-    
+        # 保存している最新の週(watcher.pyで取得したものなど)が初期値より新しければその週を表示
+        latest = ctrl.store.latest_week()
+        if latest:
+            monday = date.fromisocalendar(int(latest[0]), int(latest[1]), 1)
+            if monday > self.tkcal.get_date(): self.tkcal.set_date(monday)
+        self.worker = MapWorker(ctrl)   # 地図作成はバックグラウンドで実行
+        # 先読み(モジュールの読み込みを含む)は画面が表示されてから始める
+        self.after(WARM_UP_DELAY, lambda: self.worker.prefetch(self.tkcal.get_date()))
+        self.poll_worker()
+
+    def get_options(self) -> tuple:
+        """
+        画面で指定した地図作成の条件
+        Returns:
+            list:   感染症名(含まれる文字列)のリスト
+            float:  最大値を固定にする場合の最小の最大値(固定しない時はNone)
+        """
+        keywords = []
+        if self.var_col.get(): keywords.append(teiten.NAME_COVID)    # 新型コロナ
+        if self.var_flu.get(): keywords.append(teiten.NAME_FLU)      # インフルエンザ
+        # 最大値を固定にする場合は40
+        return keywords, 40 if self.var_fix_max.get() else None
+
     def map_btn_clicked(self):
         """
-        地図作成(カレンダーから日付を取得して地図を作成)
+        地図作成(カレンダーから日付を取得して地図を作成、連打しても同じ条件の地図は1回だけ作成)
         """
-        self.var_msg.set("")
-        self.update_idletasks()
         today = self.tkcal.get_date()
-        msg = self.ctrl.create_map(today)
-        self.var_msg.set(msg)
+        keywords, fix_max = self.get_options()
+        if self.worker.submit((today, keywords, fix_max)):
+            self.var_msg.set("")
+
+    def cancel_btn_clicked(self):
+        """
+        地図作成の中止
+        """
+        self.worker.cancel()
+
+    def date_selected(self, event=None):
+        """
+        日付を選んだ時に週報データを先読み
+        """
+        self.worker.prefetch(self.tkcal.get_date())
+
+    def poll_worker(self):
+        """
+        バックグラウンドからのメッセージを表示(定期的に呼び出す)
+        """
+        while not self.worker.messages.empty():
+            self.var_msg.set(self.worker.messages.get_nowait())
+        self.after(100, self.poll_worker)
 
 class App(tk.Tk):
     """
@@ -283,9 +715,17 @@ class App(tk.Tk):
         self.title("定点把握疾患")              # タイトル
         my_frame = MyFrame(self)                    # MyFrameクラス(V)のインスタンス作成
         my_frame.pack()
-        ctr = Mapping(my_frame)         # 制御クラス(C)のインスタンス作成
-        my_frame.set_control(ctr)       # MyFrameクラスに制御クラスを関連付ける
+        self.ctrl = Mapping(my_frame)   # 制御クラス(C)のインスタンス作成
+        my_frame.set_control(self.ctrl) # MyFrameクラスに制御クラスを関連付ける
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="定点把握疾患の定点あたりの報告数の階級区分図作成")
+    parser.add_argument("--profile", nargs="?", const="", metavar="PATH"
+                        , help="最初の地図作成をcProfileで計測(PATHを指定した時は結果を保存、省略時はログに出力)")
+    parser.add_argument("--profile-memory", action="store_true", help="--profileの時にメモリ使用量も計測")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     app = App()
+    if args.profile is not None:
+        app.ctrl.instrument.capture_next(args.profile or None, args.profile_memory)
     app.mainloop()
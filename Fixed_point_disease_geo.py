@@ -1,75 +1,129 @@
 """
 GeoPandas test
+定点把握疾患の定点あたりの報告数の階級区分図(静止画)作成
 """
-import geopandas as gpd
-import matplotlib.pyplot as plt
-import pandas as pd
+import functools, os
+import numpy as np
 from datetime import date, timedelta
+from typing import Dict, List, Optional       # 関数アノテーション用
+import classify, teiten
+from classify import Scale
+from geo_cache import PREF_TOPO_URL, GeometryCache, default_cache
+from teiten_store import TeitenStore
+# geopandas, pandas, matplotlibは読み込みに時間がかかるので、静止画を作成する時に読み込む
 
-plt.rcParams['font.family'] = 'Meiryo'
-plt.show()
+# 日本語の表示に使うフォント(Windowsはメイリオ、ないものは飛ばして次を使う)
+FONT_FAMILY = ["Meiryo", "Yu Gothic", "Hiragino Sans", "Noto Sans CJK JP", "IPAexGothic", "sans-serif"]
 
-# 地図データ取得
-url1 = "https://raw.githubusercontent.com/smartnews-smri/japan-topography/main/data/municipality/geojson/s0010/prefectures.json"  # 全国都道府県 
-gdf = gpd.read_file(url1)
-# gdf.plot()
+@functools.lru_cache(maxsize=1)
+def font_family() -> tuple:
+    """
+    FONT_FAMILYのうちインストールされているもの(ないフォントを指定すると文字を描くたびに警告が出るため)
+    """
+    from matplotlib import font_manager
+    installed = {f.name for f in font_manager.fontManager.ttflist}
+    return tuple(f for f in FONT_FAMILY if f in installed or f == "sans-serif")
 
-# 色分けデータ取得
-today = date.today() - timedelta(days=16)
-year = today.strftime('%Y')
-week = today.strftime('%V')
-url2 = f"https://www.niid.go.jp/niid/images/idwr/sokuho/idwr-{year}/{year}{week}/{year}-{week}-teiten.csv"
-print(f"日付：{today.strftime('%Y/%m/%d')}、週：{week}")
+_base = {}  # 地図データ(URLとズームレベルをキーにした(GeoJSON, GeoDataFrame, ラベル位置))
 
-# 色分け用データ作成
-# case 1    1回の読み込みで見出しまで作る
-# import numpy as np
-# try:
-#         df = pd.read_csv(url2, encoding='cp932', skiprows=[4], header=[2, 3])
-#         lvl0 = np.where(df.columns.levels[0].str.contains('Unnamed'), '', df.columns.levels[0])
-#         a = [x for x in df.columns.levels[0] if not 'Unnamed' in x]
-#         i = pd.Index(a).repeat(2)
-#         # マルチインデックスの更新方法を検討したが断念
-# except:
-#         print('感染症データがない日付を指定されました')
-# #         exit()
+def get_base(geo_cache:GeometryCache=default_cache, zoom:Optional[int]=None) -> tuple:
+    """
+    地図データとラベル位置の取得(地図データが変わらない間は1回だけ作成)
+    Args:
+        GeometryCache:  地図データのキャッシュ
+        int:            地図データの詳細度(Noneの時は元のデータ)
+    Returns:
+        GeoDataFrame:   地図データ
+        ndarray:        都道府県ごとのラベル位置(x, y)
+    """
+    import geopandas as gpd
+    geo_json_data = geo_cache.get_geojson(PREF_TOPO_URL, "prefectures", zoom)
+    key = (PREF_TOPO_URL, zoom)
+    if key not in _base or _base[key][0] is not geo_json_data:     # 地図データが更新された
+        gdf = gpd.GeoDataFrame.from_features(geo_json_data["features"], crs="EPSG:4326")
+        # ラベル位置(重心は地域の外になることがあるので地域内の点を使う)
+        points = gdf.geometry.representative_point()
+        _base[key] = (geo_json_data, gdf, np.column_stack([points.x, points.y]))
+    return _base[key][1], _base[key][2]
 
-# case 2    ヘッダーとデータを分けて作る
-# データ部分の作成
-try:
-    df = pd.read_csv(url2, encoding='cp932', skiprows=5, header=None)  # ヘッダー部分を読まない
-except:
-    print('感染症データがない日付を指定されました')
-    exit()
+def merge_table(gdf:"gpd.GeoDataFrame", table:teiten.TeitenTable) -> "gpd.GeoDataFrame":
+    """
+    週報データ(全感染症の定当)を都道府県名をキーにして地図データにマージ
+    Args:
+        GeoDataFrame:   地図データ
+        TeitenTable:    週報データ
+    Returns:
+        GeoDataFrame:   感染症名を列名にした定当を追加した地図データ
+    """
+    import pandas as pd
+    df = pd.DataFrame(table.teito, index=table.prefs, columns=table.diseases)
+    return gdf.join(df, on='N03_001')
 
-df = df.dropna(how='all')   # すべての列がNAの行を削除
-# ヘッダー部分の作成(ヘッダー部分をデータとして読み込む(2行スキップして2行だけ読む))
-cdf = pd.read_csv(url2, encoding='cp932', skiprows=2, nrows=2, header=None)
-cdf = cdf.ffill(axis=1)     # 感染症名が左のカラムにしかないので右にコピー
-cdf = cdf.fillna('N03_001') # 先頭にNAが残るのでN03_001を設定
-df.columns = pd.MultiIndex.from_frame(cdf.T)    # カラム名にするためマルチインデックス化(データは行列を入れ替えて読む)
-s1df = df.drop(columns='報告', level=1)         # マルチインデックスのレベル1が「報告」の列を削除
-s1df.columns = s1df.columns.droplevel(1)        # マルチインデックスのレベル1を削除、シングル化
+def render_report(table:teiten.TeitenTable, keywords:List[str], path:str, vmax:Optional[float]=40
+                , geo_cache:GeometryCache=default_cache, zoom:Optional[int]=8
+                , scales:Optional[Dict[str, Scale]]=None) -> str:
+    """
+    感染症ごとの地図を並べた静止画を作成(HTMLの地図と同じ階級区分と色で塗り分ける)
+    Args:
+        TeitenTable:    週報データ
+        list:           感染症名(含まれる文字列)のリスト
+        str:            保存するファイル(拡張子で形式を決める)
+        float:          最後の区分に入れる最小の最大値(Noneの時はデータの最大値)
+        GeometryCache:  地図データのキャッシュ
+        int:            地図データの詳細度
+        dict:           感染症名をキーにした階級区分(ない感染症はその週の値から作成)
+    Returns:
+        str:            保存したファイルのパス
+    """
+    import matplotlib
+    from matplotlib.colors import BoundaryNorm, ListedColormap
+    from matplotlib.figure import Figure
+    gdf, labels = get_base(geo_cache, zoom)
+    mdf = merge_table(gdf, table)
+    names = [name for name in (table.find(keyword) for keyword in keywords) if name]
+    # フォントはrcParamsを書き換えずにこの図だけに設定する(呼び出し側の設定に影響しない)
+    with matplotlib.rc_context({"font.family": list(font_family())}):
+        # pyplotを使わないので複数のスレッドやプロセスで同時に作成できる
+        fig = Figure(figsize=(6 * max(len(names), 1), 6))
+        axes = fig.subplots(1, max(len(names), 1), squeeze=False)[0]
+        for ax, name in zip(axes, names):
+            values = mdf[name].to_numpy()
+            scale = (scales or {}).get(name) or classify.fit(values, vmax=vmax, name=name)
+            # 区分の境界で色を分ける(境界の外の値は最初と最後の区分の色、Scale.classifyと同じ)
+            cmap = ListedColormap(scale.colors)
+            cmap.set_under(scale.colors[0])
+            cmap.set_over(scale.colors[-1])
+            norm = BoundaryNorm(scale.bins, len(scale.colors))
+            mdf.plot(ax=ax, column=name, cmap=cmap, norm=norm
+                    , legend=True, legend_kwds={'label': name}, missing_kwds={'color': 'lightgrey'})
+            ax.set_axis_off()              # 目盛軸を非表示
+            ax.set_title(name)
+            ax.set_xlim(130, 145)
+            ax.set_ylim(30, 45)
+            # 報告数のラベル(値のある都道府県だけ)
+            found = ~np.isnan(values)
+            colors = np.where(values[found] > 8, 'yellow', 'black')
+            for (x, y), v, c in zip(labels[found], values[found], colors):
+                ax.annotate(f'{v:g}', (x, y), fontsize=6, color=c)
+        fig.suptitle(table.title)
+        tmp = f"{path}.{os.getpid()}.tmp"  # 一時ファイルに書いてから置き換える(形式は元の拡張子で決める)
+        fig.savefig(tmp, format=os.path.splitext(path)[1][1:] or None)
+    os.replace(tmp, path)
+    return path
 
-# データを都道府県名をキーにして地図データgdfにマージ
-gdf = gdf.merge(s1df, on='N03_001', how='left')
+if __name__ == '__main__':
+    import matplotlib.pyplot as plt
 
-# 地図作成
-_, axes = plt.subplots(1, 2, figsize=(12, 6))     # 二つ分の図領域を作成
-ax1 = gdf.plot(ax=axes[0], column='インフルエンザ', cmap='PuRd', vmin=0, vmax=40
-        , legend=True, legend_kwds={'label':'インフルエンザ', 'location':'left'})
-ax1.set_axis_off()              # 目盛軸を非表示
-ax1.set_title('インフルエンザ')
-ax1.set_xlim(130, 145)
-ax1.set_ylim(30, 45)
-gdf.apply(lambda x: ax1.annotate(x.インフルエンザ, (x.geometry.centroid.x, x.geometry.centroid.y), fontsize=6, color='yellow' if x.インフルエンザ > 8 else "black"), axis=1)
-
-ax2 = gdf.plot(ax=axes[1], column='COVID-19', cmap='PuRd', vmin=0, vmax=40
-        , legend=True, legend_kwds={'label':'COVID-19'})
-ax2.set_axis_off()              # 目盛軸を非表示
-ax2.set_title('COVID-19')
-ax2.set_xlim(130, 145)
-ax2.set_ylim(30, 45)
-gdf.apply(lambda x: ax2.annotate(x["COVID-19"], (x.geometry.centroid.x, x.geometry.centroid.y), fontsize=6, color='yellow' if x["COVID-19"] > 8 else "black"), axis=1)
-
-plt.show()
\ No newline at end of file
+    # 色分けデータ取得
+    today = date.today() - timedelta(days=16)
+    year, week = teiten.year_week(today)
+    print(f"日付：{today.strftime('%Y/%m/%d')}、週：{week}")
+    table = TeitenStore().load(year, week)
+    if table is None:
+        print('感染症データがない日付を指定されました')
+        exit()
+    # 地図作成
+    fname = render_report(table, [teiten.NAME_FLU, teiten.NAME_COVID], f"{year}-{week}_map.png")
+    plt.imshow(plt.imread(fname))
+    plt.axis('off')
+    plt.show()
@@ -0,0 +1,134 @@
+"""
+定点把握疾患の週報データをまとめて取得(過去の週の一括取得)
+"""
+
+import argparse, http.client, logging, random, time, urllib.error
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, timedelta
+from typing import Callable, List, Optional, Tuple       # 関数アノテーション用
+import teiten
+from teiten_store import TeitenStore
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUS = 429      # 5xxの他に再試行するステータス(アクセスが多すぎる)
+
+def week_range(start:date, end:date) -> List[Tuple[str, str]]:
+    """
+    期間内のISO週のリスト
+    Args:
+        date:   開始日
+        date:   終了日
+    Returns:
+        list:   年と週のタプルのリスト(古い順)
+    """
+    day = start - timedelta(days=start.weekday())   # 週の月曜日
+    weeks = []
+    while day <= end:
+        weeks.append(teiten.year_week(day))
+        day += timedelta(days=7)
+    return weeks
+
+def retry_after(e:urllib.error.HTTPError) -> Optional[float]:
+    """
+    Retry-Afterヘッダーの待ち時間
+    Args:
+        HTTPError:  エラーの応答
+    Returns:
+        float:  待ち時間(秒、ヘッダーがない時や読めない時はNone)
+    """
+    value = e.headers.get("Retry-After") if e.headers else None
+    if not value: return None
+    value = value.strip()
+    if value.isdigit(): return float(value)
+    try:    # 日時で指定されている場合
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def fetch_with_retry(year:str, week:str, meta:Optional[dict], base:str
+                    , retries:int=3, backoff:float=1.0, raw_path:Optional[str]=None) -> Optional[dict]:
+    """
+    週報csvの取得(通信エラー、途中で切れた応答、サーバーエラー、429の時は待ち時間を倍にしながら再試行)
+    Retry-Afterヘッダーがある時はその時間と比べて長い方を待つ
+    Args:
+        str:    年
+        str:    週
+        dict:   保存済みの週の取得情報(再検証用、ないときはNone)
+        str:    取得元
+        int:    再試行回数
+        float:  最初の待ち時間(秒)
+        str:    取得したcsvをそのまま保存するファイル(Noneの時は保存しない)
+    Returns:
+        dict:   teiten.fetch_teitenの結果
+    """
+    meta = meta or {}
+    for attempt in range(retries + 1):
+        try:
+            return teiten.fetch_teiten(year, week, meta.get("etag"), meta.get("last_modified"), base
+                                        , raw_path=raw_path)
+        except urllib.error.HTTPError as e:
+            # 429以外の4xxは再試行しても同じ
+            if (e.code < 500 and e.code != RETRY_STATUS) or attempt == retries: raise
+            wait = retry_after(e)
+        except (urllib.error.URLError, http.client.IncompleteRead, OSError):
+            if attempt == retries: raise
+            wait = None
+        delay = backoff * 2 ** attempt * (1 + random.random() / 2)     # 同時に再試行しないようにずらす
+        time.sleep(max(delay, wait or 0))
+
+def backfill(store:TeitenStore, start:date, end:date, workers:int=8, retries:int=3, backoff:float=1.0
+            , progress:Optional[Callable[[str, str, str], None]]=None) -> dict:
+    """
+    期間内の週報データを並列に取得して保存
+    保存済みの確定した週は取得しないので、中断しても再実行すれば続きから取得する
+    Args:
+        TeitenStore:    保存先
+        date:           開始日
+        date:           終了日
+        int:            同時に取得する数
+        int:            再試行回数
+        float:          最初の待ち時間(秒)
+        Callable:       進捗を受け取る関数(年, 週, 結果)
+    Returns:
+        dict:   結果ごとの週の数(stored:保存、skipped:保存済み、missing:データなし、failed:失敗)
+    """
+    counts = {"stored": 0, "skipped": 0, "missing": 0, "failed": 0}
+    todo = []
+    for year, week in week_range(start, end):
+        if store.has_week(year, week):
+            counts["skipped"] += 1
+        else:
+            todo.append((year, week))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(fetch_with_retry, year, week, store.get_meta(year, week)
+                                    , store.base_url, retries, backoff, store.raw_path(year, week)): (year, week)
+                    for year, week in todo}
+        # 取得できた週から保存する(保存は1スレッドで行う)
+        for future in as_completed(futures):
+            year, week = futures[future]
+            try:
+                table = store.save(year, week, future.result())
+                result = "stored" if table is not None else "missing"
+            except Exception as e:
+                logger.warning('%s-%s:%s', year, week, e, exc_info=not isinstance(e, OSError))
+                result = "failed"
+            counts[result] += 1
+            if progress: progress(year, week, result)
+    return counts
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    parser = argparse.ArgumentParser(description="定点把握疾患の週報データをまとめて取得")
+    parser.add_argument("--years", type=float, default=3, help="取得する年数(今日から遡る)")
+    parser.add_argument("--workers", type=int, default=8, help="同時に取得する数")
+    parser.add_argument("--db", default="cache/teiten.sqlite3", help="保存先のデータベース")
+    parser.add_argument("--base-url", default=teiten.BASE_URL, help="週報の取得元")
+    parser.add_argument("--raw-dir", help="取得したcsvをそのまま保存するフォルダ")
+    args = parser.parse_args()
+    end = date.today()
+    start = end - timedelta(days=int(args.years * 365))
+    counts = backfill(TeitenStore(args.db, args.base_url, args.raw_dir), start, end, args.workers
+                    , progress=lambda year, week, result: print(f'{year}-{week}:{result}'))
+    print(counts)
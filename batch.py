@@ -0,0 +1,298 @@
+"""
+地図の一括作成(画面を使わずにコマンドラインから実行)
+"""
+
+import argparse, functools, html, logging, os, urllib.parse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple       # 関数アノテーション用
+import classify, regions, teiten
+from backfill import backfill, week_range
+from geo_cache import PREF_TOPO_URL, GeometryCache
+from renderers import RENDERERS, get_renderer, write_text
+from teiten_store import TeitenStore
+
+logger = logging.getLogger(__name__)
+
+ALL = "all"         # --diseaseで週報csvのすべての感染症を指定する
+INDEX_HTML = """<!DOCTYPE html>
+<html lang="ja">
+<head><meta charset="utf-8"><title>定点把握疾患の階級区分図</title></head>
+<body>
+<h3>定点当たり報告数の階級区分図</h3>
+{sliders}
+<ul>
+{items}
+</ul>
+</body>
+</html>
+"""
+
+_mapping = None     # プロセスごとの地図作成オブジェクト(_init_workerで作成)
+
+def _init_worker(cache_dir:str, db:str, lod_zoom:int, renderer:str, out_dir:str, by_region:bool
+                , scales:Dict[str, classify.Scale]) -> None:
+    """
+    プロセスの初期化：地図作成オブジェクトを作成し、地図データを1回だけ読み込む
+    Args:
+        str:    地図データのキャッシュフォルダ
+        str:    週報データのデータベース
+        int:    地図データの詳細度
+        str:    地図の出力方法
+        str:    出力先フォルダ(leafletの地図データはここに1つだけ書き出す)
+        bool:   地方ごとの地図にするか
+        dict:   感染症名をキーにした階級区分(全ての週で共通)
+    """
+    global _mapping
+    from Fixed_point_disease import Mapping
+    _mapping = Mapping(None, GeometryCache(cache_dir, offline=True), TeitenStore(db))
+    _mapping.lod_zoom = lod_zoom
+    _mapping.open_browser = False
+    _mapping.regions = by_region
+    _mapping.scales = scales
+    _mapping.renderer = get_renderer(renderer)
+    if renderer == "leaflet":   # 地図データは週ごとのフォルダではなく出力先に1つだけ書き出す
+        _mapping.renderer.shared_dir = out_dir
+    _mapping.geo_cache.get_lod(PREF_TOPO_URL, lod_zoom)
+
+def plan(tables:List[teiten.TeitenTable], keywords:Optional[List[str]], png:bool=False) -> List[tuple]:
+    """
+    作成する地図のジョブのリスト(週×感染症、時間のかかる地図を並べたものを先にする)
+    Args:
+        list:   週報データのリスト
+        list:   感染症名(含まれる文字列)のリスト(Noneの時は週報csvのすべての感染症)
+        bool:   PNGファイルも作成するか
+    Returns:
+        list:   (年, 週, 感染症名のリスト, PNGファイル名)のリスト(PNGファイルを作らない時はファイル名がNone)
+    """
+    combined, single = [], []
+    for table in tables:
+        if keywords is None:
+            names = list(table.diseases)
+        else:
+            names = list(dict.fromkeys(n for n in (table.find(k) for k in keywords) if n))
+        # 地図を並べたもの(静止画もこちらで作成)
+        # 2023/5/8以前は新型コロナがなく1つだけになるので、並べずに1つの感染症の地図のジョブで作成する
+        many = keywords is not None and len(keywords) > 1
+        if many and len(names) > 1:
+            combined.append((table.year, table.week, names, "map.png" if png else None))
+        for name in names:
+            if not png or (many and len(names) > 1):
+                pngname = None              # 静止画は地図を並べたもので作成
+            elif many:
+                pngname = "map.png"         # 並べるはずの感染症が1つだけの週
+            else:
+                pngname = f"{name}map.png"
+            single.append((table.year, table.week, [name], pngname))
+    return combined + single
+
+def fit_scales(tables:List[teiten.TeitenTable], names:List[str], scheme:str=classify.EQUAL
+                , classes:int=classify.MAX_CLASSES, thresholds:Optional[List[float]]=None
+                , fix_max:Optional[float]=None, by_region:bool=False) -> Dict[str, classify.Scale]:
+    """
+    感染症ごとに全ての週の値から階級区分を作成(一括作成する地図の区分と色を週によらず揃える)
+    Args:
+        list:   週報データのリスト
+        list:   感染症名のリスト
+        str:    階級区分の方法
+        int:    階級区分の数の上限
+        list:   階級区分の境界(FIXEDの時)
+        float:  最大値を固定にする場合の最小の最大値
+        bool:   地方ごとの地図にするか(地方の値で区分を作る)
+    Returns:
+        dict:   感染症名をキーにした階級区分
+    """
+    scales = {}
+    for name in names:
+        if by_region:
+            values = regions.RegionSeries(tables, name).region_teito()
+        else:
+            values = teiten.week_matrix(tables, name, regions.PREFS)     # 週×都道府県
+        scales[name] = classify.fit(values, scheme, classes, fix_max, thresholds, name)
+    return scales
+
+@functools.lru_cache(maxsize=4)
+def _table(year:str, week:str) -> teiten.TeitenTable:
+    """
+    週報データ(同じ週のジョブが続くので、プロセスごとに直近の週を保持)
+    """
+    return _mapping.store.get_week(year, week)
+
+def _render_job(year:str, week:str, names:List[str], png:Optional[str]
+                , fix_max:Optional[float], out_dir:str) -> Tuple[str, str, List[str]]:
+    """
+    1つのジョブの地図を作成(プロセスプールで実行、週報データは引数で送らずプロセスで読み込む)
+    Args:
+        str:    年
+        str:    週
+        list:   感染症名のリスト(2つ以上の時は地図を並べたもの)
+        str:    PNGファイル名(Noneの時は作らない)
+        float:  最大値を固定にする場合の最小の最大値
+        str:    出力先フォルダ
+    Returns:
+        tuple:  年, 週, 作成したファイルのパスのリスト
+    """
+    table = _table(year, week)
+    _mapping.out_dir = os.path.join(out_dir, f"{year}-{week}")
+    os.makedirs(_mapping.out_dir, exist_ok=True)
+    files = _mapping.create_maps(table, names, fix_max)
+    if png and files:   # 静止画(感染症の地図を並べたもの)
+        from Fixed_point_disease_geo import render_report
+        # HTMLと同じ階級区分と色(地方の地図の区分は地方の値で作るので、都道府県の静止画には使わない)
+        files.append(render_report(table, names, os.path.join(_mapping.out_dir, png)
+                                    , fix_max, _mapping.geo_cache, _mapping.lod_zoom
+                                    , None if _mapping.regions else _mapping.scales))
+    return year, week, files
+
+def _links(out_dir:str, paths:List[str]) -> str:
+    """
+    ファイルへのリンク(目次からの相対パス)
+    """
+    links = []
+    for path in paths:
+        name = os.path.splitext(os.path.basename(path))[0]
+        href = urllib.parse.quote(os.path.relpath(path, out_dir).replace(os.sep, "/"))
+        links.append(f'<a href="{html.escape(href)}">{html.escape(name)}</a>')
+    return " ".join(links)
+
+def write_index(out_dir:str, tables:List[teiten.TeitenTable], files:Dict[Tuple[str, str], List[str]]
+                , sliders:Optional[List[str]]=None) -> str:
+    """
+    作成した地図へのリンクを週ごとに並べた目次のHTMLファイルを作成
+    Args:
+        str:    出力先フォルダ
+        list:   週報データのリスト(週の順)
+        dict:   (年, 週)をキーにした作成したファイルのパスのリスト
+        list:   週をスライダーで切り替える地図のファイルのパスのリスト(週の一覧の前に置く)
+    Returns:
+        str:    目次のファイルのパス
+    """
+    items = []
+    for table in tables:
+        paths = files.get((table.year, table.week))
+        if not paths: continue
+        items.append(f'<li>{html.escape(table.year)}-{html.escape(table.week)} {html.escape(table.title)}'
+                    f'<br>{_links(out_dir, paths)}</li>')
+    path = os.path.join(out_dir, "index.html")
+    write_text(path, INDEX_HTML.format(sliders=f"<p>{_links(out_dir, sliders)}</p>" if sliders else ""
+                                        , items="\n".join(items)))
+    return path
+
+def write_sliders(tables:List[teiten.TeitenTable], names:List[str], fix_max:Optional[float], out_dir:str
+                , cache_dir:str, db:str, lod_zoom:int, by_region:bool
+                , scales:Dict[str, classify.Scale]) -> List[str]:
+    """
+    感染症ごとに期間内の週をスライダーで切り替える地図を作成(階級区分は週ごとの地図と同じ)
+    Args:
+        list:   週報データのリスト(週の順)
+        list:   感染症名のリスト
+        float:  最大値を固定にする場合の最小の最大値
+        str:    出力先フォルダ
+        str:    地図データのキャッシュフォルダ
+        str:    週報データのデータベース
+        int:    地図データの詳細度
+        bool:   地方ごとの地図にするか
+        dict:   感染症名をキーにした階級区分
+    Returns:
+        list:   作成したファイルのパスのリスト
+    """
+    from Fixed_point_disease import Mapping
+    mapping = Mapping(None, GeometryCache(cache_dir, offline=True), TeitenStore(db))
+    mapping.lod_zoom = lod_zoom
+    mapping.open_browser = False
+    mapping.regions = by_region
+    mapping.scales = scales
+    mapping.out_dir = out_dir
+    files = []
+    for name in names:
+        mapping.Choropleth_time_slider(tables, name, fix_max, out2html=True)
+        files.append(os.path.join(out_dir, f"{name}_weekly_map{'_region' if by_region else ''}.html"))
+    return files
+
+def run(start:date, end:date, keywords:Optional[List[str]], fix_max:Optional[float], out_dir:str
+        , workers:Optional[int]=None, png:bool=False, db:str="cache/teiten.sqlite3"
+        , cache_dir:str="cache/geometry", lod_zoom:int=8, renderer:str="template"
+        , by_region:bool=False, scheme:str=classify.EQUAL, classes:int=classify.MAX_CLASSES
+        , thresholds:Optional[List[float]]=None, slider:bool=False) -> List[str]:
+    """
+    期間内の週の地図を一括作成
+    週報データと地図データはこのプロセスで1回だけ用意し、地図の作成は週×感染症ごとに並列に行う
+    Args:
+        date:   開始日
+        date:   終了日
+        list:   感染症名(含まれる文字列)のリスト(Noneの時は週報csvのすべての感染症)
+        float:  最大値を固定にする場合の最小の最大値(Noneの時はデータ依存)
+        str:    出力先フォルダ
+        int:    並列に作成するプロセス数(Noneの時はCPUの数)
+        bool:   PNGファイルも作成するか
+        str:    週報データのデータベース
+        str:    地図データのキャッシュフォルダ
+        int:    地図データの詳細度
+        str:    地図の出力方法(folium, template, leaflet, svg)
+        bool:   地方(8地方区分)ごとの地図にするか
+        str:    階級区分の方法(equal, quantile, jenks, fixed, levels)
+        int:    階級区分の数の上限
+        list:   階級区分の境界(fixedの時)
+        bool:   感染症ごとに週をスライダーで切り替える地図も作成するか
+    Returns:
+        list:   作成したファイルのパスのリスト(最後は目次のファイル)
+    """
+    store = TeitenStore(db)
+    backfill(store, start, end)     # 保存していない週だけ取得
+    GeometryCache(cache_dir).get_lod(PREF_TOPO_URL, lod_zoom)   # 地図データをキャッシュに用意
+    tables = [t for t in (store.get_week(year, week) for year, week in week_range(start, end)) if t is not None]
+    jobs = plan(tables, keywords, png)
+    names = list(dict.fromkeys(name for job in jobs for name in job[2]))
+    scales = fit_scales(tables, names, scheme, classes, thresholds, fix_max, by_region)
+    os.makedirs(out_dir, exist_ok=True)
+    done = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker
+                            , initargs=(cache_dir, db, lod_zoom, renderer, out_dir, by_region, scales)) as executor:
+        futures = {executor.submit(_render_job, *job, fix_max, out_dir): i for i, job in enumerate(jobs)}
+        # 終わったものから集める(失敗したジョブがあっても残りは作成する)
+        for future in as_completed(futures):
+            year, week, names, _ = jobs[futures[future]]
+            try:
+                done[futures[future]] = future.result()[2]
+            except Exception:
+                logger.exception('%s-%s %s', year, week, " ".join(names))
+    # 目次はジョブの順(週の順、地図を並べたものが先)
+    by_week = {}
+    for i, job in enumerate(jobs):
+        by_week.setdefault(job[:2], []).extend(done.get(i, []))
+    files = [path for i in range(len(jobs)) for path in done.get(i, [])]
+    sliders = []
+    if slider:
+        sliders = write_sliders(tables, list(scales), fix_max, out_dir, cache_dir, db, lod_zoom, by_region, scales)
+    return files + sliders + [write_index(out_dir, tables, by_week, sliders)]
+
+def _date(text:str) -> date:
+    return datetime.strptime(text, "%Y/%m/%d").date()
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    parser = argparse.ArgumentParser(description="定点把握疾患の定点あたりの報告数の階級区分図を一括作成")
+    parser.add_argument("--start", type=_date, required=True, help="開始日(例:2023/10/09)")
+    parser.add_argument("--end", type=_date, help="終了日(省略時は開始日の週だけ)")
+    parser.add_argument("--disease", nargs="+", default=[teiten.NAME_COVID, teiten.NAME_FLU]
+                        , help=f"感染症名(含まれる文字列、複数指定可、{ALL}で週報csvのすべての感染症)")
+    parser.add_argument("--fix-max", type=float, help="最大値を固定にする(データの最大値の方が大きい時はデータの最大値)")
+    parser.add_argument("--out", default="maps", help="出力先フォルダ")
+    parser.add_argument("--workers", type=int, help="並列に作成するプロセス数")
+    parser.add_argument("--png", action="store_true", help="PNGファイルも作成(geopandasが必要)")
+    parser.add_argument("--renderer", choices=list(RENDERERS), default="template"
+                        , help="地図の出力方法(leafletとsvgはfoliumを使わないので速い)")
+    parser.add_argument("--regions", action="store_true", help="地方(8地方区分)ごとの地図を作成")
+    parser.add_argument("--scheme", choices=classify.SCHEMES, default=classify.EQUAL
+                        , help="階級区分の方法(levelsは警報・注意報の基準、全ての週で同じ区分を使う)")
+    parser.add_argument("--classes", type=int, default=classify.MAX_CLASSES, help="階級区分の数の上限")
+    parser.add_argument("--thresholds", type=float, nargs="+", help="階級区分の境界(--scheme fixedの時)")
+    parser.add_argument("--slider", action="store_true", help="感染症ごとに週をスライダーで切り替える地図も作成")
+    args = parser.parse_args()
+    if args.scheme == classify.FIXED and not any(t > 0 for t in args.thresholds or []):
+        parser.error("--scheme fixed には0より大きい --thresholds が必要です")
+    keywords = None if args.disease == [ALL] else args.disease
+    files = run(args.start, args.end or args.start, keywords, args.fix_max, args.out, args.workers, args.png
+                , renderer=args.renderer, by_region=args.regions
+                , scheme=args.scheme, classes=args.classes, thresholds=args.thresholds, slider=args.slider)
+    print(f'{len(files)} files {files[-1]}')
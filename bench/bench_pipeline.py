@@ -0,0 +1,206 @@
+"""
+取得→読み込み→地図作成の処理時間の計測(ネットワークを使わずfixturesのファイルで計測)
+
+fixtures
+    2023-10-teiten.csv  2023/5/8以前の列構成(新型コロナなし)の週報csv
+    2023-41-teiten.csv  2023/5/8以降の列構成(新型コロナあり)の週報csv
+    prefectures.json    全国都道府県のTopoJSON
+    同梱のファイルはNIIDとsmartnews-smriの形式に合わせて作成したもので、値は実際のものではない
+    2023-10-teiten.csvは2023-41-teiten.csvから新型コロナの列を除き、見出しの週と日付を10週に合わせて作成(--synthesize)
+    --recordで実際のファイルに置き換えられる
+
+使い方
+    python bench/bench_pipeline.py              計測してbaseline.jsonと比較(遅くなった処理があれば終了コード1)
+    python bench/bench_pipeline.py --save       計測結果をbaseline.jsonに保存
+    python bench/bench_pipeline.py --record     fixturesを実際のファイルで置き換える(ネットワークが必要)
+    python bench/bench_pipeline.py --synthesize 2023/5/8以前の列構成の週報csvを2023/5/8以降のものから作成
+"""
+
+import argparse, importlib.util, io, json, os, statistics, sys, tempfile, time, tracemalloc, warnings
+from datetime import date, timedelta
+from typing import Callable, Optional       # 関数アノテーション用
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))   # リポジトリのモジュールを使う
+
+import teiten
+from renderers import get_renderer
+from geo_cache import PREF_TOPO_URL, GeometryCache
+from teiten_store import TeitenStore
+
+FIXTURES = os.path.join(HERE, "fixtures")
+BASELINE = os.path.join(HERE, "baseline.json")     # 計測した環境ごとの基準(リポジトリには含めない)
+CSV_FIXTURES = {"pre": ("2023", "10"), "post": ("2023", "41")}  # 2023/5/8より前と後の列構成
+
+def fixture_csv(year:str, week:str) -> str:
+    return os.path.join(FIXTURES, f"{year}-{week}-teiten.csv")
+
+def record() -> None:
+    """
+    fixturesを実際のファイルで置き換える
+    """
+    import urllib.request
+    import requests
+    for year, week in CSV_FIXTURES.values():
+        with urllib.request.urlopen(teiten.teiten_url(year, week)) as res, open(fixture_csv(year, week), "wb") as f:
+            f.write(res.read())
+    with open(os.path.join(FIXTURES, "prefectures.json"), "wb") as f:
+        f.write(requests.get(PREF_TOPO_URL).content)
+
+def synthesize() -> None:
+    """
+    2023/5/8以前の列構成の週報csvを2023/5/8以降のものから作成(値は同じで、新型コロナの列を除く)
+    見出しの週と期間・作成日は作成する週に合わせる(作成日は週の翌週の水曜日)
+    """
+    year, week = CSV_FIXTURES["post"]
+    with open(fixture_csv(year, week), encoding="cp932", newline="") as f:
+        lines = f.read().split("\r\n")
+    table = teiten.parse_teiten(lines)
+    col = 1 + 2 * table.diseases.index(table.find(teiten.NAME_COVID))     # 新型コロナの報告の列
+    n = 1 + 2 * len(table.diseases)     # 都道府県名と感染症ごとの報告・定当
+    year, week = CSV_FIXTURES["pre"]
+    monday = date.fromisocalendar(int(year), int(week), 1)
+    sunday, made = monday + timedelta(days=6), monday + timedelta(days=9)
+    out = []
+    for i, line in enumerate(lines):
+        cells = line.split(",")
+        if i == 1:      # 見出し(週と期間、作成日)
+            cells = [f'"{int(year)}年{int(week)}週({monday:%m月%d日}～{sunday:%m月%d日})"', f'"{made:%Y年%m月%d日}作成"']
+        elif len(cells) == n:
+            del cells[col:col + 2]
+        out.append(",".join(cells))
+    with open(fixture_csv(year, week), "w", encoding="cp932", newline="") as f:
+        f.write("\r\n".join(out))
+
+def measure(func:Callable[[], Optional[str]], repeat:int) -> dict:
+    """
+    処理時間(中央値)、メモリ使用量のピーク、出力ファイルのサイズを計測
+    Args:
+        Callable:   計測する処理(出力ファイルがあればそのパスを返す)
+        int:        処理時間を計測する回数
+    Returns:
+        dict:   seconds(中央値), best(最短), peak_kb, output_kb
+    """
+    path = func()       # 1回目はキャッシュの準備を兼ねるので計測しない
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    # メモリの計測は遅くなるので処理時間とは別に1回だけ行う
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"seconds": statistics.median(times), "best": min(times), "peak_kb": peak / 1024
+            , "output_kb": os.path.getsize(path) / 1024 if path else None}
+
+def run(repeat:int) -> dict:
+    """
+    各処理を計測
+    Args:
+        int:    処理時間を計測する回数
+    Returns:
+        dict:   処理名をキーにした計測結果
+    """
+    from Fixed_point_disease import Mapping
+
+    work = tempfile.mkdtemp(prefix="bench_")
+    cache = GeometryCache(os.path.join(work, "geometry"), offline=True)
+    cache.seed(PREF_TOPO_URL, os.path.join(FIXTURES, "prefectures.json"))
+    mapping = Mapping(None, cache, TeitenStore(os.path.join(work, "teiten.sqlite3")))
+    mapping.out_dir = work
+    mapping.open_browser = False
+
+    raw = {}
+    for key, (year, week) in CSV_FIXTURES.items():
+        with open(fixture_csv(year, week), "rb") as f:
+            raw[key] = f.read()
+    table = teiten.parse_teiten(teiten.iter_lines(io.BytesIO(raw["post"])))
+    name_c, name_i = table.find(teiten.NAME_COVID), table.find(teiten.NAME_FLU)
+    rows_c, rows_i = table.rows(name_c), table.rows(name_i)
+
+    def parse(key:str) -> Callable[[], None]:
+        return lambda: teiten.parse_teiten(teiten.iter_lines(io.BytesIO(raw[key]))) and None
+
+    def geometry_cold() -> None:
+        GeometryCache(cache.cache_dir, offline=True).get_lod(PREF_TOPO_URL, mapping.lod_zoom)
+
+    def choropleth() -> str:
+        mapping.Choropleth_map_topo(rows_i, name_i, table.title, 40, True)
+        return os.path.join(work, f"{name_i}map.html")
+
+    def tow() -> str:
+        mapping.tow_choropleth(rows_c, rows_i, name_c, name_i, table.title, 40, 40)
+        return os.path.join(work, "COV_flu_map.html")
+
+    def template() -> str:
+        return mapping.Choropleth_map_template(rows_i, name_i, table.title, 40, "template_map.html")
+
+    def renderer(name:str) -> Callable[[], str]:
+        backend = get_renderer(name)
+        def render() -> str:
+            mapping.renderer = backend
+            return mapping.create_maps(table, [teiten.NAME_COVID, teiten.NAME_FLU], 40)[0]
+        return render
+
+    stages = {"parse_pre": parse("pre"), "parse_post": parse("post"), "geometry_cold": geometry_cold
+            , "choropleth": choropleth, "tow_choropleth": tow, "template": template
+            , "leaflet": renderer("leaflet"), "svg": renderer("svg")}
+    if importlib.util.find_spec("geopandas"):    # Fixed_point_disease_geoはgeopandasを使う時に読み込む
+        from Fixed_point_disease_geo import render_report
+        warnings.filterwarnings("ignore", message="Glyph")   # 日本語フォントがない環境の警告
+        stages["geopandas"] = lambda: render_report(table, [teiten.NAME_FLU, teiten.NAME_COVID]
+                                                    , os.path.join(work, "map.png"), 40, cache, mapping.lod_zoom)
+    else:
+        print("geopandas がないので geopandas の計測は行いません")
+    return {name: measure(func, repeat) for name, func in stages.items()}
+
+def report(results:dict, baseline:dict, threshold:float, min_diff:float=0.005) -> bool:
+    """
+    計測結果の表示(最短時間がbaselineより閾値以上遅い処理を表示、中央値はばらつきが大きいので比較に使わない)
+    Args:
+        dict:   計測結果
+        dict:   基準の計測結果
+        float:  遅くなったとみなす割合(0.2なら20%)
+        float:  遅くなったとみなす最小の差(秒、短い処理の誤差を無視する)
+    Returns:
+        bool:   遅くなった処理があればTrue
+    """
+    regressed = False
+    print(f"{'stage':<16}{'median s':>10}{'best s':>10}{'peak KB':>10}{'out KB':>10}{'vs base':>10}")
+    for name, r in results.items():
+        base = baseline.get(name)
+        ratio = r["best"] / base["best"] - 1 if base else None
+        mark = ""
+        if ratio is not None and ratio > threshold and r["best"] - base["best"] > min_diff:
+            mark = " <- regression"
+            regressed = True
+        out = f"{r['output_kb']:.1f}" if r["output_kb"] is not None else "-"
+        diff = f"{ratio:+.0%}" if ratio is not None else "-"
+        print(f"{name:<16}{r['seconds']:>10.4f}{r['best']:>10.4f}{r['peak_kb']:>10.0f}{out:>10}{diff:>10}{mark}")
+    return regressed
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="取得→読み込み→地図作成の処理時間の計測")
+    parser.add_argument("--repeat", type=int, default=5, help="処理時間を計測する回数")
+    parser.add_argument("--save", action="store_true", help="計測結果をbaseline.jsonに保存")
+    parser.add_argument("--threshold", type=float, default=0.2, help="遅くなったとみなす割合")
+    parser.add_argument("--min-diff", type=float, default=0.005, help="遅くなったとみなす最小の差(秒)")
+    parser.add_argument("--record", action="store_true", help="fixturesを実際のファイルで置き換える")
+    parser.add_argument("--synthesize", action="store_true", help="2023/5/8以前の列構成の週報csvを作成")
+    args = parser.parse_args()
+    if args.record:
+        record()
+    elif args.synthesize:
+        synthesize()
+    results = run(args.repeat)
+    baseline = {}
+    if os.path.exists(BASELINE) and not args.save:
+        with open(BASELINE, encoding='utf-8') as f:
+            baseline = json.load(f)
+    regressed = report(results, baseline, args.threshold, args.min_diff)
+    if args.save:
+        with open(BASELINE, "w", encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    sys.exit(1 if regressed else 0)
@@ -0,0 +1,113 @@
+"""
+起動時間の計測(画面の表示までに読み込むモジュールの時間が予算内か確認)
+
+新しいPythonのプロセスでFixed_point_disease.pyを読み込み、読み込みの時間と画面の表示までの時間を計測する
+folium(branca, jinja2)、requests、geopandasなどは地図作成の時に読み込むので、起動時に読み込まれていたらエラーにする
+
+使い方
+    python bench/bench_startup.py               計測して予算と比較(超えていれば終了コード1)
+    python bench/bench_startup.py --budget 0.3  読み込みの時間の予算(秒)を指定
+"""
+
+import argparse, json, os, subprocess, sys, tempfile
+from typing import List, Optional       # 関数アノテーション用
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+# 起動時に読み込まないモジュール
+HEAVY = ["folium", "branca", "jinja2", "requests", "pandas", "geopandas", "matplotlib"]
+
+# 計測用のプロセスで実行するスクリプト(画面がない環境では画面の表示は計測しない)
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import Fixed_point_disease
+imported = time.perf_counter()
+window = None
+try:
+    app = Fixed_point_disease.App()
+    app.update()
+    window = time.perf_counter() - start
+    app.destroy()
+except Exception:   # 画面がない
+    pass
+print(json.dumps({"import": imported - start, "window": window
+                , "heavy": [m for m in %r if m in sys.modules]}))
+"""
+
+def probe(repeat:int) -> dict:
+    """
+    新しいプロセスで起動時間を計測(ファイルのキャッシュの影響を除くため最短の時間を使う)
+    Args:
+        int:    計測する回数
+    Returns:
+        dict:   import(読み込みの秒), window(画面の表示までの秒、画面がない時はNone), heavy(読み込まれた重いモジュール)
+    """
+    results = []
+    with tempfile.TemporaryDirectory(prefix="bench_") as work:  # 週報データのデータベースなどは一時フォルダに作る
+        env = dict(os.environ, PYTHONPATH=ROOT)
+        for _ in range(repeat):
+            out = subprocess.run([sys.executable, "-c", PROBE % HEAVY], cwd=work, env=env
+                                , capture_output=True, text=True, check=True).stdout
+            results.append(json.loads(out.splitlines()[-1]))
+    windows = [r["window"] for r in results if r["window"] is not None]
+    return {"import": min(r["import"] for r in results), "window": min(windows) if windows else None
+            , "heavy": sorted({m for r in results for m in r["heavy"]})}
+
+def slowest(n:int=10) -> List[tuple]:
+    """
+    読み込みに時間がかかっているモジュール(python -X importtimeの結果から直接読み込んだものの合計時間の順)
+    Args:
+        int:    表示するモジュールの数
+    Returns:
+        list:   (モジュール名, 秒)のリスト
+    """
+    err = subprocess.run([sys.executable, "-X", "importtime", "-c", "import Fixed_point_disease"], cwd=ROOT
+                        , capture_output=True, text=True).stderr
+    times = []
+    for line in err.splitlines():   # 読み込まれたモジュールは読み込んだ側より前に出力される
+        if not line.startswith("import time:") or "|" not in line: continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit(): continue   # 見出しの行
+        depth = len(name) - len(name.lstrip()) - 1
+        if depth == 0:          # 最上位のモジュール(Fixed_point_disease.pyより前のものは捨てる)
+            if name.strip() == "Fixed_point_disease": break
+            times = []
+        elif depth == 2:        # 最上位のモジュールが直接読み込むもの
+            times.append((name.strip(), int(cumulative) / 1e6))
+    return sorted(times, key=lambda t: -t[1])[:n]
+
+def report(result:dict, budget:float, window_budget:Optional[float]) -> bool:
+    """
+    計測結果の表示
+    Args:
+        dict:   計測結果
+        float:  読み込みの時間の予算(秒)
+        float:  画面の表示までの時間の予算(秒)
+    Returns:
+        bool:   予算を超えたか重いモジュールが読み込まれていればTrue
+    """
+    over = result["import"] > budget
+    print(f"import  {result['import']:.3f} s (budget {budget:.3f} s){' <- over budget' if over else ''}")
+    if result["window"] is not None:
+        slow = window_budget is not None and result["window"] > window_budget
+        print(f"window  {result['window']:.3f} s{' <- over budget' if slow else ''}")
+        over = over or slow
+    else:
+        print("window  - (画面がないので計測しない)")
+    if result["heavy"]:
+        print(f"起動時に読み込まれたモジュール: {' '.join(result['heavy'])}")
+        over = True
+    if over:
+        for name, seconds in slowest():
+            print(f"  {name:<24}{seconds:>8.3f} s")
+    return over
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="起動時間の計測")
+    parser.add_argument("--repeat", type=int, default=5, help="計測する回数")
+    parser.add_argument("--budget", type=float, default=0.3, help="読み込みの時間の予算(秒)")
+    parser.add_argument("--window-budget", type=float, default=1.0, help="画面の表示までの時間の予算(秒)")
+    args = parser.parse_args()
+    sys.exit(1 if report(probe(args.repeat), args.budget, args.window_budget) else 0)
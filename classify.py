@@ -0,0 +1,230 @@
+"""
+階級区分(定当を色の区分に分ける方法と、区分ごとの色の表)
+区分は週×都道府県の配列全体から1回だけ決めるので、一括作成では同じ感染症の地図の区分と色が揃う
+区分の数は凡例に並べられる数(MAX_CLASSES)までにする
+"""
+
+import functools, logging, math
+import numpy as np
+from typing import Dict, List, Optional, Sequence, Tuple       # 関数アノテーション用
+
+logger = logging.getLogger(__name__)
+
+# 区分の方法
+EQUAL = "equal"         # 0から最大値まで切りのいい幅で等分
+QUANTILE = "quantile"   # 区分ごとの都道府県・週の数が同じになるように分ける
+JENKS = "jenks"         # 区分内のばらつきが最小になるように分ける(Fisher-Jenksの自然分類)
+FIXED = "fixed"         # 指定した境界で分ける
+LEVELS = "levels"       # 警報・注意報の基準で分ける(基準のない感染症はEQUAL)
+SCHEMES = (EQUAL, QUANTILE, JENKS, FIXED, LEVELS)
+
+MIN_CLASSES = 3         # ColorBrewerの色の最小の数
+MAX_CLASSES = 9         # ColorBrewerのPuRdの色の数(これより多いと補間した色になる)
+NICE_STEPS = (1, 2, 2.5, 5)     # 等分する幅(10の累乗倍)
+JENKS_SAMPLES = 1000    # 自然分類に使う値の数の上限(多い時は分位点で間引く)
+
+# 警報・注意報の基準(定点当たり報告数、感染症発生動向調査の警報・注意報の基準値)
+# 終息基準・注意報基準・警報開始基準の順、インフルエンザは流行開始の目安の1.0も境界にする
+EPIDEMIC_LEVELS = {
+    "インフルエンザ": (1, 10, 30),
+    "咽頭結膜熱": (1, 3),
+    "Ａ群溶血性レンサ球菌咽頭炎": (4, 8),
+    "感染性胃腸炎": (12, 20),
+    "水痘": (1, 2),
+    "手足口病": (2, 5),
+    "伝染性紅斑": (1, 2),
+    "ヘルパンギーナ": (2, 6),
+    "流行性耳下腺炎": (2, 3, 6),
+    "急性出血性結膜炎": (0.1, 1),
+    "流行性角結膜炎": (4, 8),
+}
+
+@functools.lru_cache(maxsize=32)
+def palette(n:int) -> Tuple[str, ...]:
+    """
+    n色のPuRd(folium.Choroplethと同じColorBrewerの色)
+    """
+    from branca.utilities import color_brewer
+    return tuple(color_brewer('PuRd', n=n))
+
+class Scale():
+    """
+    区分の境界と色の表(すべての出力方法で共通に使う)
+    境界はbins[i]以上bins[i+1]未満が区分i、最初の境界より小さい値は最初の区分、最後の境界以上は最後の区分
+    """
+    def __init__(self, bins:Sequence[float], colors:Optional[Sequence[str]]=None, scheme:str=EQUAL) -> None:
+        """
+        コンストラクタ
+        Args:
+            list:   区分の境界(区分の数+1個、昇順)
+            list:   区分ごとの色(Noneの時はPuRd)
+            str:    区分の方法(表示用)
+        """
+        self.bins = [float(b) for b in bins]
+        self.colors = list(colors) if colors else list(palette(len(self.bins) - 1))
+        self.scheme = scheme
+
+    @property
+    def vmax(self) -> float:
+        return self.bins[-1]
+
+    def classify(self, values) -> np.ndarray:
+        """
+        値を区分の番号に変換(配列の形はそのまま、NaNは-1)
+        """
+        values = np.asarray(values, dtype=float)
+        index = np.searchsorted(np.array(self.bins[1:-1]), values, side="right")
+        return np.where(np.isnan(values), -1, index)
+
+    def table(self, rows:list) -> Dict[str, tuple]:
+        """
+        報告数データを色に変換
+        Args:
+            list:   報告数データ(都道府県と報告数のタプルのリスト)
+        Returns:
+            dict:   都道府県をキーにした(報告数, 色)
+        """
+        index = self.classify([value for _, value in rows])
+        return {pref: (value, self.colors[i]) for (pref, value), i in zip(rows, index)}
+
+    def legend(self) -> List[Tuple[str, str]]:
+        """
+        凡例の(色, 見出し)のリスト
+        """
+        return [(color, f"{lo:g}-{hi:g}") for color, lo, hi in zip(self.colors, self.bins[:-1], self.bins[1:])]
+
+    def colormap(self, caption:str=""):
+        """
+        foliumの凡例用のStepColormap
+        """
+        from branca.colormap import StepColormap
+        return StepColormap(self.colors, index=self.bins, vmin=self.bins[0], vmax=self.bins[-1], caption=caption)
+
+    def to_dict(self) -> dict:
+        return {"scheme": self.scheme, "bins": self.bins, "colors": self.colors}
+
+    @classmethod
+    def from_dict(cls, d:dict) -> "Scale":
+        return cls(d["bins"], d["colors"], d.get("scheme", EQUAL))
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Scale) and self.bins == other.bins and self.colors == other.colors
+
+    def __repr__(self) -> str:
+        return f"Scale({self.scheme}, {self.bins})"
+
+def nice_step(top:float, classes:int) -> float:
+    """
+    0からtopまでをclasses個以下に分ける切りのいい幅(1, 2, 2.5, 5の10の累乗倍で一番小さいもの)
+    """
+    if top <= 0: return 1.0
+    e = math.floor(math.log10(top / classes))
+    for step in sorted(m * 10.0 ** k for k in range(e - 1, e + 3) for m in NICE_STEPS):
+        if math.floor(top / step) + 1 <= classes: return step
+    return 10.0 ** (e + 3)
+
+def equal_bins(top:float, classes:int=MAX_CLASSES) -> np.ndarray:
+    """
+    0から切りのいい幅で、topが最後の区分に入るまで等分した境界(topは最後の境界より小さい)
+    最大値が5以上9未満の時は、これまでのbins=range(0, int(max_value + 2))と同じ1刻みの区分になる
+    """
+    step = nice_step(top, classes)
+    n = max(math.floor(top / step) + 1, MIN_CLASSES)
+    return np.round(np.arange(n + 1) * step, 10)
+
+def quantile_bins(values:np.ndarray, classes:int=MAX_CLASSES) -> np.ndarray:
+    """
+    分位点の境界(同じ値の境界はまとめるので区分の数はclassesより少ないことがある)
+    """
+    return np.unique(np.round(np.quantile(values, np.linspace(0, 1, classes + 1)), 2))
+
+def jenks_bins(values:np.ndarray, classes:int=MAX_CLASSES) -> np.ndarray:
+    """
+    Fisher-Jenksの自然分類の境界(各区分の最小値と、最後は全体の最大値)
+    同じ値をまとめて重みにした値の並びに対して、区分の数ごとに全ての区切り方の費用を配列でまとめて計算する
+    Args:
+        ndarray:    値(NaNを含まない1次元配列)
+        int:        区分の数
+    Returns:
+        ndarray:    境界(値の種類がclassesより少ない時は値の種類の数の区分)
+    """
+    if len(values) > JENKS_SAMPLES:     # 多い時は分位点で間引く(区分の境界はほとんど変わらない)
+        values = np.quantile(values, np.linspace(0, 1, JENKS_SAMPLES))
+    x, w = np.unique(np.round(values, 2), return_counts=True)
+    n = len(x)
+    classes = min(classes, n)
+    # 区間[i, j)の偏差平方和(累積和から計算)
+    cw, cx, cxx = (np.concatenate([[0.0], np.cumsum(a)]) for a in (w, w * x, w * x * x))
+    i, j = np.arange(n + 1)[:, None], np.arange(n + 1)[None, :]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sw = cw[j] - cw[i]
+        ssd = np.where(i < j, (cxx[j] - cxx[i]) - (cx[j] - cx[i]) ** 2 / sw, np.inf)
+    cost = ssd[0]       # cost[j]: 最初のj個をc個の区分に分けた時の最小の費用
+    back = []
+    for c in range(2, classes + 1):
+        total = np.where(i >= c - 1, cost[:, None] + ssd, np.inf)
+        back.append(total.argmin(axis=0))
+        cost = total.min(axis=0)
+    # 区切りの位置を後ろからたどる
+    starts, end = [], n
+    for arg in reversed(back):
+        end = arg[end]
+        starts.append(end)
+    return np.concatenate([[x[0]], x[sorted(starts)], [x[-1]]])
+
+def threshold_bins(thresholds:Sequence[float], top:float) -> np.ndarray:
+    """
+    0と指定した境界と最後の境界(最後の基準の2倍かtopの大きい方)
+    """
+    thresholds = sorted(t for t in thresholds if t > 0)
+    if not thresholds: raise ValueError("0より大きい境界が指定されていません")
+    last = max(top, thresholds[-1] * 2)
+    return np.array([0.0] + thresholds + [math.ceil(last) if last >= 1 else last])
+
+def _at_least(bins:np.ndarray, classes:int=MIN_CLASSES) -> np.ndarray:
+    """
+    区分がclassesより少ない時は最後の区分を半分に分ける(ColorBrewerの色は3色以上のため)
+    """
+    bins = list(bins)
+    while len(bins) - 1 < classes:
+        lo, hi = bins[-2], bins[-1]
+        bins[-1:] = [round((lo + hi) / 2, 10), hi]
+    return np.array(bins)
+
+def fit(values, scheme:str=EQUAL, classes:int=MAX_CLASSES, vmax:Optional[float]=None
+        , thresholds:Optional[Sequence[float]]=None, name:Optional[str]=None) -> Scale:
+    """
+    値から区分と色の表を作成
+    Args:
+        ndarray:    値(週×都道府県などの配列、NaNは除く)
+        str:        区分の方法(SCHEMESのどれか)
+        int:        区分の数の上限
+        float:      最後の区分に入れる最小の最大値(最大値を固定にする時、Noneの時はデータの最大値)
+        list:       FIXEDの時の境界
+        str:        感染症名(LEVELSの時に基準を探す)
+    Returns:
+        Scale:  区分と色の表
+    """
+    if scheme not in SCHEMES:
+        raise ValueError(f"区分の方法がありません:{scheme}(選べるのは{', '.join(SCHEMES)})")
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values)]
+    top = max(float(values.max()) if values.size else 0.0, vmax or 0.0)
+    classes = max(classes, MIN_CLASSES)
+    if scheme == LEVELS:
+        thresholds = EPIDEMIC_LEVELS.get(name)
+        if thresholds is None:
+            logger.info("%s:警報・注意報の基準がないので%sで区分", name, EQUAL)
+            scheme = EQUAL
+    if scheme in (FIXED, LEVELS):
+        if not thresholds: raise ValueError("境界が指定されていません")
+        bins = threshold_bins(thresholds, top)
+    elif scheme in (QUANTILE, JENKS) and values.size and values.min() < values.max():
+        bins = quantile_bins(values, classes) if scheme == QUANTILE else jenks_bins(values, classes)
+        bins[0] = min(bins[0], 0.0)
+        bins[-1] = max(bins[-1], top)
+        if bins[-1] <= bins[-2]:    # 最後の区分が1つの値だけの時
+            bins[-1] = bins[-2] + nice_step(bins[-2], MAX_CLASSES)
+    else:   # 値が1種類しかない時も等分
+        bins = equal_bins(top, classes)
+    return Scale(_at_least(bins), scheme=scheme)
@@ -0,0 +1,241 @@
+"""
+週報データの書き出し(年/週ごとのArrow IPCかParquetのファイル)と読み込み
+分析で使う時にNIIDのcsvを取得し直さなくてよいよう、保存した週報データを型付きの列で書き出す
+
+ファイル
+    <出力先>/<年>/<週>.arrow(または.parquet)  1週分の全感染症・全都道府県(全国の行を含む)
+列
+    year(int16) week(int8) col(int8:csvの感染症の順) disease(dictionary) pref_no(int8:全国は-1)
+    pref(dictionary) report(float64:報告数) teito(float64:定点当たり報告数)  データがない所はnull
+    スキーマのメタデータにタイトルと内容のハッシュ(digest)を持たせ、内容が変わった週だけ書き出し直す
+    年と週もファイルに含めるので、pyarrow.datasetでフォルダごと読むこともできる
+
+使い方
+    python export.py --out data/teiten                  保存した全ての週のうち、変わった週だけ書き出す
+    python export.py --out data/teiten --format parquet Parquetで書き出す
+"""
+
+import argparse, os
+from datetime import datetime
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from typing import Dict, List, Optional, Tuple       # 関数アノテーション用
+import teiten
+from teiten_store import TeitenStore, table_digest
+
+FORMATS = {"arrow": ".arrow", "parquet": ".parquet"}    # 形式と拡張子
+
+SCHEMA = pa.schema([
+    ("year", pa.int16()), ("week", pa.int8()), ("col", pa.int8())
+    , ("disease", pa.dictionary(pa.int8(), pa.string()))
+    , ("pref_no", pa.int8()), ("pref", pa.dictionary(pa.int8(), pa.string()))
+    , ("report", pa.float64()), ("teito", pa.float64())])
+
+def to_arrow(table:teiten.TeitenTable, digest:Optional[str]=None) -> pa.Table:
+    """
+    1週分の週報データをArrowのTableに変換(都道府県×感染症の配列をそのまま列にする)
+    Args:
+        TeitenTable:    週報データ(yearとweekを設定したもの)
+        str:            内容のハッシュ(Noneの時は計算する)
+    Returns:
+        Table:  都道府県・感染症ごとの行(全国の行はpref_noが-1)
+    """
+    n_pref, n = len(table.prefs), len(table.diseases)
+    report, teito = table.report.ravel(), table.teito.ravel()
+    pref_no = np.repeat(np.arange(n_pref), n)
+    col = np.tile(np.arange(n), n_pref)
+    if not np.isnan(table.total_teito).all():   # 全国(総数)の行
+        report = np.concatenate([table.total_report, report])
+        teito = np.concatenate([table.total_teito, teito])
+        pref_no = np.concatenate([np.full(n, -1), pref_no])
+        col = np.concatenate([np.arange(n), col])
+    prefs = [teiten.TOTAL] + list(table.prefs)
+    columns = [
+        pa.array(np.full(len(col), int(table.year)), pa.int16())
+        , pa.array(np.full(len(col), int(table.week)), pa.int8())
+        , pa.array(col, pa.int8())
+        , pa.DictionaryArray.from_arrays(pa.array(col, pa.int8()), pa.array(table.diseases, pa.string()))
+        , pa.array(pref_no, pa.int8())
+        , pa.DictionaryArray.from_arrays(pa.array(pref_no + 1, pa.int8()), pa.array(prefs, pa.string()))
+        , pa.array(report, pa.float64(), from_pandas=True)     # NaNはnull
+        , pa.array(teito, pa.float64(), from_pandas=True)]
+    metadata = {"title": table.title, "digest": digest or table_digest(table)}
+    return pa.Table.from_arrays(columns, schema=SCHEMA.with_metadata(metadata))
+
+def week_path(root:str, year:str, week:str, fmt:str="arrow") -> str:
+    return os.path.join(root, str(year), f"{week}{FORMATS[fmt]}")
+
+def file_digest(path:str, fmt:str="arrow") -> Optional[str]:
+    """
+    書き出したファイルの内容のハッシュ(スキーマのメタデータだけ読む、ファイルがない時や読めない時はNone)
+    """
+    if not os.path.exists(path): return None
+    try:
+        if fmt == "parquet":
+            import pyarrow.parquet as pq
+            metadata = pq.read_schema(path).metadata
+        else:
+            metadata = pa.ipc.open_file(pa.memory_map(path)).schema.metadata
+    except (OSError, pa.ArrowInvalid):
+        return None
+    digest = (metadata or {}).get(b"digest")
+    return digest.decode("utf-8") if digest else None
+
+def write_week(root:str, table:teiten.TeitenTable, fmt:str="arrow", digest:Optional[str]=None) -> str:
+    """
+    1週分を書き出す(一時ファイルに書いてから置き換える)
+    Args:
+        str:            出力先フォルダ
+        TeitenTable:    週報データ
+        str:            形式(arrow, parquet)
+        str:            内容のハッシュ(Noneの時は計算する)
+    Returns:
+        str:    書き出したファイルのパス
+    """
+    path = week_path(root, table.year, table.week, fmt)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    data = to_arrow(table, digest)
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+        pq.write_table(data, tmp)
+    else:   # 読む時にメモリマップでそのまま使えるよう圧縮しない
+        with pa.OSFile(tmp, "wb") as sink, pa.ipc.new_file(sink, data.schema) as writer:
+            writer.write_table(data)
+    os.replace(tmp, path)
+    return path
+
+def export(store:TeitenStore, root:str, fmt:str="arrow"
+            , start:Optional[Tuple[str, str]]=None, end:Optional[Tuple[str, str]]=None) -> Dict[str, int]:
+    """
+    保存した週報データを書き出す(書き出した後に内容が変わった週と、まだ書き出していない週だけ)
+    再検証で変更がなかった週は取得日時が変わっても書き出し直さない
+    Args:
+        TeitenStore:    週報データの保存先
+        str:            出力先フォルダ
+        str:            形式(arrow, parquet)
+        tuple:          最初の(年, 週)(Noneの時は最初から)
+        tuple:          最後の(年, 週)(Noneの時は最後まで)
+    Returns:
+        dict:   written(書き出した週の数), skipped(変わっていない週の数)
+    """
+    counts = {"written": 0, "skipped": 0}
+    for year, week, digest in store.weeks():
+        if (start and (year, week) < start) or (end and (year, week) > end): continue
+        digest = digest or store.fill_digest(year, week)   # ハッシュの列を追加する前に保存した週
+        if digest is None: continue
+        if file_digest(week_path(root, year, week, fmt), fmt) == digest:
+            counts["skipped"] += 1
+            continue
+        table = store.get_week(year, week)
+        if table is None: continue
+        write_week(root, table, fmt, digest)
+        counts["written"] += 1
+    return counts
+
+class WeeklyDataset():
+    """
+    書き出した週報データの読み込み(Arrow IPCはメモリマップで読むので、読んだ範囲のファイルをコピーしない)
+    """
+    def __init__(self, root:str, fmt:str="arrow") -> None:
+        """
+        コンストラクタ
+        Args:
+            str:    書き出したフォルダ
+            str:    形式(arrow, parquet)
+        """
+        self.root = root
+        self.fmt = fmt
+
+    def weeks(self, start:Optional[Tuple[str, str]]=None, end:Optional[Tuple[str, str]]=None) -> List[Tuple[str, str]]:
+        """
+        書き出してある週(週の順)
+        Args:
+            tuple:  最初の(年, 週)(Noneの時は最初から)
+            tuple:  最後の(年, 週)(Noneの時は最後まで)
+        Returns:
+            list:   (年, 週)のリスト
+        """
+        ext = FORMATS[self.fmt]
+        found = []
+        for year in sorted(os.listdir(self.root)) if os.path.isdir(self.root) else []:
+            if not year.isdigit(): continue
+            for name in os.listdir(os.path.join(self.root, year)):
+                if name.endswith(ext):
+                    found.append((year, name[:-len(ext)]))
+        return [w for w in sorted(found) if not (start and w < start) and not (end and w > end)]
+
+    def read_week(self, year:str, week:str) -> pa.Table:
+        """
+        1週分を読み込む
+        """
+        path = week_path(self.root, year, week, self.fmt)
+        if self.fmt == "parquet":
+            import pyarrow.parquet as pq
+            return pq.read_table(path, memory_map=True)
+        return pa.ipc.open_file(pa.memory_map(path)).read_all()
+
+    def read(self, start:Optional[Tuple[str, str]]=None, end:Optional[Tuple[str, str]]=None
+            , diseases:Optional[List[str]]=None, columns:Optional[List[str]]=None) -> pa.Table:
+        """
+        期間の週報データを1つのTableにまとめて読み込む
+        Args:
+            tuple:  最初の(年, 週)(Noneの時は最初から)
+            tuple:  最後の(年, 週)(Noneの時は最後まで)
+            list:   感染症名のリスト(Noneの時は全て)
+            list:   列名のリスト(Noneの時は全て)
+        Returns:
+            Table:  週報データ(週の順)
+        """
+        parts = []
+        for year, week in self.weeks(start, end):
+            data = self.read_week(year, week)
+            if diseases is not None:
+                data = data.filter(pc.is_in(data["disease"].cast(pa.string()), pa.array(diseases)))
+            parts.append(data.select(columns) if columns else data)
+        if not parts:
+            schema = SCHEMA if not columns else pa.schema([SCHEMA.field(c) for c in columns])
+            return schema.empty_table()
+        return pa.concat_tables([p.replace_schema_metadata(None) for p in parts])
+
+    def matrix(self, disease:str, metric:str=teiten.METRIC_TEITO, start:Optional[Tuple[str, str]]=None
+                , end:Optional[Tuple[str, str]]=None) -> Tuple[List[Tuple[str, str]], List[str], np.ndarray]:
+        """
+        1つの感染症の 週×都道府県 の配列(teiten.week_matrixと同じ形、全国の行は含まない)
+        Args:
+            str:    感染症名
+            str:    報告か定当か
+            tuple:  最初の(年, 週)
+            tuple:  最後の(年, 週)
+        Returns:
+            list:       (年, 週)のリスト
+            list:       都道府県名のリスト
+            ndarray:    週×都道府県の配列(データがない所はNaN)
+        """
+        weeks = self.weeks(start, end)
+        data = self.read(start, end, [disease], ["year", "week", "pref_no", "pref", "report", "teito"])
+        data = data.filter(pc.greater_equal(data["pref_no"], 0))
+        value = "teito" if metric == teiten.METRIC_TEITO else "report"
+        n_pref = int(pc.max(data["pref_no"]).as_py()) + 1 if data.num_rows else 0
+        prefs = [""] * n_pref
+        for no, pref in zip(data["pref_no"].to_numpy(), data["pref"].cast(pa.string()).to_pylist()):
+            prefs[no] = pref
+        index = {(int(y), int(w)): i for i, (y, w) in enumerate(weeks)}
+        rows = np.array([index[k] for k in zip(data["year"].to_numpy(), data["week"].to_numpy())], dtype=int)
+        values = np.full((len(weeks), n_pref), np.nan)
+        values[rows, data["pref_no"].to_numpy()] = data[value].to_numpy(zero_copy_only=False)
+        return weeks, prefs, values
+
+def _year_week(text:str) -> Tuple[str, str]:
+    return teiten.year_week(datetime.strptime(text, "%Y/%m/%d").date())
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="保存した定点把握疾患の週報データをArrow IPCかParquetで書き出す")
+    parser.add_argument("--out", default="data/teiten", help="出力先フォルダ")
+    parser.add_argument("--format", choices=list(FORMATS), default="arrow", help="形式")
+    parser.add_argument("--start", type=_year_week, help="開始日(例:2023/01/02)")
+    parser.add_argument("--end", type=_year_week, help="終了日")
+    parser.add_argument("--db", default="cache/teiten.sqlite3", help="週報データのデータベース")
+    args = parser.parse_args()
+    print(export(TeitenStore(args.db), args.out, args.format, args.start, args.end))
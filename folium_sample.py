@@ -59,11 +59,10 @@ def get_csv_from_web():
         name_i = shippei[1].replace('"', '')             # インフルエンザ
         next(res)   # 4行目
         next(res)   # 5行目
-        data = res.read()
-        data = data.decode('cp932')
-        data = data.splitlines()
-    rows_c = [(row[0], float(row[38])) for row in csv.reader(data) if row[38]]   # 都道府県とCOVID-19定当を取得
-    rows_i = [(row[0], float(row[2])) for row in csv.reader(data) if row[2]]   # 都道府県とインフルエンザ定当を取得
+        rows_c, rows_i = [], []
+        for row in csv.reader(line.decode('cp932') for line in res):    # 1行ずつデコード
+            if row[38]: rows_c.append((row[0], float(row[38])))     # 都道府県とCOVID-19定当を取得
+            if row[2]: rows_i.append((row[0], float(row[2])))       # 都道府県とインフルエンザ定当を取得
     # 定当の最大値
     max_value = max(max([x[1] for x in rows_c]), max([x[1] for x in rows_i]))
     return rows_c, rows_i, name_c, name_i, title, max_value
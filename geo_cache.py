@@ -0,0 +1,307 @@
+"""
+地図データ(TopoJSON)のキャッシュ
+"""
+
+import hashlib, json, os, shutil, threading, time
+import topology
+from geo_store import GeometryStore
+from typing import Optional       # 関数アノテーション用
+
+# 全国都道府県のTopoJSON
+PREF_TOPO_URL = "https://raw.githubusercontent.com/smartnews-smri/japan-topography/main/data/municipality/topojson/s0010/prefectures.json"
+# 全国市区町村のTopoJSON(そのままでは重いので単純化したものを使う)
+MUNI_TOPO_URL = "https://raw.githubusercontent.com/smartnews-smri/japan-topography/main/data/municipality/topojson/s0001/N03-21_210101.json"
+LOD_ZOOMS = (5, 7, 9, 11)  # 単純化したデータを作るズームレベル
+
+class GeometryCache():
+    """
+    地図データのキャッシュ
+    URLをキーにしてディスクに保存し、読み込んだオブジェクトはメモリで共有する
+    """
+    def __init__(self, cache_dir:str="cache/geometry", ttl:float=7 * 24 * 3600
+                , max_bytes:int=200 * 1024 * 1024, offline:bool=False) -> None:
+        """
+        コンストラクタ
+        Args:
+            str:    キャッシュフォルダ
+            float:  有効期間(秒) 過ぎたらETag/Last-Modifiedで再検証する
+            int:    キャッシュフォルダの上限サイズ(バイト) 超えたら古いものから削除
+            bool:   ネットワークを使わない
+        """
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self._memory = {}               # URLをキーにした読み込み済みオブジェクト
+        self._lock = threading.Lock()
+        self.hits = 0                   # メモリまたはディスクから返した回数
+        self.misses = 0                 # ダウンロードした回数
+        self.bytes_downloaded = 0       # ダウンロードしたバイト数
+
+    def _paths(self, url:str) -> tuple:
+        """
+        URLに対応するデータファイルとメタファイルのパス
+        Args:
+            str:    URL
+        Returns:
+            tuple:  データファイルのパス、メタファイルのパス
+        """
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        base = os.path.join(self.cache_dir, key)
+        return base + ".json", base + ".meta"
+
+    def _read_meta(self, meta_path:str) -> dict:
+        """
+        メタ情報の読み込み(ないときは空の辞書)
+        """
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write(self, path:str, data, mode:str="wb") -> None:
+        """
+        一時ファイルに書いてから置き換える(途中で止まっても壊れたファイルを残さない)
+        """
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, mode) as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def seed(self, url:str, fixture_path:str) -> None:
+        """
+        ローカルのファイルをURLのキャッシュとして登録する(オフライン用)
+        Args:
+            str:    URL
+            str:    ローカルのファイル
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        data_path, meta_path = self._paths(url)
+        shutil.copyfile(fixture_path, data_path)
+        self._drop_derived(url)
+        meta = {"url": url, "fetched": time.time(), "etag": None, "last_modified": None}
+        self._write(meta_path, json.dumps(meta), "w")
+        with self._lock:   # 変換結果も含めて読み直す
+            for key in [k for k in self._memory if k.startswith(f"{url}#")]:
+                del self._memory[key]
+            self._memory.pop(url, None)
+
+    def get_json(self, url:str):
+        """
+        URLのJSONを取得
+        メモリ→ディスク(有効期間内)→再検証またはダウンロードの順に探す
+        Args:
+            str:    URL
+        Returns:
+            object: JSONを読み込んだオブジェクト(呼び出し側で変更しないこと)
+        """
+        with self._lock:
+            if url in self._memory:     # 同じセッションで読み込み済み
+                self.hits += 1
+                return self._memory[url]
+            data_path, meta_path = self._paths(url)
+            meta = self._read_meta(meta_path)
+            cached = os.path.exists(data_path)
+            expired = time.time() - meta.get("fetched", 0) > self.ttl
+            if not cached or (expired and not self.offline):
+                self._fetch(url, data_path, meta_path, meta if cached else {})
+            else:
+                self.hits += 1
+                os.utime(data_path)     # 最終使用日時の更新(削除の順番に使う)
+            with open(data_path, "rb") as f:
+                obj = json.loads(f.read())
+            self._memory[url] = obj
+            return obj
+
+    def get_lod(self, url:str, zoom:Optional[int]=None) -> dict:
+        """
+        ズームレベルに合わせて単純化・量子化したTopoJSONを取得
+        LOD_ZOOMSのうちzoom以上で最も小さいレベルのものを使う(なければ元のデータ)
+        作成したものはディスクに保存し、次回からは読み込むだけにする
+        Args:
+            str:    TopoJSONのURL
+            int:    表示するズームレベル(Noneの時は元のデータ)
+        Returns:
+            dict:   TopoJSONデータ(呼び出し側で変更しないこと)
+        """
+        level = next((z for z in LOD_ZOOMS if zoom is not None and z >= zoom), None)
+        if level is None: return self.get_json(url)
+        source = self.get_json(url)     # 元データの再検証もここで行う
+        key = f"{url}#lod{level}"
+        with self._lock:
+            if key in self._memory: return self._memory[key]
+            data_path, _ = self._paths(key)
+            if os.path.exists(data_path):
+                os.utime(data_path)     # 最終使用日時の更新(削除の順番に使う)
+                with open(data_path, "rb") as f:
+                    obj = json.loads(f.read())
+            else:
+                obj = topology.prepare_lod(source, level)
+                os.makedirs(self.cache_dir, exist_ok=True)
+                self._write(data_path, json.dumps(obj, ensure_ascii=False, separators=(",", ":")), "w")
+            # 元のデータより重くなる場合は元のデータを使う
+            if len(obj["arcs"]) and sum(map(len, obj["arcs"])) >= sum(map(len, source["arcs"])):
+                obj = source
+            self._memory[key] = obj
+            return obj
+
+    def get_store(self, url:str, zoom:Optional[int]=None, object_name:str="prefectures"
+                , key:str="N03_001") -> GeometryStore:
+        """
+        get_lodのTopoJSONをデコードした地域の形を取得
+        作成したものはディスクに保存し、次回からはメモリマップで読み込むだけにする
+        作成元のTopoJSONのファイルの内容が変わっていたら作り直す
+        Args:
+            str:    TopoJSONのURL
+            int:    表示するズームレベル(Noneの時は元のデータ)
+            str:    オブジェクト名
+            str:    地域名のプロパティ
+        Returns:
+            GeometryStore:  地域の形(読み取り専用)
+        """
+        topo = self.get_lod(url, zoom)
+        level = next((z for z in LOD_ZOOMS if zoom is not None and z >= zoom), None)
+        mem_key = f"{url}#store{level}#{object_name}"
+        with self._lock:
+            cached = self._memory.get(mem_key)
+            if cached is not None and cached[0] is topo: return cached[1]
+            source_path = self._paths(url if level is None else f"{url}#lod{level}")[0]
+            # 作成元のファイルの内容のハッシュ(更新日時は読むたびに最終使用日時として更新されるので使わない)
+            with open(source_path, "rb") as f:
+                source = hashlib.sha1(f.read()).hexdigest()
+            path = self._store_path(mem_key)
+            store = None
+            if os.path.exists(path):
+                try:
+                    store = GeometryStore.load(path)
+                except ValueError:
+                    store = None
+                if store is not None and (store.header.get("source") != source or store.key != key):
+                    store = None
+            if store is None:
+                store = GeometryStore.from_topology(topo, object_name, key)
+                os.makedirs(self.cache_dir, exist_ok=True)
+                store.save(path, source=source)
+                store = GeometryStore.load(path)
+            else:
+                os.utime(path)      # 最終使用日時の更新(削除の順番に使う)
+            self._memory[mem_key] = (topo, store)
+            return store
+
+    def _store_path(self, key:str) -> str:
+        """
+        地域の形のファイルのパス
+        """
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + ".geo")
+
+    def prepare(self, url:str) -> None:
+        """
+        LOD_ZOOMSのすべてのレベルの単純化したデータを作成
+        Args:
+            str:    TopoJSONのURL
+        """
+        for zoom in LOD_ZOOMS:
+            self.get_lod(url, zoom)
+
+    def _drop_derived(self, url:str) -> None:
+        """
+        元データが更新された時に単純化したデータを削除
+        """
+        # 地域の形のファイルは作成元の内容のハッシュで作り直すので、メモリからだけ削除
+        for key in [k for k in self._memory if k.startswith(f"{url}#store")]:
+            del self._memory[key]
+        for zoom in LOD_ZOOMS:
+            key = f"{url}#lod{zoom}"
+            self._memory.pop(key, None)
+            try:
+                os.remove(self._paths(key)[0])
+            except OSError:
+                pass
+
+    def get_geojson(self, url:str, object_name:str, zoom:Optional[int]=None) -> dict:
+        """
+        TopoJSONのオブジェクトをGeoJSONに変換して取得(変換結果もメモリで共有する)
+        Args:
+            str:    TopoJSONのURL
+            str:    オブジェクト名
+            int:    表示するズームレベル(単純化したデータを使う、Noneの時は元のデータ)
+        Returns:
+            dict:   GeoJSONデータ(呼び出し側で変更しないこと)
+        """
+        key = f"{url}#{object_name}#{zoom}"
+        if key not in self._memory:
+            geojson = self.get_store(url, zoom, object_name).to_geojson()
+            with self._lock:
+                self._memory[key] = geojson
+        return self._memory[key]
+
+    def _fetch(self, url:str, data_path:str, meta_path:str, meta:dict) -> None:
+        """
+        ダウンロード(キャッシュがあれば条件付きリクエストで再検証)
+        Args:
+            str:    URL
+            str:    データファイルのパス
+            str:    メタファイルのパス
+            dict:   キャッシュのメタ情報(キャッシュがない場合は空)
+        """
+        if self.offline:
+            raise FileNotFoundError(f"キャッシュがありません:{url}")
+        import requests     # 読み込みに時間がかかるので取得する時だけ読み込む
+        headers = {}
+        if meta.get("etag"): headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"): headers["If-Modified-Since"] = meta["last_modified"]
+        try:
+            res = requests.get(url, headers=headers, timeout=30)
+            res.raise_for_status()
+        except requests.RequestException:
+            if meta: return             # 通信できない時は期限切れでもキャッシュを使う
+            raise
+        if res.status_code == 304:      # 変更なし
+            self.hits += 1
+        else:
+            self.misses += 1
+            self.bytes_downloaded += len(res.content)
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._write(data_path, res.content)
+            self._drop_derived(url)
+            meta["etag"] = res.headers.get("ETag")
+            meta["last_modified"] = res.headers.get("Last-Modified")
+        meta["url"] = url
+        meta["fetched"] = time.time()
+        self._write(meta_path, json.dumps(meta), "w")
+        self._evict(keep=data_path)
+
+    def _evict(self, keep:Optional[str]=None) -> None:
+        """
+        上限サイズを超えていたら最終使用日時の古いものから削除
+        Args:
+            str:    削除しないファイル(今使うもの)
+        """
+        files = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith((".json", ".geo")): continue
+            path = os.path.join(self.cache_dir, name)
+            st = os.stat(path)
+            files.append((st.st_mtime, st.st_size, path))
+        total = sum(x[1] for x in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes: break
+            if path == keep: continue
+            os.remove(path)
+            total -= size
+            if not path.endswith(".json"): continue
+            try:
+                os.remove(path[:-len(".json")] + ".meta")
+            except OSError:
+                pass
+
+# アプリ全体で共有するキャッシュ
+default_cache = GeometryCache()
+
+if __name__ == '__main__':
+    # 単純化したデータを作成してキャッシュに保存(python geo_cache.py [TopoJSONのURL ...])
+    import sys
+    for url in sys.argv[1:] or [PREF_TOPO_URL]:
+        default_cache.prepare(url)
+        print(f'prepared:{url}')
@@ -0,0 +1,255 @@
+"""
+地図データの形の保存形式(TopoJSONをデコードした座標と地域の索引)
+arcsの座標はデコードした配列のままファイルに保存し、読み込みはメモリマップで行う(読み込み後も配列は読み取り専用)
+地図ごとの値はTopoJSONに書き込まず、地域ごとの新しいpropertiesを作って重ねる
+
+ファイル
+    MAGIC, ヘッダーの長さ(uint32), ヘッダー(JSON), 配列(8バイト境界)
+    ヘッダー    オブジェクト名、地域名のプロパティ、地域ごとの形の種類とproperties、配列の型・形・位置
+    配列        coords(全てのarcの座標) arc_offsets(arcごとの座標の位置) ring_arcs(リングのarcの番号、負の番号は逆向き)
+                ring_offsets(リングごとの位置) polygon_offsets(ポリゴンごとのリングの位置) feature_offsets(地域ごとのポリゴンの位置)
+"""
+
+import json, mmap, os, struct
+import numpy as np
+from typing import Dict, List, Optional       # 関数アノテーション用
+
+MAGIC = b"GEOSTORE"
+HEADER = struct.Struct("<I")    # ヘッダーの長さ
+ARRAYS = ("coords", "arc_offsets", "ring_arcs", "ring_offsets", "polygon_offsets", "feature_offsets")
+
+def decode_coords(topo:dict) -> tuple:
+    """
+    arcsを1つの座標の配列に変換(量子化されている場合は累積和とtransformで元の座標に戻す)
+    Args:
+        dict:   TopoJSONデータ
+    Returns:
+        ndarray:    全てのarcの座標(点の数×2)
+        ndarray:    arcごとの座標の開始位置(arcの数+1)
+    """
+    lengths = np.array([len(arc) for arc in topo["arcs"]], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    coords = np.array([p[:2] for arc in topo["arcs"] for p in arc], dtype=float).reshape(-1, 2)
+    transform = topo.get("transform")
+    if transform and len(coords):
+        # 量子化されたarcは前の点からの差分なので、全体の累積和からarcの開始位置の直前の値を引く
+        total = np.cumsum(coords, axis=0)
+        base = np.vstack([[0.0, 0.0], total])[offsets[:-1]]
+        coords = (total - np.repeat(base, lengths, axis=0)) * transform["scale"] + transform["translate"]
+    return coords, offsets
+
+def _polygons(geometry:dict) -> list:
+    """
+    geometryのポリゴン(リングのarc番号のリスト)のリスト(形がないものは空のリスト)
+    """
+    kind = geometry.get("type")
+    if kind == "Polygon": return [geometry["arcs"]]
+    if kind == "MultiPolygon": return geometry["arcs"]
+    if kind is None: return []
+    raise ValueError(f"対応していない形です:{kind}")
+
+class GeometryStore():
+    """
+    地域の形と地域名の索引(読み取り専用なので、複数のスレッドの地図作成で共有できる)
+    """
+    def __init__(self, header:dict, arrays:Dict[str, np.ndarray]) -> None:
+        """
+        コンストラクタ(from_topologyかloadで作成する)
+        Args:
+            dict:   ヘッダー(object, key, types, properties)
+            dict:   配列名をキーにした配列
+        """
+        self.header = header
+        self.object_name = header["object"]
+        self.key = header["key"]
+        self.types = header["types"]
+        self._properties = header["properties"]
+        for name in ARRAYS:
+            setattr(self, name, arrays[name])
+        self.names = [p.get(self.key, "") for p in self._properties]    # 地域名(形の順)
+        self.index = {}     # 地域名をキーにした形の番号
+        for i, name in enumerate(self.names):
+            self.index.setdefault(name, i)
+
+    @classmethod
+    def from_topology(cls, topo:dict, object_name:str="prefectures", key:str="N03_001") -> "GeometryStore":
+        """
+        TopoJSONのオブジェクトから作成
+        Args:
+            dict:   TopoJSONデータ
+            str:    オブジェクト名
+            str:    地域名のプロパティ
+        Returns:
+            GeometryStore:  地域の形
+        """
+        coords, arc_offsets = decode_coords(topo)
+        geometries = topo["objects"][object_name]["geometries"]
+        ring_arcs, ring_offsets, polygon_offsets, feature_offsets = [], [0], [0], [0]
+        for g in geometries:
+            for polygon in _polygons(g):
+                for ring in polygon:
+                    ring_arcs.extend(ring)
+                    ring_offsets.append(len(ring_arcs))
+                polygon_offsets.append(len(ring_offsets) - 1)
+            feature_offsets.append(len(polygon_offsets) - 1)
+        header = {"object": object_name, "key": key, "types": [g.get("type") for g in geometries]
+                , "properties": [g.get("properties", {}) for g in geometries]}
+        arrays = {"coords": coords, "arc_offsets": arc_offsets, "ring_arcs": np.array(ring_arcs, dtype=np.int32)
+                , "ring_offsets": np.array(ring_offsets, dtype=np.int64)
+                , "polygon_offsets": np.array(polygon_offsets, dtype=np.int64)
+                , "feature_offsets": np.array(feature_offsets, dtype=np.int64)}
+        return cls(header, arrays)
+
+    def save(self, path:str, **extra) -> None:
+        """
+        ファイルに保存(一時ファイルに書いてから置き換える)
+        Args:
+            str:    ファイルのパス
+            dict:   ヘッダーに追加する情報(作成元のファイルの内容のハッシュなど)
+        """
+        arrays, offset = {}, 0
+        for name in ARRAYS:
+            a = np.ascontiguousarray(getattr(self, name))
+            arrays[name] = [a.dtype.str, list(a.shape), offset]
+            offset += (a.nbytes + 7) // 8 * 8
+        header = dict(self.header, **extra, arrays=arrays)
+        text = json.dumps(header, ensure_ascii=False).encode("utf-8")
+        text += b" " * (-(len(MAGIC) + HEADER.size + len(text)) % 8)   # 配列を8バイト境界に置く
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(MAGIC + HEADER.pack(len(text)) + text)
+            for name in ARRAYS:
+                data = np.ascontiguousarray(getattr(self, name)).tobytes()
+                f.write(data + b"\0" * (-len(data) % 8))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path:str) -> "GeometryStore":
+        """
+        ファイルをメモリマップで読み込む(配列はファイルの内容をコピーせずに参照する)
+        Args:
+            str:    ファイルのパス
+        Returns:
+            GeometryStore:  地域の形(ヘッダーのextraはheaderに含まれる)
+        """
+        with open(path, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if buffer[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"地図データの形のファイルではありません:{path}")
+        start = len(MAGIC) + HEADER.size
+        size, = HEADER.unpack_from(buffer, len(MAGIC))
+        header = json.loads(bytes(buffer[start:start + size]).decode("utf-8"))
+        start += size
+        arrays = {}
+        for name, (dtype, shape, offset) in header.pop("arrays").items():
+            count = int(np.prod(shape))
+            arrays[name] = np.frombuffer(buffer, dtype, count, start + offset).reshape(shape)
+        return cls(header, arrays)
+
+    def __len__(self) -> int:
+        return len(self.types)
+
+    def arc(self, i:int) -> np.ndarray:
+        """
+        arcの座標(負の番号は逆向き、どちらも配列のビュー)
+        """
+        j = i if i >= 0 else ~i
+        coords = self.coords[self.arc_offsets[j]:self.arc_offsets[j + 1]]
+        return coords if i >= 0 else coords[::-1]
+
+    def ring(self, r:int) -> np.ndarray:
+        """
+        リングの座標(arcをつなぐ、つなぎ目の点は重複させない)
+        """
+        arcs = self.ring_arcs[self.ring_offsets[r]:self.ring_offsets[r + 1]]
+        parts = [self.arc(int(i)) if k == 0 else self.arc(int(i))[1:] for k, i in enumerate(arcs)]
+        return np.concatenate(parts) if parts else np.empty((0, 2))
+
+    def rings(self, feature) -> List[List[np.ndarray]]:
+        """
+        地域のポリゴンごとのリングの座標
+        Args:
+            int:    形の番号か地域名
+        Returns:
+            list:   ポリゴンごとのリングの座標(点の数×2の配列)のリスト
+        """
+        i = self.index[feature] if isinstance(feature, str) else feature
+        return [[self.ring(r) for r in range(self.polygon_offsets[p], self.polygon_offsets[p + 1])]
+                for p in range(self.feature_offsets[i], self.feature_offsets[i + 1])]
+
+    def geometry(self, feature) -> Optional[dict]:
+        """
+        地域のGeoJSONのgeometry(形がない時はNone)
+        Args:
+            int:    形の番号か地域名
+        """
+        i = self.index[feature] if isinstance(feature, str) else feature
+        kind = self.types[i]
+        if kind is None: return None
+        polygons = [[r.tolist() for r in rings] for rings in self.rings(i)]
+        return {"type": kind, "coordinates": polygons[0] if kind == "Polygon" else polygons}
+
+    def properties(self, feature) -> dict:
+        """
+        地域のproperties(共有しているので変更しないこと)
+        """
+        return self._properties[self.index[feature] if isinstance(feature, str) else feature]
+
+    def to_geojson(self) -> dict:
+        """
+        GeoJSONのFeatureCollection(topology.to_geojsonと同じ、featureのidは形の順番)
+        """
+        features = [{"type": "Feature", "id": str(i), "properties": self._properties[i], "geometry": self.geometry(i)}
+                    for i in range(len(self))]
+        return {"type": "FeatureCollection", "features": features}
+
+    def overlay(self, values:dict, field:str="teito") -> List[dict]:
+        """
+        地域ごとの値を追加した新しいproperties(形の順、元のpropertiesは変更しない)
+        Args:
+            dict:   地域名をキーにした値
+            str:    値のプロパティ名
+        Returns:
+            list:   地域ごとのproperties(値がない地域は元のpropertiesのコピー)
+        """
+        overlay = [dict(p) for p in self._properties]
+        for name, value in values.items():
+            i = self.index.get(name)
+            if i is not None:   # 地図データにない地域名は無視
+                overlay[i][field] = value
+        return overlay
+
+    def join(self, topo:dict, values:dict, field:str="teito") -> dict:
+        """
+        地域ごとの値を追加したTopoJSON(geometriesとpropertiesだけ新しく作り、arcsなどは元のデータと共有)
+        foliumのTopoJsonは描画する時にpropertiesにstyleを書き込むので、共有しているTopoJSONを直接渡さずにこれを渡す
+        Args:
+            dict:   このGeometryStoreを作成したTopoJSONデータ
+            dict:   地域名をキーにした値
+            str:    値のプロパティ名
+        Returns:
+            dict:   TopoJSONデータ
+        """
+        obj = topo["objects"][self.object_name]
+        if len(obj["geometries"]) != len(self):
+            raise ValueError("地図データと地域の形が一致しません")
+        geometries = [dict(g, properties=p) for g, p in zip(obj["geometries"], self.overlay(values, field))]
+        objects = dict(topo["objects"], **{self.object_name: dict(obj, geometries=geometries)})
+        return dict(topo, objects=objects)
+
+_stores = {}    # TopoJSONのidをキーにした(TopoJSON, GeometryStore)
+
+def for_topology(topo:dict, object_name:str="prefectures", key:str="N03_001") -> GeometryStore:
+    """
+    TopoJSONから作成した地域の形(ファイルに保存しない地図データ用、地図データが変わらない間は1回だけ作成)
+    Args:
+        dict:   TopoJSONデータ
+        str:    オブジェクト名
+        str:    地域名のプロパティ
+    Returns:
+        GeometryStore:  地域の形
+    """
+    cached = _stores.get((id(topo), object_name))
+    if cached is None or cached[0] is not topo:
+        cached = _stores[(id(topo), object_name)] = (topo, GeometryStore.from_topology(topo, object_name, key))
+    return cached[1]
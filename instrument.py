@@ -0,0 +1,149 @@
+"""
+処理時間の計測(地図作成の段階ごとの時間、キャッシュの利用回数、転送量)
+"""
+
+import io, logging, threading, time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, Optional       # 関数アノテーション用
+
+logger = logging.getLogger(__name__)
+
+# 段階名
+DOWNLOAD = "download"   # 週報csvのダウンロード
+DECODE = "decode"       # cp932のデコード
+PARSE = "parse"         # csvの読み込み
+GEOMETRY = "geometry"   # 地図データの読み込み
+BUILD = "build"         # 階級区分図の作成
+SAVE = "save"           # HTMLファイルの保存
+BROWSER = "browser"     # ブラウザで表示
+
+class Instrument():
+    """
+    段階ごとの処理時間とカウンタの記録
+    段階が終わるごとにloggingのDEBUGとcallbackに通知し、run()の終わりにINFOで集計を出力する
+    """
+    def __init__(self, callback:Optional[Callable[[str, float], None]]=None) -> None:
+        """
+        コンストラクタ
+        Args:
+            Callable:   段階が終わるごとに(段階名, 秒)を受け取る関数
+        """
+        self.callback = callback
+        self.seconds = {}       # 段階名をキーにした処理時間(秒)
+        self.counters = {}      # カウンタ名をキーにした回数・バイト数
+        self._lock = threading.Lock()
+        self._capture = None    # 次のrun()だけ行うプロファイル(出力先, メモリも計測するか)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.seconds = {}
+            self.counters = {}
+
+    def add(self, name:str, seconds:float) -> None:
+        """
+        段階の処理時間を加算
+        """
+        with self._lock:
+            self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+
+    def count(self, name:str, n:int=1) -> None:
+        """
+        カウンタを加算
+        """
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    @contextmanager
+    def stage(self, name:str, exclude:Iterable[str]=()) -> Iterator[None]:
+        """
+        withの中の処理時間を段階の時間として記録
+        Args:
+            str:    段階名
+            list:   withの中で別に記録される段階名(その時間は差し引く)
+        """
+        exclude = tuple(exclude)
+        before = sum(self.seconds.get(e, 0.0) for e in exclude)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start - (sum(self.seconds.get(e, 0.0) for e in exclude) - before)
+            self.add(name, elapsed)
+            logger.debug("%s: %.3f s", name, elapsed)
+            if self.callback: self.callback(name, elapsed)
+
+    def capture_next(self, path:Optional[str]=None, memory:bool=False) -> None:
+        """
+        次のrun()1回だけcProfile(とtracemalloc)で計測する
+        Args:
+            str:    cProfileの結果の保存先(Noneの時は上位の関数をログに出力)
+            bool:   tracemallocでメモリ使用量も計測するか
+        """
+        self._capture = (path, memory)
+
+    @contextmanager
+    def run(self, label:str, profile:bool=True) -> Iterator[None]:
+        """
+        1回の処理(地図作成など)の計測：カウンタを初期化し、終わったら集計をログに出力
+        Args:
+            str:    処理の名前(ログ用)
+            bool:   capture_nextのプロファイルを行うか(Falseの時は次のrun()に残す、先読みなど)
+        """
+        self.reset()
+        capture = None
+        if profile:
+            capture, self._capture = self._capture, None
+        profiler = None
+        if capture:
+            import cProfile
+            profiler = cProfile.Profile()
+            if capture[1]:
+                import tracemalloc
+                tracemalloc.start()
+            profiler.enable()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add("total", time.perf_counter() - start)
+            if profiler:
+                profiler.disable()
+                self._save_profile(profiler, *capture)
+            logger.info("%s %s", label, self.summary())
+
+    def _save_profile(self, profiler, path:Optional[str], memory:bool) -> None:
+        """
+        プロファイルの結果を保存またはログに出力
+        """
+        import cProfile, pstats, tracemalloc
+        if path:
+            profiler.dump_stats(path)
+            logger.info("profile: %s", path)
+        else:
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(20)
+            logger.info("profile:\n%s", out.getvalue())
+        if memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, cProfile.__file__)])
+            tracemalloc.stop()
+            top = "\n".join(str(s) for s in snapshot.statistics("lineno")[:10])
+            logger.info("memory: peak %.0f KB\n%s", peak / 1024, top)
+
+    def report(self) -> Dict[str, dict]:
+        """
+        計測結果
+        Returns:
+            dict:   seconds(段階ごとの時間), counters(カウンタ)
+        """
+        with self._lock:
+            return {"seconds": dict(self.seconds), "counters": dict(self.counters)}
+
+    def summary(self) -> str:
+        """
+        計測結果の1行の文字列
+        """
+        report = self.report()
+        times = " ".join(f"{k}={v:.3f}s" for k, v in report["seconds"].items())
+        counts = " ".join(f"{k}={v}" for k, v in report["counters"].items())
+        return f"{times} {counts}".strip()
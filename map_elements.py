@@ -0,0 +1,206 @@
+"""
+地図データを共有する地図要素(複数の地図で同じTopoJSONを1つだけ埋め込む)
+"""
+
+from branca.element import MacroElement
+from folium.elements import JSCSSMixin
+from jinja2 import Template
+
+class SharedTopoJson(MacroElement):
+    """
+    TopoJSONをページに1つだけ埋め込む(Figureに追加する)
+    地図ごとのSharedChoroplethから変数名で参照する
+    """
+    _template = Template("""
+        {% macro header(this, kwargs) %}
+        <script>
+            var {{ this.get_name() }} = {{ this.data|tojson }};
+            var {{ this.get_name() }}_features = {};
+            function {{ this.get_name() }}_feature(object_name) {
+                // GeoJSONへの変換も1回だけ行う
+                if (!(object_name in {{ this.get_name() }}_features)) {
+                    {{ this.get_name() }}_features[object_name] = topojson.feature(
+                        {{ this.get_name() }}, {{ this.get_name() }}.objects[object_name]);
+                }
+                return {{ this.get_name() }}_features[object_name];
+            }
+        </script>
+        {% endmacro %}
+        """)
+
+    def __init__(self, data:dict) -> None:
+        """
+        コンストラクタ
+        Args:
+            dict:   TopoJSONデータ
+        """
+        super().__init__()
+        self._name = "SharedTopoJson"
+        self.data = data
+
+class SharedChoropleth(JSCSSMixin, MacroElement):
+    """
+    SharedTopoJsonの地図データを使った階級区分図のレイヤー(Mapに追加する)
+    地図ごとに持つのは地域ごとの値と色だけ
+    """
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }}_values = {% if this.values_js %}{{ this.values_js }}{% else %}{{ this.values|tojson }}{% endif %};
+            var {{ this.get_name() }} = L.geoJson(
+                {{ this.shared.get_name() }}_feature({{ this.object_name|tojson }}),
+                {
+                    style: function(feature) {
+                        var v = {{ this.get_name() }}_values[feature.properties[{{ this.key|tojson }}]];
+                        return {
+                            fillColor: v === undefined ? {{ this.nan_fill_color|tojson }} : v[1],
+                            fillOpacity: {{ this.fill_opacity }},
+                            color: "black",
+                            weight: {{ this.line_weight }},
+                            opacity: 1
+                        };
+                    },
+                    onEachFeature: function(feature, layer) {
+                        var name = feature.properties[{{ this.key|tojson }}];
+                        var v = {{ this.get_name() }}_values[name];
+                        var text = "<b>{{ this.aliases[0] }}</b> " + name;
+                        if (v !== undefined) { text += "<br><b>{{ this.aliases[1] }}</b> " + v[0]; }
+                        layer.bindTooltip(text, {sticky: true});
+                    }
+                }
+            ).addTo({{ this._parent.get_name() }});
+        {% endmacro %}
+        """)
+
+    default_js = [
+        ("topojson", "https://cdnjs.cloudflare.com/ajax/libs/topojson/1.6.9/topojson.min.js"),
+    ]
+
+    def __init__(self, shared:SharedTopoJson, object_name:str, values:dict, key:str="N03_001"
+                , aliases:tuple=("地域", "人数"), fill_opacity:float=0.3, line_weight:float=2
+                , nan_fill_color:str="black", values_js:str="") -> None:
+        """
+        コンストラクタ
+        Args:
+            SharedTopoJson: 共有する地図データ
+            str:            TopoJSONのオブジェクト名
+            dict:           地域名をキーにした(値, 色)
+            str:            地域を特定するプロパティ
+            tuple:          ツールチップの地域と値の見出し
+            float:          透明度
+            float:          境界線の幅
+            str:            値がない地域の色
+            str:            値と色をJavaScriptの式で指定する場合の式(valuesの代わりに使う)
+        """
+        super().__init__()
+        self._name = "SharedChoropleth"
+        self.shared = shared
+        self.object_name = object_name
+        self.values = values
+        self.key = key
+        self.aliases = aliases
+        self.fill_opacity = fill_opacity
+        self.line_weight = line_weight
+        self.nan_fill_color = nan_fill_color
+        self.values_js = values_js
+
+class SharedTimeSlider(JSCSSMixin, MacroElement):
+    """
+    SharedTopoJsonの地図データを使った、週をスライダーで切り替える階級区分図のレイヤー(Mapに追加する)
+    週ごとに持つのは地域ごとの値と区分の番号の配列だけで、地域の順は地域名のリストで1回だけ持つ
+    """
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }}_data = {{ this.data|tojson }};
+            var {{ this.get_name() }}_index = {};
+            {{ this.get_name() }}_data.names.forEach(function(name, i) { {{ this.get_name() }}_index[name] = i; });
+            var {{ this.get_name() }}_week = {{ this.get_name() }}_data.labels.length - 1;
+            function {{ this.get_name() }}_at(feature) {
+                // 表示している週の地域の[値, 区分の番号](データがない地域はnull)
+                var d = {{ this.get_name() }}_data;
+                var i = {{ this.get_name() }}_index[feature.properties[{{ this.key|tojson }}]];
+                if (i === undefined || d.classes[{{ this.get_name() }}_week][i] < 0) { return null; }
+                return [d.values[{{ this.get_name() }}_week][i], d.classes[{{ this.get_name() }}_week][i]];
+            }
+            var {{ this.get_name() }} = L.geoJson(
+                {{ this.shared.get_name() }}_feature({{ this.object_name|tojson }}),
+                {
+                    style: function(feature) {
+                        var v = {{ this.get_name() }}_at(feature);
+                        return {
+                            fillColor: v === null ? {{ this.nan_fill_color|tojson }} : {{ this.get_name() }}_data.colors[v[1]],
+                            fillOpacity: v === null ? 0 : {{ this.fill_opacity }},
+                            color: "black",
+                            weight: {{ this.line_weight }},
+                            opacity: 1
+                        };
+                    },
+                    onEachFeature: function(feature, layer) {
+                        layer.bindTooltip(function() {
+                            var v = {{ this.get_name() }}_at(feature);
+                            var text = "<b>{{ this.aliases[0] }}</b> " + feature.properties[{{ this.key|tojson }}];
+                            if (v !== null) { text += "<br><b>{{ this.aliases[1] }}</b> " + v[0]; }
+                            return text;
+                        }, {sticky: true});
+                    }
+                }
+            ).addTo({{ this._parent.get_name() }});
+            // 週を選ぶスライダー
+            var {{ this.get_name() }}_control = L.control({position: "bottomleft"});
+            {{ this.get_name() }}_control.onAdd = function() {
+                var d = {{ this.get_name() }}_data;
+                var div = L.DomUtil.create("div", "leaflet-bar");
+                div.style.background = "white";
+                div.style.padding = "6px";
+                var input = L.DomUtil.create("input", "", div);
+                input.type = "range";
+                input.min = 0;
+                input.max = d.labels.length - 1;
+                input.value = {{ this.get_name() }}_week;
+                input.style.width = "300px";
+                var label = L.DomUtil.create("div", "", div);
+                label.textContent = d.labels[{{ this.get_name() }}_week];
+                input.addEventListener("input", function() {
+                    {{ this.get_name() }}_week = parseInt(input.value);
+                    label.textContent = d.labels[{{ this.get_name() }}_week];
+                    {{ this.get_name() }}.setStyle({{ this.get_name() }}.options.style);
+                });
+                L.DomEvent.disableClickPropagation(div);    // スライダーの操作で地図を動かさない
+                return div;
+            };
+            {{ this.get_name() }}_control.addTo({{ this._parent.get_name() }});
+        {% endmacro %}
+        """)
+
+    default_js = [
+        ("topojson", "https://cdnjs.cloudflare.com/ajax/libs/topojson/1.6.9/topojson.min.js"),
+    ]
+
+    def __init__(self, shared:SharedTopoJson, object_name:str, names:list, labels:list, values:list
+                , classes:list, colors:list, key:str="N03_001", aliases:tuple=("地域", "人数")
+                , fill_opacity:float=0.6, line_weight:float=1, nan_fill_color:str="white") -> None:
+        """
+        コンストラクタ
+        Args:
+            SharedTopoJson: 共有する地図データ
+            str:            TopoJSONのオブジェクト名
+            list:           地域名のリスト(値と区分の番号の列の順)
+            list:           週ごとの見出し(スライダーの順、最初は最後の週を表示)
+            list:           週×地域の値(データがない所はNone)
+            list:           週×地域の区分の番号(データがない所は-1)
+            list:           区分ごとの色
+            str:            地域を特定するプロパティ
+            tuple:          ツールチップの地域と値の見出し
+            float:          透明度
+            float:          境界線の幅
+            str:            値がない地域の色
+        """
+        super().__init__()
+        self._name = "SharedTimeSlider"
+        self.shared = shared
+        self.object_name = object_name
+        self.data = {"names": names, "labels": labels, "values": values, "classes": classes, "colors": colors}
+        self.key = key
+        self.aliases = aliases
+        self.fill_opacity = fill_opacity
+        self.line_weight = line_weight
+        self.nan_fill_color = nan_fill_color
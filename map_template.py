@@ -0,0 +1,81 @@
+"""
+地図の雛形(地図・地図データ・ツールチップは1回だけ作成し、値と色だけを差し込む)
+"""
+
+import folium, html, json, os
+from branca.element import Element
+from map_elements import SharedTopoJson, SharedChoropleth
+
+PAYLOAD = "__MAP_PAYLOAD__"     # 値と色を差し込む位置
+TITLE = "__MAP_TITLE__"         # タイトルを差し込む位置
+
+class MapTemplate():
+    """
+    階級区分図の雛形
+    地図ごとにfoliumの要素を作り直さず、作成済みのHTMLに値と色のJSONを差し込む
+    """
+    def __init__(self, topo_json_data:dict, location:list=[39.00, 137.00], zoom_start:int=6) -> None:
+        """
+        コンストラクタ：雛形のHTMLを作成
+        Args:
+            dict:   TopoJSONデータ
+            list:   地図の中心
+            int:    地図の倍率
+        """
+        self.topo_json_data = topo_json_data
+        map = folium.Map(location=location, tiles='Cartodb Positron', zoom_start=zoom_start)
+        shared = SharedTopoJson(topo_json_data)
+        map.get_root().add_child(shared)
+        # 値と色は差し込んだJSONのvaluesを使う
+        map.get_root().header.add_child(Element(f"<script>var map_payload = {PAYLOAD};</script>"), name="map_payload")
+        SharedChoropleth(shared, "prefectures", {}, values_js="map_payload.values").add_to(map)
+        # 凡例(差し込んだJSONのlegendから作成)
+        map.get_root().script.add_child(Element("""
+            var legend = L.control({position: "topright"});
+            legend.onAdd = function() {
+                var div = L.DomUtil.create("div");
+                div.style.background = "white";
+                div.style.padding = "4px";
+                var html = "<div>" + map_payload.caption + "</div><div style='display:flex'>";
+                map_payload.legend.forEach(function(x) {
+                    html += "<span title='" + x[1] + "' style='background:" + x[0] + ";width:" + (200 / map_payload.legend.length) + "px;height:10px'></span>";
+                });
+                html += "</div><div style='display:flex;justify-content:space-between'><span>"
+                    + map_payload.legend[0][1] + "</span><span>" + map_payload.legend[map_payload.legend.length - 1][1] + "</span></div>";
+                div.innerHTML = html;
+                return div;
+            };
+            legend.addTo(""" + map.get_name() + """);
+            """), name="map_legend")
+        map.get_root().html.add_child(Element(TITLE))
+        # 差し込む位置で分割しておく(差し込みは文字列の連結だけ)
+        head, rest = map.get_root().render().split(PAYLOAD, 1)
+        middle, tail = rest.split(TITLE, 1)
+        self._parts = (head, middle, tail)
+
+    def render(self, values:dict, legend:list, caption:str, title_html:str) -> str:
+        """
+        値と色を差し込んだHTMLの作成
+        Args:
+            dict:   地域名をキーにした(値, 色)
+            list:   凡例の(色, 見出し)のリスト
+            str:    凡例の見出し
+            str:    タイトルのHTML
+        Returns:
+            str:    HTML
+        """
+        payload = json.dumps({"values": values, "legend": legend, "caption": html.escape(caption)}, ensure_ascii=False)
+        head, middle, tail = self._parts
+        return "".join((head, payload.replace("</", "<\\/"), middle, title_html, tail))
+
+    def save(self, path:str, values:dict, legend:list, caption:str, title_html:str) -> str:
+        """
+        値と色を差し込んだHTMLをファイルに保存(一時ファイルに書いてから置き換える)
+        Returns:
+            str:    保存したファイルのパス
+        """
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(self.render(values, legend, caption, title_html))
+        os.replace(tmp, path)
+        return path
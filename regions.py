@@ -0,0 +1,237 @@
+"""
+地方別・全国の集計(週×都道府県の配列から地方ごとの定当、移動平均、前週比を計算)
+"""
+
+import functools
+import numpy as np
+from typing import List, Optional, Tuple       # 関数アノテーション用
+import teiten, topology
+
+# 8地方区分(都道府県は全国地方公共団体コードの順)
+REGIONS = {
+    "北海道": ["北海道"],
+    "東北": ["青森県", "岩手県", "宮城県", "秋田県", "山形県", "福島県"],
+    "関東": ["茨城県", "栃木県", "群馬県", "埼玉県", "千葉県", "東京都", "神奈川県"],
+    "中部": ["新潟県", "富山県", "石川県", "福井県", "山梨県", "長野県", "岐阜県", "静岡県", "愛知県"],
+    "近畿": ["三重県", "滋賀県", "京都府", "大阪府", "兵庫県", "奈良県", "和歌山県"],
+    "中国": ["鳥取県", "島根県", "岡山県", "広島県", "山口県"],
+    "四国": ["徳島県", "香川県", "愛媛県", "高知県"],
+    "九州": ["福岡県", "佐賀県", "長崎県", "熊本県", "大分県", "宮崎県", "鹿児島県", "沖縄県"],
+}
+REGION_NAMES = list(REGIONS)
+PREFS = [pref for prefs in REGIONS.values() for pref in prefs]
+_REGION_OF = {pref: r for r, prefs in enumerate(REGIONS.values()) for pref in prefs}
+
+# 定点の種類ごとの感染症(同じ種類の感染症は同じ医療機関が報告するので定点数が同じ)
+SENTINEL_TYPES = {
+    "インフルエンザ定点": [teiten.NAME_FLU, teiten.NAME_COVID],
+    "小児科定点": ["ＲＳウイルス感染症", "咽頭結膜熱", "Ａ群溶血性レンサ球菌咽頭炎", "感染性胃腸炎", "水痘", "手足口病"
+                , "伝染性紅斑", "突発性発しん", "ヘルパンギーナ", "流行性耳下腺炎"],
+    "眼科定点": ["急性出血性結膜炎", "流行性角結膜炎"],
+    "基幹定点": ["細菌性髄膜炎", "無菌性髄膜炎", "マイコプラズマ肺炎", "クラミジア肺炎", "感染性胃腸炎（ロタウイルス）"],
+}
+
+def sentinel_type(name:str) -> Optional[str]:
+    """
+    感染症の定点の種類(名前が一致するもの、なければ新型コロナとインフルエンザは含まれる文字列で探す)
+    """
+    for kind, names in SENTINEL_TYPES.items():
+        if name in names: return kind
+    if teiten.NAME_FLU in name or teiten.NAME_COVID in name: return "インフルエンザ定点"
+    return None
+
+def table_sentinels(table:teiten.TeitenTable, name:str, prefs:Optional[List[str]]=None) -> np.ndarray:
+    """
+    1週分の都道府県ごとの定点数(同じ種類の定点の感染症の報告数÷定当の中央値)
+    報告数が0の感染症は定当も0で定点数が分からないので、同じ週の同じ種類の定点の感染症から求める
+    Args:
+        TeitenTable:    週報データ
+        str:            感染症名
+        list:           都道府県名のリスト(Noneの時は週報データの順)
+    Returns:
+        ndarray:    定点数(都道府県、同じ種類のどの感染症でも分からない時はNaN)
+    """
+    kind = sentinel_type(name)
+    cols = [i for i, d in enumerate(table.diseases) if d == name or (kind and sentinel_type(d) == kind)]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        n = np.where(table.teito[:, cols] > 0, table.report[:, cols] / table.teito[:, cols], np.nan)
+    found = ~np.isnan(n).all(axis=1)
+    result = np.full(len(table.prefs), np.nan)
+    result[found] = np.nanmedian(n[found], axis=1)
+    if prefs is None: return result
+    index = {pref: i for i, pref in enumerate(table.prefs)}
+    return np.array([result[index[p]] if p in index else np.nan for p in prefs])
+
+@functools.lru_cache(maxsize=16)
+def _membership(prefs:Tuple[str, ...]) -> np.ndarray:
+    """
+    都道府県×地方の所属の行列(都道府県の並びごとに1回だけ作成)
+    """
+    m = np.zeros((len(prefs), len(REGIONS)))
+    for i, pref in enumerate(prefs):
+        if pref in _REGION_OF: m[i, _REGION_OF[pref]] = 1
+    return m
+
+def sentinels(report:np.ndarray, teito:np.ndarray, known:Optional[np.ndarray]=None) -> np.ndarray:
+    """
+    都道府県ごとの定点数(報告数÷定当、週ごとの値の中央値)
+    定当が0の週は定点数が分からないので、ほかの週の値か、同じ種類の定点の感染症から求めた値(known)を使う
+    Args:
+        ndarray:    報告数(週×都道府県)
+        ndarray:    定当(週×都道府県)
+        ndarray:    table_sentinelsで求めた定点数(週×都道府県、Noneの時は使わない)
+    Returns:
+        ndarray:    定点数(都道府県、どの週でも分からない時はNaN)
+    """
+    report, teito = np.atleast_2d(report), np.atleast_2d(teito)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        n = np.where(teito > 0, report / teito, np.nan)
+    if known is not None:
+        n = np.where(np.isnan(n), np.atleast_2d(known), n)
+    found = ~np.isnan(n).all(axis=0)
+    result = np.full(n.shape[1], np.nan)
+    result[found] = np.nanmedian(n[:, found], axis=0)
+    return result
+
+def _rate(report:np.ndarray, n:np.ndarray, m:np.ndarray) -> np.ndarray:
+    """
+    まとめた地域ごとの定当(報告数の合計÷定点数の合計)
+    定点数が分からない都道府県は集計に含めない。報告した都道府県が全て0の時は0(データなしにしない)
+    Args:
+        ndarray:    報告数(週×都道府県)
+        ndarray:    定点数(都道府県)
+        ndarray:    都道府県×地域の所属の行列
+    Returns:
+        ndarray:    定当(週×地域、データがない所はNaN)
+    """
+    reported = ~np.isnan(report)
+    valid = reported & ~np.isnan(n)      # 報告数と定点数が分かる都道府県だけ集計
+    total = np.where(valid, report, 0) @ m
+    count = np.where(valid, n, 0) @ m
+    all_zero = (reported @ m > 0) & (np.where(reported, report, 0) @ m == 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(count > 0, total / count, np.where(all_zero, 0.0, np.nan))
+
+def aggregate(report:np.ndarray, teito:np.ndarray, prefs:List[str], known:Optional[np.ndarray]=None) -> np.ndarray:
+    """
+    地方ごとの定当(地方の報告数の合計÷地方の定点数の合計、報告数が0の都道府県も定点数に含める)
+    Args:
+        ndarray:    報告数(週×都道府県)
+        ndarray:    定当(週×都道府県)
+        list:       都道府県名のリスト(配列の列の順)
+        ndarray:    table_sentinelsで求めた定点数(週×都道府県、Noneの時は使わない)
+    Returns:
+        ndarray:    定当(週×地方、データがない所はNaN、報告した都道府県が全て0の地方は0)
+    """
+    report, teito = np.atleast_2d(report), np.atleast_2d(teito)
+    return _rate(report, sentinels(report, teito, known), _membership(tuple(prefs)))
+
+def rolling_mean(values:np.ndarray, window:int) -> np.ndarray:
+    """
+    直近window週の移動平均(NaNの週は除いて平均、1週もない時はNaN)
+    Args:
+        ndarray:    週×列の配列
+        int:        週数
+    Returns:
+        ndarray:    週×列の配列
+    """
+    values = np.asarray(values, dtype=float)
+    found = ~np.isnan(values)
+    zero = np.zeros((1,) + values.shape[1:])
+    total = np.concatenate([zero, np.cumsum(np.where(found, values, 0), axis=0)])
+    count = np.concatenate([zero, np.cumsum(found, axis=0)])
+    start = np.maximum(np.arange(1, len(values) + 1) - window, 0)
+    total = total[1:] - total[start]
+    count = count[1:] - count[start]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(count > 0, total / count, np.nan)
+
+def week_over_week(values:np.ndarray) -> np.ndarray:
+    """
+    前週比(今週÷前週、最初の週と前週が0かNaNの時はNaN)
+    Args:
+        ndarray:    週×列の配列
+    Returns:
+        ndarray:    週×列の配列
+    """
+    values = np.asarray(values, dtype=float)
+    result = np.full(values.shape, np.nan)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        result[1:] = np.where(values[:-1] > 0, values[1:] / values[:-1], np.nan)
+    return result
+
+class RegionSeries():
+    """
+    1つの感染症の複数週のデータ(都道府県・地方・全国)
+    """
+    def __init__(self, tables:List[teiten.TeitenTable], keyword:str, prefs:List[str]=PREFS) -> None:
+        """
+        コンストラクタ：週×都道府県の報告数と定当を作成
+        Args:
+            list:   週報データのリスト(週の順)
+            str:    感染症名(含まれる文字列)
+            list:   都道府県名のリスト(配列の列の順)
+        """
+        self.weeks = [(t.year, t.week) for t in tables]
+        self.titles = [t.title for t in tables]
+        self.prefs = prefs
+        self.report = teiten.week_matrix(tables, keyword, prefs, teiten.METRIC_REPORT)
+        self.teito = teiten.week_matrix(tables, keyword, prefs, teiten.METRIC_TEITO)
+        # 同じ種類の定点の感染症から求めた定点数(報告数が0の週の定点数に使う)
+        self.known = np.full(self.report.shape, np.nan)
+        # 全国(総数の行)
+        self.total_teito = np.full(len(tables), np.nan)
+        for w, table in enumerate(tables):
+            name = table.find(keyword)
+            if name is not None:
+                self.total_teito[w] = table.total_teito[table.diseases.index(name)]
+                self.known[w] = table_sentinels(table, name, prefs)
+
+    def region_teito(self) -> np.ndarray:
+        """
+        地方ごとの定当(週×地方、地方の順はREGION_NAMES)
+        """
+        return aggregate(self.report, self.teito, self.prefs, self.known)
+
+    def national_teito(self) -> np.ndarray:
+        """
+        全国の定当(週、総数の行がない週は都道府県から計算)
+        """
+        n = sentinels(self.report, self.teito, self.known)
+        computed = _rate(self.report, n, np.ones((len(self.prefs), 1)))[:, 0]
+        return np.where(np.isnan(self.total_teito), computed, self.total_teito)
+
+def region_rows(table:teiten.TeitenTable, name:Optional[str]) -> list:
+    """
+    1週分の地方ごとの定当を地方名と値のタプルのリストで取得(地図作成用、データがあるものだけ)
+    報告数が0の都道府県の定点数は、同じ週の同じ種類の定点の感染症から求める
+    Args:
+        TeitenTable:    週報データ
+        str:            感染症名(Noneの時は空のリスト)
+    Returns:
+        list:   地方名と値のタプルのリスト
+    """
+    if name is None: return []
+    values = aggregate(table.column(name, teiten.METRIC_REPORT), table.column(name), table.prefs
+                        , table_sentinels(table, name))[0]
+    return [(region, round(float(v), 2)) for region, v in zip(REGION_NAMES, values) if not np.isnan(v)]
+
+_topologies = {}    # 元のTopoJSONのidをキーにした(元のTopoJSON, 地方のTopoJSON)
+
+def region_topology(topo:dict, object_name:str="prefectures", key:str="N03_001") -> dict:
+    """
+    都道府県をまとめた地方の形のTopoJSON(地図データが変わらない間は1回だけ作成)
+    都道府県の地図と同じ処理で地方の地図を作れるよう、同じオブジェクト名とプロパティに地方を設定する
+    Args:
+        dict:   TopoJSONデータ
+        str:    都道府県のオブジェクト名
+        str:    都道府県名のプロパティ
+    Returns:
+        dict:   地方の形のTopoJSONデータ(使わないarcは除く)
+    """
+    cached = _topologies.get(id(topo))
+    if cached is None or cached[0] is not topo:
+        merged = topology.merge(topo, object_name, REGIONS, key)
+        result = topology.compact(dict(topo, objects={object_name: merged}))
+        cached = _topologies[id(topo)] = (topo, result)
+    return cached[1]
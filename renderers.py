@@ -0,0 +1,319 @@
+"""
+地図の出力方法(foliumの地図、雛形、Leaflet+データファイル、SVG)
+Mapping.create_mapsからMapping.rendererで選んだ方法で出力する
+一括作成ではfoliumの要素を作らない方法を使うと、地図の数が多くてもファイルの書き込みが主な処理になる
+"""
+
+import hashlib, html, json, math, os
+from abc import ABC, abstractmethod
+import numpy as np
+from typing import List, Tuple       # 関数アノテーション用
+from geo_store import GeometryStore
+from instrument import BUILD, SAVE
+
+OBJECT_NAME = "prefectures"     # TopoJSONのオブジェクト名
+KEY = "N03_001"                 # 地域を特定するプロパティ
+
+def write_text(path:str, text:str) -> None:
+    """
+    一時ファイルに書いてから置き換える(並列に作成しても壊れたファイルを残さない)
+    """
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+class Renderer(ABC):
+    """
+    地図の出力方法の基底クラス(renderを実装しないと作成できない)
+    """
+    name = ""
+
+    @abstractmethod
+    def render(self, mapping, panels:list, title:str, stem:str) -> str:
+        """
+        地図をファイルに出力
+        Args:
+            Mapping:    地図作成オブジェクト(地図データ、色、出力先、計測を使う)
+            list:       地図ごとの(報告数データ, 感染症名, 階級区分(Scale))のリスト
+            str:        期間
+            str:        ファイル名(拡張子なし、out_dirに作成)
+        Returns:
+            str:        作成したファイルのパス
+        """
+        raise NotImplementedError
+
+class FoliumRenderer(Renderer):
+    """
+    foliumで作成(画面から作成する時の既定の方法)
+    """
+    name = "folium"
+
+    def render(self, mapping, panels:list, title:str, stem:str) -> str:
+        if len(panels) > 1:
+            f = mapping.multi_choropleth(panels, title, f"{stem}.html", False)
+            return mapping.save_html(f, f"{stem}.html")
+        rows, name, scale = panels[0]
+        map = mapping.Choropleth_map_topo(rows, name, title, scale.vmax, scale=scale)
+        return mapping.save_html(map, f"{stem}.html")
+
+class TemplateRenderer(FoliumRenderer):
+    """
+    1つの感染症の地図は雛形(MapTemplate)に値と色を差し込んで作成、複数並べる地図はfoliumで作成
+    """
+    name = "template"
+
+    def render(self, mapping, panels:list, title:str, stem:str) -> str:
+        if len(panels) > 1:
+            return super().render(mapping, panels, title, stem)
+        rows, name, scale = panels[0]
+        return mapping.Choropleth_map_template(rows, name, title, scale.vmax, f"{stem}.html", scale=scale)
+
+# Leaflet+データファイルのHTML(地図ごとに変わるのはファイル名だけ)
+LEAFLET_HTML = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1.0">
+<link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/leaflet@1.9.3/dist/leaflet.css"/>
+<script src="https://cdn.jsdelivr.net/npm/leaflet@1.9.3/dist/leaflet.js"></script>
+<script src="https://cdnjs.cloudflare.com/ajax/libs/topojson/1.6.9/topojson.min.js"></script>
+<script src="__GEOMETRY__" charset="utf-8"></script>
+<script src="__DATA__" charset="utf-8"></script>
+<style>
+html, body {width: 100%; height: 100%; margin: 0; padding: 0;}
+#maps {display: flex; width: 100%; height: 100%;}
+.panel {flex: 1; display: flex; flex-direction: column;}
+.panel h3 {text-align: center; font-size: 20px; margin: 4px;}
+.panel h6 {text-align: right; margin: 0 8px 4px;}
+.map {flex: 1;}
+.legend {background: white; padding: 4px;}
+</style>
+</head>
+<body>
+<div id="maps"></div>
+<script>
+(function() {
+    var features = topojson.feature(map_geometry, map_geometry.objects[map_data.object]);
+    map_data.panels.forEach(function(panel) {
+        var div = document.createElement("div");
+        div.className = "panel";
+        var h3 = document.createElement("h3");
+        h3.textContent = panel.name + "定点当たり報告数";
+        var h6 = document.createElement("h6");
+        h6.textContent = map_data.title;
+        var map_div = document.createElement("div");
+        map_div.className = "map";
+        div.append(h3, h6, map_div);
+        document.getElementById("maps").appendChild(div);
+        var map = L.map(map_div).setView(map_data.location, map_data.zoom);
+        L.tileLayer("https://{s}.basemaps.cartocdn.com/light_all/{z}/{x}/{y}{r}.png", {
+            attribution: '&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors &copy; <a href="https://carto.com/attributions">CARTO</a>',
+            subdomains: "abcd", maxZoom: 20
+        }).addTo(map);
+        L.geoJson(features, {
+            style: function(feature) {
+                var v = panel.values[feature.properties[map_data.key]];
+                return {fillColor: v === undefined ? "black" : v[1], fillOpacity: 0.3, color: "black", weight: 2, opacity: 1};
+            },
+            onEachFeature: function(feature, layer) {
+                var name = feature.properties[map_data.key];
+                var v = panel.values[name];
+                var text = "<b>地域</b> " + name;
+                if (v !== undefined) { text += "<br><b>人数</b> " + v[0]; }
+                layer.bindTooltip(text, {sticky: true});
+            }
+        }).addTo(map);
+        var legend = L.control({position: "topright"});
+        legend.onAdd = function() {
+            var div = L.DomUtil.create("div", "legend");
+            var caption = document.createElement("div");
+            caption.textContent = panel.name;
+            var bar = document.createElement("div");
+            bar.style.display = "flex";
+            panel.legend.forEach(function(x) {
+                var span = document.createElement("span");
+                span.title = x[1];
+                span.style.cssText = "background:" + x[0] + ";width:" + (200 / panel.legend.length) + "px;height:10px";
+                bar.appendChild(span);
+            });
+            var labels = document.createElement("div");
+            labels.style.cssText = "display:flex;justify-content:space-between";
+            labels.innerHTML = "<span></span><span></span>";
+            labels.children[0].textContent = panel.legend[0][1];
+            labels.children[1].textContent = panel.legend[panel.legend.length - 1][1];
+            div.append(caption, bar, labels);
+            return div;
+        };
+        legend.addTo(map);
+    });
+})();
+</script>
+</body>
+</html>
+"""
+
+class LeafletRenderer(Renderer):
+    """
+    作成済みのLeafletのHTMLと地図ごとのデータファイルを書き出す(foliumの要素もJinjaも使わない)
+    地図データは出力先フォルダに1つだけ書き出して全ての地図で共有する
+    ブラウザでファイルを直接開いても読めるよう、データファイルはJSONを変数に代入するJavaScript(.js)にする
+    """
+    name = "leaflet"
+
+    def __init__(self, shared_dir:str=None, location:list=[39.00, 137.00], zoom_start:int=6) -> None:
+        """
+        コンストラクタ
+        Args:
+            str:    地図データの出力先フォルダ(Noneの時は地図と同じフォルダ)
+            list:   地図の中心
+            int:    地図の倍率
+        """
+        self.shared_dir = shared_dir
+        self.location = location
+        self.zoom_start = zoom_start
+        self._geometry = None   # (TopoJSONデータ, ファイル名, 内容)
+        self._written = set()   # 書き出した地図データのパス
+        head, rest = LEAFLET_HTML.split("__GEOMETRY__", 1)
+        middle, tail = rest.split("__DATA__", 1)
+        self._parts = (head, middle, tail)
+
+    def geometry_file(self, topo_json_data:dict, out_dir:str) -> str:
+        """
+        地図データのファイルを用意(内容のハッシュをファイル名にするので、地図データが変わると別のファイルになる)
+        Args:
+            dict:   TopoJSONデータ
+            str:    地図の出力先フォルダ
+        Returns:
+            str:    地図データのファイルのパス
+        """
+        if self._geometry is None or self._geometry[0] is not topo_json_data:
+            text = json.dumps(topo_json_data, ensure_ascii=False, separators=(",", ":"))
+            name = f"geometry-{hashlib.sha1(text.encode('utf-8')).hexdigest()[:12]}.js"
+            self._geometry = (topo_json_data, name, f"var map_geometry = {text};\n")
+        path = os.path.join(self.shared_dir or out_dir, self._geometry[1])
+        if path not in self._written:
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                write_text(path, self._geometry[2])
+            self._written.add(path)
+        return path
+
+    def render(self, mapping, panels:list, title:str, stem:str) -> str:
+        topo_json_data = mapping.get_geometry()
+        with mapping.instrument.stage(BUILD):
+            data = {"title": title, "object": OBJECT_NAME, "key": KEY
+                    , "location": self.location, "zoom": self.zoom_start, "panels": []}
+            for rows, name, scale in panels:
+                mapping.check_cancel()
+                data["panels"].append({"name": name, "values": scale.table(rows), "legend": scale.legend()})
+            text = f"var map_data = {json.dumps(data, ensure_ascii=False)};\n"
+        with mapping.instrument.stage(SAVE):
+            geometry = self.geometry_file(topo_json_data, mapping.out_dir)
+            data_path = os.path.join(mapping.out_dir, f"{stem}.js")
+            path = os.path.join(mapping.out_dir, f"{stem}.html")
+            write_text(data_path, text)
+            head, middle, tail = self._parts
+            src = os.path.relpath(geometry, mapping.out_dir).replace(os.sep, "/")
+            write_text(path, "".join((head, html.escape(src), middle, html.escape(f"{stem}.js"), tail)))
+        mapping.show(path)
+        return path
+
+class SvgRenderer(Renderer):
+    """
+    1つのSVGファイルに書き出す(地図タイルなしの静止画、都道府県の形はパスの文字列にして使い回す)
+    """
+    name = "svg"
+
+    def __init__(self, width:int=500, zoom:int=5) -> None:
+        """
+        コンストラクタ
+        Args:
+            int:    地図1つの幅(ピクセル)
+            int:    地図データの詳細度(幅500ピクセルで日本全体を表示するならズームレベル5で足りる)
+        """
+        self.width = width
+        self.zoom = zoom
+        self._paths = None      # (地域の形, 地域名と形(SVGのパス)のリスト, 高さ)
+
+    def paths(self, store:GeometryStore) -> Tuple[List[Tuple[str, str]], float]:
+        """
+        都道府県の形をSVGのパスに変換(地図データが変わった時だけ作り直す)
+        経度は中央の緯度のcosを掛けた正距円筒図法
+        Args:
+            GeometryStore:  地域の形
+        Returns:
+            list:   (地域名, SVGのパス)のリスト
+            float:  地図の高さ
+        """
+        if self._paths is not None and self._paths[0] is store:
+            return self._paths[1], self._paths[2]
+        polygons = [[r for rings in store.rings(i) for r in rings if len(r) > 2] for i in range(len(store))]
+        points = np.concatenate([r for rings in polygons for r in rings])
+        (x0, y0), (x1, y1) = points.min(axis=0), points.max(axis=0)
+        kx = math.cos(math.radians((y0 + y1) / 2))
+        scale = self.width / ((x1 - x0) * kx)
+        paths = []
+        for name, rings in zip(store.names, polygons):
+            d = []
+            for r in rings:
+                xy = np.column_stack([(r[:, 0] - x0) * kx * scale, (y1 - r[:, 1]) * scale]).round(1)
+                xy = xy[np.r_[True, np.any(xy[1:] != xy[:-1], axis=1)]]   # 丸めて同じ位置になった点は除く
+                d.append("M" + "L".join(f"{x:g},{y:g}" for x, y in xy) + "Z")
+            paths.append((name, "".join(d)))
+        height = (y1 - y0) * scale
+        self._paths = (store, paths, height)
+        return paths, height
+
+    def render(self, mapping, panels:list, title:str, stem:str) -> str:
+        store = mapping.get_store(self.zoom)
+        with mapping.instrument.stage(BUILD):
+            paths, height = self.paths(store)
+            top, bottom = 50, 50    # タイトルと凡例の高さ
+            width, total = self.width * len(panels), height + top + bottom
+            out = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{total:.0f}"'
+                    f' viewBox="0 0 {width} {total:.0f}" font-family="sans-serif">'
+                    , f'<rect width="100%" height="100%" fill="white"/>']
+            for i, (rows, name, scale) in enumerate(panels):
+                mapping.check_cancel()
+                colors = scale.table(rows)
+                x = i * self.width
+                out.append(f'<text x="{x + self.width / 2:g}" y="22" text-anchor="middle" font-size="20"'
+                            f' font-weight="bold">{html.escape(name)}定点当たり報告数</text>')
+                out.append(f'<text x="{x + self.width - 8:g}" y="40" text-anchor="end" font-size="10">{html.escape(title)}</text>')
+                out.append(f'<g transform="translate({x},{top})" stroke="black" stroke-width="0.5" fill-opacity="0.6" fill-rule="evenodd">')
+                for pref, d in paths:
+                    v = colors.get(pref)
+                    fill, label = (v[1], f"{pref} {v[0]:g}") if v else ("black", pref)
+                    out.append(f'<path d="{d}" fill="{fill}"><title>{html.escape(label)}</title></path>')
+                out.append('</g>')
+                # 凡例
+                legend = scale.legend()
+                w = 200 / len(legend)
+                lx, ly = x + self.width - 210, top + height + 10
+                for j, (color, label) in enumerate(legend):
+                    out.append(f'<rect x="{lx + j * w:.1f}" y="{ly:.0f}" width="{w:.1f}" height="10" fill="{color}">'
+                                f'<title>{label}</title></rect>')
+                out.append(f'<text x="{lx:g}" y="{ly + 22:.0f}" font-size="10">{legend[0][1]}</text>')
+                out.append(f'<text x="{lx + 200:g}" y="{ly + 22:.0f}" font-size="10" text-anchor="end">{legend[-1][1]}</text>')
+            out.append('</svg>\n')
+        with mapping.instrument.stage(SAVE):
+            path = os.path.join(mapping.out_dir, f"{stem}.svg")
+            write_text(path, "\n".join(out))
+        mapping.show(path)
+        return path
+
+RENDERERS = {r.name: r for r in (FoliumRenderer, TemplateRenderer, LeafletRenderer, SvgRenderer)}
+
+def get_renderer(name:str, **kwargs) -> Renderer:
+    """
+    名前から出力方法を作成
+    Args:
+        str:    出力方法の名前(folium, template, leaflet, svg)
+        dict:   出力方法のコンストラクタの引数
+    Returns:
+        Renderer:   出力方法
+    """
+    if name not in RENDERERS:
+        raise ValueError(f"出力方法がありません:{name}(選べるのは{', '.join(RENDERERS)})")
+    return RENDERERS[name](**kwargs)
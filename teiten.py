@@ -0,0 +1,283 @@
+"""
+定点把握疾患の週報(teiten.csv)の取得と読み込み
+"""
+
+import codecs, csv, logging, math, os, threading, time, urllib.request, urllib.error
+from datetime import date
+import numpy as np
+from typing import BinaryIO, Iterable, Iterator, List, Optional, Tuple       # 関数アノテーション用
+from instrument import DOWNLOAD, DECODE, PARSE, Instrument
+
+logger = logging.getLogger(__name__)
+
+NAME_COVID = "COVID-19"         # 新型コロナの感染症名(見出しに含まれる文字列)
+NAME_FLU = "インフルエンザ"      # インフルエンザの感染症名(見出しに含まれる文字列)
+METRIC_REPORT = "報告"          # 4行目の見出し 報告数
+METRIC_TEITO = "定当"           # 4行目の見出し 定点当たり報告数
+TOTAL = "総数"                  # 全国の行
+BASE_URL = "https://www.niid.go.jp/niid/images/idwr/sokuho"   # 週報の取得元
+
+def year_week(today:date) -> Tuple[str, str]:
+    """
+    日付からISO週の年と週を取得
+    年末年始は暦の年とISO週の年が異なるので%Yではなく%Gを使う
+    Args:
+        date:   日付
+    Returns:
+        str:    年(4桁)
+        str:    週(2桁)
+    """
+    return today.strftime('%G'), today.strftime('%V')
+
+def teiten_url(year:str, week:str, base:str=BASE_URL) -> str:
+    """
+    定点把握疾患の週報csvファイルのurl
+    Args:
+        str:    年(4桁)
+        str:    週(2桁)
+        str:    取得元(テスト用のサーバーに変えられる)
+    Returns:
+        str:    url
+    """
+    return f'{base}/idwr-{year}/{year}{week}/{year}-{week}-teiten.csv'
+
+def to_value(cell:str) -> float:
+    """
+    csvのセルを数値に変換(報告がないと「-」が設定されるのでNaNにする)
+    """
+    if not cell or cell == "-": return math.nan
+    return float(cell)
+
+class TeitenTable():
+    """
+    週報データ(全感染症を列ごとに保持)
+    report, teito は 都道府県×感染症 の配列(データがない所はNaN)
+    """
+    def __init__(self, title:str, prefs:List[str], diseases:List[str]
+                , report:np.ndarray, teito:np.ndarray
+                , total_report:Optional[np.ndarray]=None, total_teito:Optional[np.ndarray]=None) -> None:
+        """
+        コンストラクタ
+        Args:
+            str:        期間
+            list:       都道府県名のリスト
+            list:       感染症名のリスト
+            ndarray:    報告数(都道府県×感染症)
+            ndarray:    定当(都道府県×感染症)
+            ndarray:    全国の報告数(感染症)
+            ndarray:    全国の定当(感染症)
+        """
+        self.title = title
+        self.year = ""          # 年(取得した側で設定)
+        self.week = ""          # 週(取得した側で設定)
+        self.prefs = prefs
+        self.diseases = diseases
+        self.report = report
+        self.teito = teito
+        n = len(diseases)
+        self.total_report = total_report if total_report is not None else np.full(n, np.nan)
+        self.total_teito = total_teito if total_teito is not None else np.full(n, np.nan)
+        self._index = {name: i for i, name in enumerate(diseases)}
+
+    def find(self, keyword:str) -> Optional[str]:
+        """
+        キーワードを含む感染症名を探す(感染症名と同じ時はその感染症)
+        Args:
+            str:    キーワード
+        Returns:
+            str:    感染症名(ないときはNone)
+        """
+        if keyword in self._index: return keyword   # 感染症名が別の感染症名に含まれる時のため
+        return next((name for name in self.diseases if keyword in name), None)
+
+    def column(self, name:str, metric:str=METRIC_TEITO) -> np.ndarray:
+        """
+        感染症の列(都道府県順)
+        Args:
+            str:    感染症名
+            str:    報告か定当か
+        Returns:
+            ndarray:    報告数か定当の配列(データがない所はNaN)
+        """
+        values = self.teito if metric == METRIC_TEITO else self.report
+        return values[:, self._index[name]]
+
+    def rows(self, name:Optional[str], metric:str=METRIC_TEITO) -> list:
+        """
+        感染症のデータを都道府県と値のタプルのリストで取得(データがあるものだけ)
+        Args:
+            str:    感染症名(Noneの時は空のリスト)
+            str:    報告か定当か
+        Returns:
+            list:   都道府県と値のタプルのリスト
+        """
+        if name is None: return []
+        col = self.column(name, metric)
+        return [(pref, float(v)) for pref, v in zip(self.prefs, col) if not math.isnan(v)]
+
+def parse_teiten(lines:Iterable[str]) -> TeitenTable:
+    """
+    週報csvの読み込み(1回の走査で全感染症を読む)
+    3行目の疾病名と4行目の報告/定当から列の位置を決めるので、列の位置が変わっても読める
+    Args:
+        Iterable:   csvの行(デコード済み、ストリームでもよい)
+    Returns:
+        TeitenTable:    週報データ
+    """
+    reader = csv.reader(lines)
+    next(reader)                        # 1行目
+    title = next(reader)[0]             # 2行目 報告期間
+    shippei = next(reader)              # 3行目 疾病(左の列にしか名前がない)
+    metrics = next(reader)              # 4行目 報告/定当
+    # 列ごとの疾病名と報告/定当から、疾病ごとの列の位置を作成
+    diseases, col_report, col_teito = [], {}, {}
+    name = ""
+    for i in range(1, len(metrics)):
+        if i < len(shippei) and shippei[i]:
+            name = shippei[i]
+            diseases.append(name)
+        if not name: continue
+        if metrics[i] == METRIC_REPORT: col_report[name] = i
+        elif metrics[i] == METRIC_TEITO: col_teito[name] = i
+    idx_report = [col_report.get(name) for name in diseases]
+    idx_teito = [col_teito.get(name) for name in diseases]
+
+    def values(row:list, idx:list) -> list:
+        return [to_value(row[i]) if i is not None and i < len(row) else math.nan for i in idx]
+
+    prefs, report, teito = [], [], []
+    total_report = total_teito = None
+    for row in reader:
+        if not row or not row[0]: continue      # 空行
+        if row[0] == TOTAL:                     # 5行目 総数
+            total_report, total_teito = np.array(values(row, idx_report)), np.array(values(row, idx_teito))
+            continue
+        prefs.append(row[0])
+        report.append(values(row, idx_report))
+        teito.append(values(row, idx_teito))
+    shape = (len(prefs), len(diseases))
+    return TeitenTable(title, prefs, diseases
+                        , np.array(report, dtype=float).reshape(shape), np.array(teito, dtype=float).reshape(shape)
+                        , total_report, total_teito)
+
+def iter_lines(raw:BinaryIO, encoding:str='cp932', tee:Optional[BinaryIO]=None
+                , instrument:Optional[Instrument]=None) -> Iterator[str]:
+    """
+    バイトのストリームを1行ずつ読んでデコード(全体を読まないので、メモリは読み込みのバッファと1行分だけ)
+    cp932の2バイト文字の2バイト目に改行(0x0A)は現れないので、デコードする前に行に分けてよい
+    Args:
+        BinaryIO:   readlineを持つ読み込みオブジェクト(HTTPResponseなど)
+        str:        文字コード
+        BinaryIO:   読んだバイトをそのまま書き込む先(Noneの時は書き込まない)
+        Instrument: 読み込み(ダウンロード)とデコードの時間、転送量の記録先
+    Returns:
+        Iterator:   デコードした行(改行を含む)
+    """
+    instrument = instrument or Instrument()
+    decoder = codecs.getincrementaldecoder(encoding)()
+    while True:
+        start = time.perf_counter()
+        line = raw.readline()
+        instrument.add(DOWNLOAD, time.perf_counter() - start)
+        if not line: break
+        instrument.count("bytes_downloaded", len(line))
+        if tee is not None: tee.write(line)
+        start = time.perf_counter()
+        text = decoder.decode(line)
+        instrument.add(DECODE, time.perf_counter() - start)
+        yield text
+    rest = decoder.decode(b"", final=True)  # 途中で切れた文字があればエラー
+    if rest: yield rest
+
+def week_matrix(tables:List[TeitenTable], keyword:str, prefs:List[str], metric:str=METRIC_TEITO) -> np.ndarray:
+    """
+    複数週の感染症データを 週×都道府県 の配列にまとめる
+    Args:
+        list:   週報データのリスト(週の順)
+        str:    感染症名(含まれる文字列)
+        list:   都道府県名のリスト(配列の列の順)
+        str:    報告か定当か
+    Returns:
+        ndarray:    週×都道府県の配列(データがない所はNaN)
+    """
+    values = np.full((len(tables), len(prefs)), np.nan)
+    for w, table in enumerate(tables):
+        name = table.find(keyword)
+        if name is None: continue       # 感染症のデータがない週
+        pos = {pref: i for i, pref in enumerate(table.prefs)}
+        idx = np.array([pos.get(pref, -1) for pref in prefs])
+        found = idx >= 0
+        values[w, found] = table.column(name, metric)[idx[found]]
+    return values
+
+def check_teiten(year:str, week:str, base:str=BASE_URL, timeout:float=30) -> bool:
+    """
+    週報csvが公開されているか(HEADで確認するので本体はダウンロードしない)
+    Args:
+        str:    年
+        str:    週
+        str:    取得元
+        float:  タイムアウト(秒)
+    Returns:
+        bool:   公開されていればTrue
+    """
+    _url = teiten_url(year, week, base)
+    try:
+        res = urllib.request.urlopen(urllib.request.Request(_url, method="HEAD"), timeout=timeout)
+    except urllib.error.HTTPError as e:
+        if e.code == 404: return False
+        raise
+    with res:
+        return res.url == _url      # データがない週はリダイレクトされる
+
+def fetch_teiten(year:str, week:str, etag:Optional[str]=None, last_modified:Optional[str]=None
+                , base:str=BASE_URL, timeout:float=30, instrument:Optional[Instrument]=None
+                , raw_path:Optional[str]=None) -> Optional[dict]:
+    """
+    週報csvをWebから取得
+    Args:
+        str:        年
+        str:        週
+        str:        前回取得時のETag(再検証用)
+        str:        前回取得時のLast-Modified(再検証用)
+        str:        取得元
+        float:      タイムアウト(秒)
+        Instrument: ダウンロード・デコード・読み込みの時間と転送量の記録先
+        str:        取得したcsvをそのまま保存するファイル(読み込みと同時に書き込む、Noneの時は保存しない)
+    Returns:
+        dict:   table(TeitenTable), etag, last_modified
+                変更がない(304)時は{"not_modified": True}、データがない週はNone
+    """
+    _url = teiten_url(year, week, base)
+    headers = {}
+    if etag: headers["If-None-Match"] = etag
+    if last_modified: headers["If-Modified-Since"] = last_modified
+    instrument = instrument or Instrument()
+    try:
+        with instrument.stage(DOWNLOAD):    # 応答ヘッダーまで
+            res = urllib.request.urlopen(urllib.request.Request(_url, headers=headers), timeout=timeout)
+    except urllib.error.HTTPError as e:
+        if e.code == 304: return {"not_modified": True}
+        raise
+    with res:
+        logger.info('request url:%s', _url)
+        logger.info('return  url:%s', res.url)
+        if res.url != _url:     # データがない週はリダイレクトされる
+            return None
+        # 全体を読まずに行ごとにデコードしながら読み込む(読み込みの時間からダウンロードとデコードの時間は除く)
+        # 保存する時は一時ファイルに書いて、読み込めたら置き換える
+        tmp = f"{raw_path}.{os.getpid()}.{threading.get_ident()}.tmp" if raw_path else None
+        tee = open(tmp, "wb") if tmp else None
+        try:
+            with instrument.stage(PARSE, exclude=(DOWNLOAD, DECODE)):
+                table = parse_teiten(iter_lines(res, 'cp932', tee, instrument))
+        except BaseException:
+            if tee:
+                tee.close()
+                os.remove(tmp)
+            raise
+        if tee:
+            tee.close()
+            os.replace(tmp, raw_path)
+        table.year, table.week = year, week
+        return {"table": table, "etag": res.headers.get("ETag"), "last_modified": res.headers.get("Last-Modified")}
@@ -0,0 +1,265 @@
+"""
+定点把握疾患の週報データの保存(SQLite)
+"""
+
+import hashlib, math, os, sqlite3, threading, time
+from datetime import date, timedelta
+import numpy as np
+from typing import List, Optional, Tuple       # 関数アノテーション用
+import teiten
+from instrument import Instrument
+
+FINAL_DAYS = 21     # 週の終わりからこの日数が過ぎた週は確定とみなし再取得しない
+
+def table_digest(table:teiten.TeitenTable) -> str:
+    """
+    週報データの内容のハッシュ(データが変わった時だけ変わる、取得日時や再検証には影響されない)
+    Args:
+        TeitenTable:    週報データ
+    Returns:
+        str:    SHA-1の16進文字列
+    """
+    h = hashlib.sha1("\n".join([table.title, "\t".join(table.diseases), "\t".join(table.prefs)]).encode("utf-8"))
+    for a in (table.report, table.teito, table.total_report, table.total_teito):
+        h.update(np.nan_to_num(np.asarray(a, dtype=float), nan=-1.0).tobytes())    # NaNはビット列が揃わないことがある
+    return h.hexdigest()
+
+class TeitenStore():
+    """
+    週報データを(年, 週, 都道府県, 感染症)をキーにして保存する
+    """
+    def __init__(self, path:str="cache/teiten.sqlite3", base_url:str=teiten.BASE_URL
+                , raw_dir:Optional[str]=None) -> None:
+        """
+        コンストラクタ：データベースを開き、なければテーブルを作成
+        Args:
+            str:    データベースファイル
+            str:    週報の取得元
+            str:    取得したcsvをそのまま保存するフォルダ(Noneの時は保存しない)
+        """
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.base_url = base_url
+        self.raw_dir = raw_dir
+        if raw_dir:
+            os.makedirs(raw_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self.con = sqlite3.connect(path, check_same_thread=False)
+        self.con.executescript("""
+            CREATE TABLE IF NOT EXISTS weeks (
+                year TEXT, week TEXT, title TEXT, diseases TEXT
+                , fetched REAL, etag TEXT, last_modified TEXT, digest TEXT
+                , PRIMARY KEY (year, week));
+            CREATE TABLE IF NOT EXISTS teiten (
+                year TEXT, week TEXT, col INTEGER, pref_no INTEGER
+                , disease TEXT, pref TEXT, report REAL, value REAL
+                , PRIMARY KEY (year, week, col, pref_no)) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS missing (
+                year TEXT, week TEXT, checked REAL, PRIMARY KEY (year, week));
+            """)
+        # 内容のハッシュの列がない古いデータベース(ハッシュはNULLになる)
+        if "digest" not in [r[1] for r in self.con.execute("PRAGMA table_info(weeks)")]:
+            with self.con:
+                self.con.execute("ALTER TABLE weeks ADD COLUMN digest TEXT")
+
+    def is_final(self, year:str, week:str, today:Optional[date]=None) -> bool:
+        """
+        確定した週か(週の終わりからFINAL_DAYS日過ぎているか)
+        Args:
+            str:    年
+            str:    週
+            date:   基準日(省略時は今日)
+        Returns:
+            bool:   確定していればTrue
+        """
+        sunday = date.fromisocalendar(int(year), int(week), 7)
+        return sunday + timedelta(days=FINAL_DAYS) < (today or date.today())
+
+    def get_meta(self, year:str, week:str) -> Optional[dict]:
+        """
+        週の取得情報
+        Args:
+            str:    年
+            str:    週
+        Returns:
+            dict:   title, diseases, fetched, etag, last_modified(保存されていない時はNone)
+        """
+        with self._lock:
+            row = self.con.execute("SELECT title, diseases, fetched, etag, last_modified FROM weeks"
+                                    " WHERE year=? AND week=?", (year, week)).fetchone()
+        if row is None: return None
+        return {"title": row[0], "diseases": row[1].split("\t"), "fetched": row[2]
+                , "etag": row[3], "last_modified": row[4]}
+
+    def get_week(self, year:str, week:str) -> Optional[teiten.TeitenTable]:
+        """
+        保存した週のデータを取得
+        Args:
+            str:    年
+            str:    週
+        Returns:
+            TeitenTable:    週報データ(保存されていない時はNone)
+        """
+        meta = self.get_meta(year, week)
+        if meta is None: return None
+        with self._lock:
+            records = self.con.execute("SELECT pref_no, pref, report, value FROM teiten"
+                                        " WHERE year=? AND week=? ORDER BY pref_no, col", (year, week)).fetchall()
+        n = len(meta["diseases"])
+        # pref_noが-1の行は全国(総数)
+        total = [r for r in records[:n] if r[0] == -1]
+        records = records[len(total):]
+        prefs = [r[1] for r in records[::n]] if n else []
+        # NULLはNaNになる
+        values = np.array([(r[2], r[3]) for r in records], dtype=float).reshape(len(prefs), n, 2)
+        totals = np.array([(r[2], r[3]) for r in total], dtype=float).reshape(-1, 2)
+        table = teiten.TeitenTable(meta["title"], prefs, meta["diseases"], values[:, :, 0], values[:, :, 1]
+                                    , totals[:, 0] if len(total) else None, totals[:, 1] if len(total) else None)
+        table.year, table.week = year, week
+        return table
+
+    def put_week(self, year:str, week:str, table:teiten.TeitenTable
+                , etag:Optional[str]=None, last_modified:Optional[str]=None) -> None:
+        """
+        週のデータを保存(同じ週のデータは置き換える)
+        Args:
+            str:            年
+            str:            週
+            TeitenTable:    週報データ
+            str:            ETag
+            str:            Last-Modified
+        """
+        def nullable(v:float) -> Optional[float]:
+            return None if math.isnan(v) else float(v)
+
+        records = [(year, week, col, pref_no, name, pref, nullable(table.report[pref_no, col]), nullable(table.teito[pref_no, col]))
+                    for pref_no, pref in enumerate(table.prefs)
+                    for col, name in enumerate(table.diseases)]
+        if not np.isnan(table.total_teito).all():
+            records += [(year, week, col, -1, name, teiten.TOTAL, nullable(table.total_report[col]), nullable(table.total_teito[col]))
+                        for col, name in enumerate(table.diseases)]
+        with self._lock, self.con:
+            self.con.execute("DELETE FROM teiten WHERE year=? AND week=?", (year, week))
+            self.con.executemany("INSERT INTO teiten VALUES (?, ?, ?, ?, ?, ?, ?, ?)", records)
+            self.con.execute("INSERT OR REPLACE INTO weeks (year, week, title, diseases, fetched, etag, last_modified, digest)"
+                            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+                            , (year, week, table.title, "\t".join(table.diseases), time.time(), etag, last_modified
+                                , table_digest(table)))
+
+    def has_week(self, year:str, week:str) -> bool:
+        """
+        週のデータかデータがないことが確定しているか(取得しなくてよいか)
+        Args:
+            str:    年
+            str:    週
+        Returns:
+            bool:   確定した週でデータまたはデータなしが保存されていればTrue
+        """
+        if not self.is_final(year, week): return False
+        with self._lock:
+            return bool(self.con.execute("SELECT 1 FROM weeks WHERE year=? AND week=?"
+                                        " UNION ALL SELECT 1 FROM missing WHERE year=? AND week=?"
+                                        , (year, week, year, week)).fetchone())
+
+    def latest_week(self) -> Optional[Tuple[str, str]]:
+        """
+        保存している最新の週
+        Returns:
+            tuple:  年と週(保存していない時はNone)
+        """
+        with self._lock:
+            row = self.con.execute("SELECT year, week FROM weeks ORDER BY year DESC, week DESC LIMIT 1").fetchone()
+        return tuple(row) if row else None
+
+    def weeks(self) -> List[Tuple[str, str, Optional[str]]]:
+        """
+        保存している週の一覧(週の順)
+        Returns:
+            list:   (年, 週, 内容のハッシュ)のリスト(ハッシュの列を追加する前に保存した週はNone)
+        """
+        with self._lock:
+            return [tuple(r) for r in self.con.execute("SELECT year, week, digest FROM weeks ORDER BY year, week")]
+
+    def fill_digest(self, year:str, week:str) -> Optional[str]:
+        """
+        ハッシュの列を追加する前に保存した週の内容のハッシュを計算して保存
+        Args:
+            str:    年
+            str:    週
+        Returns:
+            str:    内容のハッシュ(保存されていない時はNone)
+        """
+        table = self.get_week(year, week)
+        if table is None: return None
+        digest = table_digest(table)
+        with self._lock, self.con:
+            self.con.execute("UPDATE weeks SET digest=? WHERE year=? AND week=?", (digest, year, week))
+        return digest
+
+    def is_missing(self, year:str, week:str) -> bool:
+        """
+        データがない週として記録されているか
+        """
+        with self._lock:
+            return bool(self.con.execute("SELECT 1 FROM missing WHERE year=? AND week=?", (year, week)).fetchone())
+
+    def mark_missing(self, year:str, week:str) -> None:
+        """
+        データがない週を記録(確定した週だけ、以後は取得しない)
+        """
+        if not self.is_final(year, week): return
+        with self._lock, self.con:
+            self.con.execute("INSERT OR REPLACE INTO missing VALUES (?, ?, ?)", (year, week, time.time()))
+
+    def save(self, year:str, week:str, res:Optional[dict]) -> Optional[teiten.TeitenTable]:
+        """
+        teiten.fetch_teitenの結果を保存
+        Args:
+            str:    年
+            str:    週
+            dict:   fetch_teitenの結果
+        Returns:
+            TeitenTable:    週報データ(データがない週はNone)
+        """
+        if res is None:
+            self.mark_missing(year, week)
+            return None
+        if res.get("not_modified"):
+            self.touch(year, week)
+            return self.get_week(year, week)
+        self.put_week(year, week, res["table"], res["etag"], res["last_modified"])
+        return res["table"]
+
+    def touch(self, year:str, week:str) -> None:
+        """
+        再検証で変更がなかった時に取得日時を更新
+        """
+        with self._lock, self.con:
+            self.con.execute("UPDATE weeks SET fetched=? WHERE year=? AND week=?", (time.time(), year, week))
+
+    def raw_path(self, year:str, week:str) -> Optional[str]:
+        """
+        取得したcsvの保存先(raw_dirがない時はNone)
+        """
+        return os.path.join(self.raw_dir, f"{year}-{week}-teiten.csv") if self.raw_dir else None
+
+    def load(self, year:str, week:str, instrument:Optional[Instrument]=None) -> Optional[teiten.TeitenTable]:
+        """
+        週のデータを取得(確定した週は保存したデータ、それ以外は再検証してから返す)
+        Args:
+            str:        年
+            str:        週
+            Instrument: 処理時間と取得結果の記録先
+        Returns:
+            TeitenTable:    週報データ(データがない週はNone)
+        """
+        instrument = instrument or Instrument()
+        if self.has_week(year, week):   # 確定した週は取得しない
+            instrument.count("store_hits")
+            return self.get_week(year, week)
+        meta = self.get_meta(year, week) or {}
+        res = teiten.fetch_teiten(year, week, meta.get("etag"), meta.get("last_modified"), self.base_url
+                                    , instrument=instrument, raw_path=self.raw_path(year, week))
+        instrument.count("not_modified" if res and res.get("not_modified") else "store_misses")
+        return self.save(year, week, res)
@@ -0,0 +1,9 @@
+"""
+テストの共通設定(モジュールはリポジトリの直下にあるので、テストからimportできるようにする)
+"""
+
+import os, sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(ROOT, "bench", "fixtures")     # ベンチマークと同じオフラインのデータ
+sys.path.insert(0, ROOT)
@@ -0,0 +1,48 @@
+"""
+batch.planのテスト(作成する地図と静止画のジョブ)
+"""
+
+import os
+import pytest
+import teiten
+from batch import plan
+from conftest import FIXTURES
+
+@pytest.fixture(scope="module")
+def table() -> teiten.TeitenTable:
+    with open(os.path.join(FIXTURES, "2023-41-teiten.csv"), "rb") as f:
+        table = teiten.parse_teiten(teiten.iter_lines(f))
+    table.year, table.week = "2023", "41"
+    return table
+
+@pytest.fixture(scope="module")
+def table_before_covid() -> teiten.TeitenTable:
+    with open(os.path.join(FIXTURES, "2023-10-teiten.csv"), "rb") as f:
+        table = teiten.parse_teiten(teiten.iter_lines(f))
+    table.year, table.week = "2023", "10"
+    return table
+
+def test_single_keyword_png(table):
+    flu = table.find(teiten.NAME_FLU)
+    assert plan([table], [teiten.NAME_FLU], png=True) == [("2023", "41", [flu], f"{flu}map.png")]
+
+def test_single_keyword_without_png(table):
+    flu = table.find(teiten.NAME_FLU)
+    assert plan([table], [teiten.NAME_FLU]) == [("2023", "41", [flu], None)]
+
+def test_combined_png(table):
+    covid, flu = table.find(teiten.NAME_COVID), table.find(teiten.NAME_FLU)
+    jobs = plan([table], [teiten.NAME_COVID, teiten.NAME_FLU], png=True)
+    assert jobs[0] == ("2023", "41", [covid, flu], "map.png")
+    assert [job[3] for job in jobs[1:]] == [None, None]     # 静止画は地図を並べたものだけ
+
+def test_combined_with_one_disease(table_before_covid):
+    # 新型コロナのない週は並べずに1つの地図だけ(静止画もその地図で作成)
+    flu = table_before_covid.find(teiten.NAME_FLU)
+    jobs = plan([table_before_covid], [teiten.NAME_COVID, teiten.NAME_FLU], png=True)
+    assert jobs == [("2023", "10", [flu], "map.png")]
+
+def test_all_diseases_png(table):
+    jobs = plan([table], None, png=True)
+    assert [job[2] for job in jobs] == [[name] for name in table.diseases]
+    assert [job[3] for job in jobs] == [f"{name}map.png" for name in table.diseases]
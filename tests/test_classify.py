@@ -0,0 +1,18 @@
+"""
+classify.threshold_bins, classify.fitのテスト(指定した境界で分ける区分)
+"""
+
+import pytest
+import classify
+
+def test_threshold_bins():
+    assert list(classify.threshold_bins([3, 1], 5)) == [0.0, 1.0, 3.0, 6.0]
+
+@pytest.mark.parametrize("thresholds", [[0], [-1, 0], []])
+def test_threshold_bins_without_positive(thresholds):
+    with pytest.raises(ValueError):
+        classify.threshold_bins(thresholds, 5)
+
+def test_fit_fixed_without_positive():
+    with pytest.raises(ValueError):
+        classify.fit([1.0, 2.0], classify.FIXED, thresholds=[0, -2])
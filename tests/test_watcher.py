@@ -0,0 +1,57 @@
+"""
+watcher.Watcherのテスト(取得や地図作成に失敗しても監視を続けるか)
+"""
+
+import os, threading, time, urllib.error
+from datetime import timedelta
+import pytest
+import teiten
+from conftest import FIXTURES
+from teiten_store import TeitenStore
+from watcher import Watcher
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """
+    空の保存先(HEADでの確認は常に公開済み)
+    """
+    monkeypatch.setattr(teiten, "check_teiten", lambda *args, **kwargs: True)
+    return TeitenStore(str(tmp_path / "teiten.sqlite3"))
+
+def fixture_table() -> teiten.TeitenTable:
+    with open(os.path.join(FIXTURES, "2023-41-teiten.csv"), "rb") as f:
+        return teiten.parse_teiten(teiten.iter_lines(f))
+
+def test_load_error_keeps_running(store, monkeypatch):
+    calls = []
+    def load(year, week, instrument=None):
+        calls.append((year, week))
+        raise urllib.error.URLError("connection reset")
+    monkeypatch.setattr(store, "load", load)
+    watcher = Watcher(store, lambda table: None, min_interval=0.01, publish_delay=timedelta(0))
+    stop = threading.Event()
+    thread = threading.Thread(target=watcher.run, args=(stop,), daemon=True)
+    thread.start()
+    deadline = time.time() + 5
+    while len(calls) < 3 and time.time() < deadline:
+        time.sleep(0.01)
+    try:
+        assert len(calls) >= 3      # 失敗した後も確認を続けている
+        assert thread.is_alive()
+        assert watcher.misses >= 1
+        assert len(set(calls)) == 1     # 取得できなかった週を再試行している
+    finally:
+        stop.set()
+        thread.join(5)
+    assert not thread.is_alive()
+
+def test_render_error_moves_to_next_week(store, monkeypatch):
+    table = fixture_table()
+    monkeypatch.setattr(store, "load", lambda year, week, instrument=None: table)
+    def on_new(table):
+        raise RuntimeError("render failed")
+    watcher = Watcher(store, on_new, publish_delay=timedelta(0))
+    week = (watcher.year, watcher.week)
+    assert watcher.check() is table
+    assert (watcher.year, watcher.week) != week
+    assert watcher.misses == 0
@@ -0,0 +1,326 @@
+"""
+TopoJSONの変換
+"""
+
+import numpy as np
+from typing import List       # 関数アノテーション用
+
+def decode_arcs(topo:dict) -> List[list]:
+    """
+    arcsを座標のリストに変換(量子化されている場合はtransformで元の座標に戻す)
+    Args:
+        dict:   TopoJSONデータ
+    Returns:
+        list:   arcごとの座標のリスト
+    """
+    transform = topo.get("transform")
+    if not transform:
+        return [[list(p[:2]) for p in arc] for arc in topo["arcs"]]
+    (sx, sy), (tx, ty) = transform["scale"], transform["translate"]
+    arcs = []
+    for arc in topo["arcs"]:
+        x = y = 0
+        coords = []
+        for p in arc:   # 量子化されたarcは前の点からの差分
+            x += p[0]
+            y += p[1]
+            coords.append([x * sx + tx, y * sy + ty])
+        arcs.append(coords)
+    return arcs
+
+def _ring(arcs:List[list], indexes:List[int]) -> list:
+    """
+    arcの番号のリストからリングの座標を作成(負の番号は逆向き、つなぎ目の点は重複させない)
+    """
+    coords = []
+    for i in indexes:
+        arc = arcs[i] if i >= 0 else arcs[~i][::-1]
+        coords.extend(arc if not coords else arc[1:])
+    return coords
+
+def to_geometry(geometry:dict, arcs:List[list]) -> dict:
+    """
+    TopoJSONのgeometryをGeoJSONのgeometryに変換
+    Args:
+        dict:   TopoJSONのgeometry
+        list:   decode_arcsで変換したarcs
+    Returns:
+        dict:   GeoJSONのgeometry
+    """
+    kind = geometry["type"]
+    if kind == "Polygon":
+        coords = [_ring(arcs, ring) for ring in geometry["arcs"]]
+    elif kind == "MultiPolygon":
+        coords = [[_ring(arcs, ring) for ring in polygon] for polygon in geometry["arcs"]]
+    elif kind == "LineString":
+        coords = _ring(arcs, geometry["arcs"])
+    elif kind == "MultiLineString":
+        coords = [_ring(arcs, line) for line in geometry["arcs"]]
+    else:   # Point, MultiPoint はarcsを使わない
+        coords = geometry.get("coordinates")
+    return {"type": kind, "coordinates": coords}
+
+def to_geojson(topo:dict, object_name:str) -> dict:
+    """
+    TopoJSONのオブジェクトをGeoJSONのFeatureCollectionに変換
+    featureのidはgeometriesの順番(0から)
+    Args:
+        dict:   TopoJSONデータ
+        str:    オブジェクト名(例:prefectures)
+    Returns:
+        dict:   GeoJSONデータ
+    """
+    arcs = decode_arcs(topo)
+    features = [{"type": "Feature", "id": str(i)
+                , "properties": d.get("properties", {})
+                , "geometry": to_geometry(d, arcs)}
+                for i, d in enumerate(topo["objects"][object_name]["geometries"])]
+    return {"type": "FeatureCollection", "features": features}
+
+def _simplify_line(coords:np.ndarray, tolerance:float) -> np.ndarray:
+    """
+    Douglas-Peucker法で線を単純化(始点と終点は残す)
+    Args:
+        ndarray:    座標の配列(点の数×2)
+        float:      許容誤差(座標の単位)
+    Returns:
+        ndarray:    単純化した座標の配列
+    """
+    n = len(coords)
+    if n < 3: return coords
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2: continue
+        a, b = coords[first], coords[last]
+        pts = coords[first + 1:last]
+        d = b - a
+        length = np.hypot(d[0], d[1])
+        if length == 0:     # 始点と終点が同じ(閉じた線)の時は点からの距離
+            dist = np.hypot(pts[:, 0] - a[0], pts[:, 1] - a[1])
+        else:               # 線分からの距離
+            dist = np.abs(d[0] * (pts[:, 1] - a[1]) - d[1] * (pts[:, 0] - a[0])) / length
+        i = int(np.argmax(dist))
+        if dist[i] > tolerance:
+            mid = first + 1 + i
+            keep[mid] = True
+            stack.append((first, mid))
+            stack.append((mid, last))
+    return coords[keep]
+
+def simplify(topo:dict, tolerance:float) -> dict:
+    """
+    TopoJSONのarcsを単純化(地域の境界はarcを共有しているので隣の地域と隙間ができない)
+    Args:
+        dict:   TopoJSONデータ
+        float:  許容誤差(度)
+    Returns:
+        dict:   単純化したTopoJSONデータ(量子化なし)
+    """
+    arcs = []
+    for arc in decode_arcs(topo):
+        coords = np.array(arc, dtype=float).reshape(-1, 2)
+        if len(coords) > 3 and np.array_equal(coords[0], coords[-1]):
+            # 閉じたarc(島など)は始点から最も遠い点で2つに分けて単純化(面が潰れないように)
+            k = int(np.argmax(np.hypot(*(coords - coords[0]).T)))
+            coords = np.concatenate([_simplify_line(coords[:k + 1], tolerance)[:-1]
+                                    , _simplify_line(coords[k:], tolerance)])
+        else:
+            coords = _simplify_line(coords, tolerance)
+        arcs.append(coords.tolist())
+    result = {k: v for k, v in topo.items() if k not in ("arcs", "transform")}
+    result["arcs"] = arcs
+    if "transform" in topo:     # Pointの座標も元の座標に戻す
+        result["objects"] = {name: _map_points(obj, lambda p: _untransform(topo["transform"], p))
+                            for name, obj in topo["objects"].items()}
+    return result
+
+def quantize(topo:dict, step:float) -> dict:
+    """
+    TopoJSON(量子化なし)を量子化(座標を整数にして前の点からの差分で持つ)
+    Args:
+        dict:   TopoJSONデータ(量子化なし)
+        float:  量子化の幅(度)
+    Returns:
+        dict:   量子化したTopoJSONデータ
+    """
+    all_points = np.concatenate([np.array(arc, dtype=float).reshape(-1, 2) for arc in topo["arcs"] if arc])
+    x0, y0 = all_points.min(axis=0)
+    arcs = []
+    for arc in topo["arcs"]:
+        q = np.round((np.array(arc, dtype=float).reshape(-1, 2) - (x0, y0)) / step).astype(np.int64)
+        if len(q) > 2:      # 量子化で同じ位置になった連続する点を削除(始点と終点は残す)
+            same = np.zeros(len(q), dtype=bool)
+            same[1:-1] = np.all(q[1:-1] == q[:-2], axis=1)
+            q = q[~same]
+        delta = np.diff(q, axis=0, prepend=np.zeros((1, 2), dtype=np.int64))
+        arcs.append(delta.tolist())
+    transform = {"scale": [step, step], "translate": [float(x0), float(y0)]}
+    result = {k: v for k, v in topo.items() if k not in ("arcs", "transform", "objects")}
+    result["transform"] = transform
+    result["objects"] = {name: _map_points(obj, lambda p: [int(round((p[0] - x0) / step)), int(round((p[1] - y0) / step))])
+                        for name, obj in topo["objects"].items()}
+    result["arcs"] = arcs
+    return result
+
+def _untransform(transform:dict, p:list) -> list:
+    """
+    量子化されたPointの座標を元の座標に戻す
+    """
+    (sx, sy), (tx, ty) = transform["scale"], transform["translate"]
+    return [p[0] * sx + tx, p[1] * sy + ty]
+
+def _map_points(obj:dict, func) -> dict:
+    """
+    オブジェクト内のPoint/MultiPointの座標を変換したコピー(それ以外はそのまま)
+    """
+    if obj.get("type") == "GeometryCollection":
+        return dict(obj, geometries=[_map_points(g, func) for g in obj["geometries"]])
+    if obj.get("type") == "Point":
+        return dict(obj, coordinates=func(obj["coordinates"]))
+    if obj.get("type") == "MultiPoint":
+        return dict(obj, coordinates=[func(p) for p in obj["coordinates"]])
+    return obj
+
+def degrees_per_pixel(zoom:int) -> float:
+    """
+    Webメルカトルのズームレベルで1ピクセルに相当する経度の幅
+    """
+    return 360 / (256 * 2 ** zoom)
+
+def prepare_lod(topo:dict, zoom:int) -> dict:
+    """
+    ズームレベルに合わせて単純化・量子化したTopoJSONを作成
+    許容誤差は0.5ピクセル、量子化の幅はその半分
+    Args:
+        dict:   TopoJSONデータ
+        int:    ズームレベル
+    Returns:
+        dict:   単純化・量子化したTopoJSONデータ
+    """
+    tolerance = degrees_per_pixel(zoom) / 2
+    return quantize(simplify(topo, tolerance), tolerance / 2)
+
+def _polygons(geometry:dict) -> List[list]:
+    """
+    Polygon/MultiPolygonのgeometryからポリゴン(リングのarc番号のリスト)のリストを取得
+    """
+    if geometry.get("type") == "Polygon": return [geometry["arcs"]]
+    if geometry.get("type") == "MultiPolygon": return geometry["arcs"]
+    return []
+
+def _ring_area(coords:np.ndarray) -> float:
+    """
+    リングの面積(符号なし、座標の単位)
+    """
+    x, y = coords[:, 0], coords[:, 1]
+    return abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1))) / 2
+
+def _contains(coords:np.ndarray, point:np.ndarray) -> bool:
+    """
+    点がリングの内側にあるか(レイキャスティング)
+    """
+    x, y = coords[:, 0], coords[:, 1]
+    x2, y2 = np.roll(x, -1), np.roll(y, -1)
+    cross = (y > point[1]) != (y2 > point[1])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        xs = x + (point[1] - y) * (x2 - x) / (y2 - y)
+    return bool(np.count_nonzero(cross & (point[0] < xs)) % 2)
+
+def _stitch(indexes:List[int], arcs:List[list]) -> List[List[int]]:
+    """
+    向き付きのarcを端点でつないでリングにする
+    Args:
+        list:   arcの番号のリスト(負の番号は逆向き)
+        list:   decode_arcsで変換したarcs
+    Returns:
+        list:   リングごとのarcの番号のリスト
+    """
+    def ends(i:int) -> tuple:
+        arc = arcs[i] if i >= 0 else arcs[~i][::-1]
+        return tuple(arc[0]), tuple(arc[-1])
+    starts = {}     # 始点をキーにしたarcの番号
+    for i in indexes:
+        starts.setdefault(ends(i)[0], []).append(i)
+    rings = []
+    for i in indexes:
+        first = ends(i)[0]
+        if i not in starts.get(first, []): continue     # 使用済み
+        ring = []
+        while True:
+            starts[ends(i)[0]].remove(i)
+            ring.append(i)
+            end = ends(i)[1]
+            if end == first or not starts.get(end): break
+            i = starts[end][0]
+        rings.append(ring)
+    return rings
+
+def merge(topo:dict, object_name:str, groups:dict, key:str="N03_001") -> dict:
+    """
+    地域をまとめた形を作成(まとめる地域の間の境界のarcを除いてつなぐ、arcsは元のデータと共有)
+    Args:
+        dict:   TopoJSONデータ
+        str:    まとめる地域のオブジェクト名(例:prefectures)
+        dict:   まとめた地域の名前をキーにした、まとめる地域の名前のリスト
+        str:    地域の名前のプロパティ(まとめた地域の名前も同じプロパティに設定する)
+    Returns:
+        dict:   まとめた地域のGeometryCollection(MultiPolygon)
+    """
+    arcs = decode_arcs(topo)
+    by_name = {g.get("properties", {}).get(key): g for g in topo["objects"][object_name]["geometries"]}
+    geometries = []
+    for name, members in groups.items():
+        indexes = [i for m in members if m in by_name
+                    for polygon in _polygons(by_name[m]) for ring in polygon for i in ring]
+        # 2回使われているarc(まとめる地域どうしの境界)は除く
+        used = {}
+        for i in indexes:
+            used[i if i >= 0 else ~i] = used.get(i if i >= 0 else ~i, 0) + 1
+        rings = _stitch([i for i in indexes if used[i if i >= 0 else ~i] == 1], arcs)
+        # 面積の大きい順に、内側にあるリングは穴、それ以外は外周にする
+        coords = [np.array(_ring(arcs, r), dtype=float) for r in rings]
+        order = sorted(range(len(rings)), key=lambda k: -_ring_area(coords[k]))
+        polygons = []   # (外周の番号, リングのリスト, 穴の番号のリスト)
+        for k in order:
+            outer = next((p for p in reversed(polygons) if _contains(coords[p[0]], coords[k][0])), None)
+            if outer is None or any(_contains(coords[h], coords[k][0]) for h in outer[2]):
+                polygons.append((k, [rings[k]], []))    # 外周(穴の中の島も外周)
+            else:
+                outer[1].append(rings[k])
+                outer[2].append(k)
+        geometries.append({"type": "MultiPolygon", "arcs": [p[1] for p in polygons], "properties": {key: name}})
+    return {"type": "GeometryCollection", "geometries": geometries}
+
+def compact(topo:dict) -> dict:
+    """
+    どのオブジェクトからも使われていないarcを除いたTopoJSON(arcの番号を付け直す)
+    Args:
+        dict:   TopoJSONデータ
+    Returns:
+        dict:   arcを除いたTopoJSONデータ
+    """
+    def walk(arcs, func):   # arcの番号の入れ子のリストに関数を適用
+        return [walk(a, func) if isinstance(a, list) else func(a) for a in arcs]
+    def geometries(obj):
+        if obj.get("type") == "GeometryCollection":
+            for g in obj["geometries"]: yield from geometries(g)
+        elif "arcs" in obj:
+            yield obj
+    used = set()
+    for obj in topo["objects"].values():
+        for g in geometries(obj):
+            walk(g["arcs"], lambda i: used.add(i if i >= 0 else ~i))
+    keep = sorted(used)
+    new = {old: n for n, old in enumerate(keep)}
+    def renumber(obj):
+        if obj.get("type") == "GeometryCollection":
+            return dict(obj, geometries=[renumber(g) for g in obj["geometries"]])
+        if "arcs" in obj:
+            return dict(obj, arcs=walk(obj["arcs"], lambda i: new[i] if i >= 0 else ~new[~i]))
+        return obj
+    result = dict(topo, objects={name: renumber(obj) for name, obj in topo["objects"].items()})
+    result["arcs"] = [topo["arcs"][i] for i in keep]
+    return result
@@ -0,0 +1,170 @@
+"""
+最新週の監視(新しい週報csvが公開された時だけ取得して地図を作成)
+"""
+
+import argparse, http.client, logging, os, threading, urllib.error
+from datetime import date, datetime, timedelta
+from typing import Callable, Optional, Tuple       # 関数アノテーション用
+import classify, teiten
+from teiten_store import TeitenStore
+
+logger = logging.getLogger(__name__)
+
+PUBLISH_DELAY = timedelta(days=8)   # 週の月曜日から公開予定(翌週の火曜日)までの日数
+MIN_INTERVAL = 10 * 60              # 公開予定を過ぎてからの最初の確認間隔(秒)
+MAX_INTERVAL = 6 * 3600             # 確認間隔の上限(秒)
+
+def next_week(year:str, week:str) -> Tuple[str, str]:
+    """
+    次のISO週
+    """
+    return teiten.year_week(date.fromisocalendar(int(year), int(week), 1) + timedelta(days=7))
+
+class Watcher():
+    """
+    次に公開される週の週報csvを監視する
+    公開予定(火曜日)まではHEADも送らずに待ち、過ぎたら間隔を倍にしながらHEADで確認する
+    公開されたら取得して保存し、on_newを呼んで次の週の監視に移る
+    取得や地図作成に失敗しても監視は止めない(取得の失敗は未公開と同じく後で再試行、地図作成の失敗はその週を飛ばす)
+    """
+    def __init__(self, store:TeitenStore, on_new:Callable[[teiten.TeitenTable], None]
+                , min_interval:float=MIN_INTERVAL, max_interval:float=MAX_INTERVAL
+                , publish_delay:timedelta=PUBLISH_DELAY) -> None:
+        """
+        コンストラクタ：監視する週を決める(保存している最新の週の次、保存していない時は公開済みのはずの週)
+        Args:
+            TeitenStore:    保存先
+            Callable:       新しい週のデータを受け取る関数(地図作成など)
+            float:          公開予定を過ぎてからの最初の確認間隔(秒)
+            float:          確認間隔の上限(秒)
+            timedelta:      週の月曜日から公開予定までの時間
+        """
+        self.store = store
+        self.on_new = on_new
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.publish_delay = publish_delay
+        self.misses = 0     # 公開予定を過ぎてから公開されていなかった回数
+        latest = store.latest_week()
+        if latest:
+            self.year, self.week = next_week(*latest)
+        else:
+            self.year, self.week = teiten.year_week(date.today() - publish_delay)
+
+    def due(self) -> datetime:
+        """
+        監視している週の公開予定日時
+        """
+        return datetime.combine(date.fromisocalendar(int(self.year), int(self.week), 1), datetime.min.time()) \
+                + self.publish_delay
+
+    def delay(self, now:Optional[datetime]=None) -> float:
+        """
+        次の確認までの待ち時間
+        Args:
+            datetime:   現在日時(省略時は今)
+        Returns:
+            float:  待ち時間(秒)
+        """
+        now = now or datetime.now()
+        due = self.due()
+        if now < due:   # 公開予定までは確認しない
+            return min((due - now).total_seconds(), self.max_interval)
+        return min(self.min_interval * 2 ** self.misses, self.max_interval)
+
+    def check(self, now:Optional[datetime]=None) -> Optional[teiten.TeitenTable]:
+        """
+        監視している週が公開されたか確認し、公開されていれば取得して次の週に移る
+        Args:
+            datetime:   現在日時(省略時は今)
+        Returns:
+            TeitenTable:    新しい週のデータ(公開されていない時はNone)
+        """
+        now = now or datetime.now()
+        if now < self.due(): return None
+        published = self._published(self.year, self.week)
+        if not published and now >= self.due() + timedelta(days=7) and self._published(*next_week(self.year, self.week)):
+            # 次の週が先に公開された(年末年始などで公開されない週)時はその週を飛ばす
+            logger.info('%s-%s:公開されない週', self.year, self.week)
+            self.year, self.week = next_week(self.year, self.week)
+            published = True
+        if not published:
+            self.misses += 1
+            logger.info('%s-%s:未公開', self.year, self.week)
+            return None
+        try:
+            table = self.store.load(self.year, self.week)
+        except (urllib.error.URLError, http.client.IncompleteRead, OSError) as e:
+            # HEADの後のGETで通信エラーや途中で切れた応答
+            logger.warning('%s-%s:%s', self.year, self.week, e)
+            table = None
+        if table is None:   # 取得できなかったか、HEADとGETの間に取り下げられた
+            self.misses += 1
+            return None
+        logger.info('%s-%s:公開 %s', self.year, self.week, table.title)
+        try:
+            self.on_new(table)
+        except Exception:   # 地図作成の失敗(データは保存済み)
+            logger.exception('%s-%s:地図の作成に失敗', self.year, self.week)
+        self.year, self.week = next_week(self.year, self.week)
+        self.misses = 0
+        return table
+
+    def _published(self, year:str, week:str) -> bool:
+        """
+        週報csvが公開されているか(通信エラーの時は公開されていないとみなす)
+        """
+        try:
+            return teiten.check_teiten(year, week, self.store.base_url)
+        except (urllib.error.URLError, OSError) as e:
+            logger.warning('%s-%s:%s', year, week, e)
+            return False
+
+    def run(self, stop:Optional[threading.Event]=None) -> None:
+        """
+        stopが設定されるまで確認を繰り返す(公開済みの週が続く時は待たずに続けて取得)
+        Args:
+            Event:  終了の指示
+        """
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            if self.check() is not None: continue
+            wait = self.delay()
+            logger.info('次の確認:%s-%s %s', self.year, self.week
+                        , (datetime.now() + timedelta(seconds=wait)).strftime('%m/%d %H:%M'))
+            stop.wait(wait)
+
+if __name__ == '__main__':
+    from Fixed_point_disease import Mapping
+    from renderers import RENDERERS, get_renderer
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    parser = argparse.ArgumentParser(description="新しい週報が公開されたら定点把握疾患の階級区分図を作成")
+    parser.add_argument("--disease", nargs="+", default=[teiten.NAME_COVID, teiten.NAME_FLU]
+                        , help="感染症名(含まれる文字列、複数指定可)")
+    parser.add_argument("--fix-max", type=float, help="最大値を固定にする(データの最大値の方が大きい時はデータの最大値)")
+    parser.add_argument("--out", default="maps", help="出力先フォルダ")
+    parser.add_argument("--renderer", choices=list(RENDERERS), default="template", help="地図の出力方法")
+    parser.add_argument("--scheme", choices=classify.SCHEMES, default=classify.EQUAL, help="階級区分の方法")
+    parser.add_argument("--thresholds", type=float, nargs="+", help="階級区分の境界(--scheme fixedの時)")
+    parser.add_argument("--db", default="cache/teiten.sqlite3", help="週報データのデータベース")
+    args = parser.parse_args()
+    if args.scheme == classify.FIXED and not any(t > 0 for t in args.thresholds or []):
+        parser.error("--scheme fixed には0より大きい --thresholds が必要です")
+
+    store = TeitenStore(args.db)
+    mapping = Mapping(None, store=store)
+    mapping.open_browser = False
+    mapping.renderer = get_renderer(args.renderer)
+    mapping.scheme, mapping.thresholds = args.scheme, args.thresholds
+
+    def render(table:teiten.TeitenTable) -> None:
+        mapping.out_dir = os.path.join(args.out, f"{table.year}-{table.week}")
+        os.makedirs(mapping.out_dir, exist_ok=True)
+        for path in mapping.create_maps(table, args.disease, args.fix_max):
+            logger.info(path)
+
+    try:
+        Watcher(store, render).run()
+    except KeyboardInterrupt:
+        pass